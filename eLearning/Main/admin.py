@@ -37,6 +37,15 @@ class CourseFileAdmin(admin.ModelAdmin):
     list_display = ('course', 'file_name', 'uploaded_at')
     search_fields = ('course__title', 'file_name')
 
+# UploadSession admin to follow unfinished uploads
+class UploadSessionAdmin(admin.ModelAdmin):
+    list_display = ('original_name', 'course', 'uploader', 'received', 'size', 'created_at')
+
+# ChatMessage admin to review chat history
+class ChatMessageAdmin(admin.ModelAdmin):
+    list_display = ('course', 'username', 'message', 'created_at')
+    list_filter = ('course',)
+
 # Register models and their admin classes
 admin.site.register(User, UserAdmin)
 admin.site.register(Category, CategoryAdmin)
@@ -45,4 +54,6 @@ admin.site.register(Enrollment, EnrollmentAdmin)
 admin.site.register(Notification, NotificationAdmin)
 admin.site.register(UserPost, UserPostAdmin)
 admin.site.register(CourseFeedback, CourseFeedbackAdmin)
-admin.site.register(CourseFile, CourseFileAdmin)
\ No newline at end of file
+admin.site.register(CourseFile, CourseFileAdmin)
+admin.site.register(ChatMessage, ChatMessageAdmin)
+admin.site.register(UploadSession, UploadSessionAdmin)
\ No newline at end of file
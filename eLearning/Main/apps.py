@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class MainConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'Main'
+
+    def ready(self):
+        # Connect the model signal receivers.
+        from . import signals
@@ -0,0 +1,37 @@
+from django.conf import settings
+from django.core.cache import cache
+from .models import Category, Course
+from .versions import get_versions
+
+# Tracked names whose changes alter the catalog. 'teacher' moves when a teacher's name changes.
+CATALOG_VERSION_NAMES = ('category', 'course', 'teacher')
+
+# Builds the category/course structure of the catalog page as plain data, in two queries. They go to the primary,
+# since the result is cached under the current version stamps, which a lagging replica may not have caught up with.
+def build_course_catalog():
+    courses_by_category = {}
+    courses = Course.objects.using('default').select_related('teacher').only(
+        'title', 'description', 'category_id', 'teacher__first_name', 'teacher__last_name'
+    ).order_by('pk')
+    for course in courses:
+        courses_by_category.setdefault(course.category_id, []).append({
+            'id': course.id,
+            'title': course.title,
+            'description': course.description,
+            'teacher_name': course.teacher.get_full_name(),
+        })
+    return [
+        {'name': category.name, 'courses': courses_by_category.get(category.id, [])}
+        for category in Category.objects.using('default').order_by('pk')
+    ]
+
+# Returns the catalog from the cache, keyed on the current catalog version so that any change is seen at once.
+# A cache hit costs no database queries.
+def get_course_catalog():
+    versions = get_versions(CATALOG_VERSION_NAMES)
+    key = 'course_catalog:' + '-'.join(str(versions[name]) for name in CATALOG_VERSION_NAMES)
+    catalog = cache.get(key)
+    if catalog is None:
+        catalog = build_course_catalog()
+        cache.set(key, catalog, settings.COURSE_CATALOG_CACHE_TIMEOUT)
+    return catalog
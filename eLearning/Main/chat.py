@@ -0,0 +1,240 @@
+import asyncio
+import json
+import logging
+import uuid
+from collections import Counter, deque
+from time import monotonic
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from .models import ChatMessage
+
+logger = logging.getLogger(__name__)
+
+# Builds the payload sent to chat clients, both live and when replaying a room's history.
+def serialize_chat_message(message):
+    return {
+        'id': message.message_id.hex,
+        'message': message.message,
+        'username': message.username,
+        'user_id': str(message.user_id) if message.user_id else 'Anonymous',
+    }
+
+# Saves chat messages in batches instead of one INSERT per message. A batch is written with a single
+# bulk_create once it holds CHAT_FLUSH_BATCH_SIZE messages, or CHAT_FLUSH_INTERVAL_MS after its first message.
+class ChatWriteBuffer:
+    def __init__(self):
+        self.pending = []
+        self.timer = None
+        self.loop = None
+        # Scheduled flushes, kept referenced until they finish.
+        self.tasks = set()
+
+    async def add(self, message):
+        self.pending.append(message)
+        if len(self.pending) >= settings.CHAT_FLUSH_BATCH_SIZE:
+            # A full batch is written in the background too, so the sender's broadcast never waits for the database.
+            self.start_flush()
+        else:
+            self.schedule_flush()
+
+    def schedule_flush(self):
+        loop = asyncio.get_running_loop()
+        # A timer set on another event loop never fires here, so it is replaced.
+        if self.timer is not None and self.loop is loop:
+            return
+        self.loop = loop
+        self.timer = loop.call_later(settings.CHAT_FLUSH_INTERVAL_MS / 1000, self.start_flush)
+
+    def start_flush(self):
+        task = asyncio.get_running_loop().create_task(self.flush())
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    # Writes everything pending. Errors are logged rather than raised, so one bad message cannot break the room.
+    async def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending = self.pending, []
+        if not batch:
+            return
+        try:
+            await database_sync_to_async(self.save_batch)(batch)
+        except Exception:
+            # Every room shares the batch, and one bad message fails the whole INSERT, so the batch is saved again
+            # a message at a time and only the bad ones are lost.
+            logger.warning('Could not save a batch of %d chat messages, saving them one by one.', len(batch), exc_info=True)
+            await database_sync_to_async(self.save_each)(batch)
+
+    def save_batch(self, batch):
+        with transaction.atomic():
+            ChatMessage.objects.bulk_create(batch)
+
+    def save_each(self, batch):
+        for message in batch:
+            message.pk = None
+            try:
+                with transaction.atomic():
+                    message.save(force_insert=True)
+            except Exception:
+                logger.exception('Could not save chat message %s.', message.message_id)
+
+# Keeps the last CHAT_HISTORY_SIZE messages of each room that has members connected to this process,
+# so joining clients get the history without a query. A room is loaded from the database when its first
+# member here joins, then kept current from the broadcasts its members receive, and dropped when the last one leaves.
+class RecentChatMessages:
+    def __init__(self):
+        self.rooms = {}
+        self.seen = {}
+        self.members = Counter()
+
+    # Registers a member of the room and returns the room's recent messages, oldest first.
+    async def join(self, course_id):
+        self.members[course_id] += 1
+        if course_id not in self.rooms:
+            try:
+                messages = await database_sync_to_async(self.load)(course_id)
+            except BaseException:
+                # The member never joined.
+                self.leave(course_id)
+                raise
+            if course_id not in self.rooms:
+                self.rooms[course_id] = deque(maxlen=settings.CHAT_HISTORY_SIZE)
+                # Ids of recently recorded messages and batches, oldest first.
+                self.seen[course_id] = (set(), deque(maxlen=2 * settings.CHAT_HISTORY_SIZE))
+                for message in messages:
+                    self.record(course_id, message)
+        return list(self.rooms[course_id])
+
+    def load(self, course_id):
+        messages = ChatMessage.objects.filter(course_id=course_id).order_by('-created_at')[:settings.CHAT_HISTORY_SIZE]
+        return [serialize_chat_message(message) for message in reversed(messages)]
+
+    # Unregisters a member. Returns True when it was the room's last member in this process.
+    def leave(self, course_id):
+        self.members[course_id] -= 1
+        if self.members[course_id] > 0:
+            return False
+        del self.members[course_id]
+        self.rooms.pop(course_id, None)
+        self.seen.pop(course_id, None)
+        return True
+
+    # Remembers an id, returning False if it was already recorded.
+    def mark_seen(self, course_id, key):
+        seen, order = self.seen[course_id]
+        if key in seen:
+            return False
+        if len(order) == order.maxlen:
+            seen.discard(order[0])
+        order.append(key)
+        seen.add(key)
+        return True
+
+    # Adds a broadcast message to the room. Every member receives each broadcast, so repeats are ignored.
+    def record(self, course_id, payload):
+        if course_id in self.rooms and self.mark_seen(course_id, payload['id']):
+            self.rooms[course_id].append(payload)
+
+    # Adds a coalesced batch to the room. Only the first member to see the batch decodes it.
+    def record_batch(self, course_id, batch_id, text):
+        if course_id in self.rooms and self.mark_seen(course_id, batch_id):
+            for payload in json.loads(text):
+                self.record(course_id, payload)
+
+# Batches the broadcasts of busy rooms. Instead of one event, one JSON encode and one frame per message
+# for every member, a busy room's messages are gathered for CHAT_COALESCE_WINDOW_MS, encoded once as an
+# array, and forwarded unchanged by every member as a single frame. A room counts as busy when this
+# process holds at least CHAT_COALESCE_MIN_MEMBERS of its members, or its members here sent at least
+# CHAT_COALESCE_MIN_RATE messages in the current second. Both thresholds default to None, which turns
+# batching off.
+class ChatCoalescer:
+    def __init__(self):
+        # Room group name -> messages waiting for the next batch, and the task that sends it.
+        self.pending = {}
+        # Room group name -> (current second, messages sent in it).
+        self.rates = {}
+
+    def is_busy(self, group_name, members):
+        second = int(monotonic())
+        current, count = self.rates.get(group_name, (second, 0))
+        count = count + 1 if current == second else 1
+        self.rates[group_name] = (second, count)
+
+        min_members = settings.CHAT_COALESCE_MIN_MEMBERS
+        min_rate = settings.CHAT_COALESCE_MIN_RATE
+        return (min_members is not None and members >= min_members) or (min_rate is not None and count >= min_rate)
+
+    # Broadcasts a message to the room, either at once or in the room's next batch.
+    async def send(self, channel_layer, group_name, payload, members):
+        busy = self.is_busy(group_name, members)
+        pending = self.pending.get(group_name)
+        # A batch left by an event loop that has since stopped will never be sent, so it is not joined.
+        if pending is not None and pending[1].get_loop() is asyncio.get_running_loop():
+            # Once a batch is open, later messages join it so they cannot overtake it.
+            pending[0].append(payload)
+        elif busy:
+            task = asyncio.create_task(self.send_later(channel_layer, group_name))
+            self.pending[group_name] = ([payload], task)
+        else:
+            await channel_layer.group_send(group_name, {'type': 'chat_message', **payload})
+
+    async def send_later(self, channel_layer, group_name):
+        await asyncio.sleep(settings.CHAT_COALESCE_WINDOW_MS / 1000)
+        payloads, _ = self.pending.pop(group_name)
+        if len(payloads) == 1:
+            await channel_layer.group_send(group_name, {'type': 'chat_message', **payloads[0]})
+        else:
+            await channel_layer.group_send(group_name, {
+                'type': 'chat_batch',
+                'id': uuid.uuid4().hex,
+                'text': json.dumps(payloads),
+            })
+
+# Limits how often one connection may send. The bucket holds up to `burst` tokens and refills at `rate`
+# tokens per second; each message takes one.
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = monotonic()
+
+    def take(self):
+        now = monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+# The connection limits, counted in the cache each time one is hit:
+# too_large - a frame longer than CHAT_MAX_MESSAGE_LENGTH was rejected.
+# rate_limited - a message beyond the CHAT_RATE_LIMIT / CHAT_RATE_BURST token bucket was rejected.
+# invalid - a frame that was not a JSON chat message was rejected.
+# slow_client - a client more than CHAT_OUTBOUND_BUFFER_SIZE bytes or CHAT_SEND_TIMEOUT seconds behind was disconnected.
+CHAT_LIMITS = ('too_large', 'rate_limited', 'invalid', 'slow_client')
+
+def chat_limit_key(limit):
+    return f'chat_limit:{limit}'
+
+async def count_chat_limit(limit):
+    key = chat_limit_key(limit)
+    if not await cache.aadd(key, 1, None):
+        await cache.aincr(key)
+
+# Returns how often each limit has been hit, across all processes sharing the cache.
+def get_chat_limit_counts():
+    counts = cache.get_many([chat_limit_key(limit) for limit in CHAT_LIMITS])
+    return {limit: counts.get(chat_limit_key(limit), 0) for limit in CHAT_LIMITS}
+
+def reset_chat_limit_counts():
+    cache.delete_many([chat_limit_key(limit) for limit in CHAT_LIMITS])
+
+# Shared by all chat connections in this process.
+write_buffer = ChatWriteBuffer()
+recent_messages = RecentChatMessages()
+coalescer = ChatCoalescer()
@@ -1,15 +1,31 @@
+import asyncio
 import json
+from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from .notifications import notification_group_name
+from .feed import FEED_GROUP_NAME
+from .chat import TokenBucket, coalescer, count_chat_limit, recent_messages, serialize_chat_message, write_buffer
+from .models import ChatMessage, Course, has_course_access
 
 User = get_user_model()
 
+# Close code sent to clients that fall too far behind. Clients reconnect and get the recent history.
+SLOW_CLIENT_CLOSE_CODE = 1013
+
 # Defines a WebSocket consumer for handling real-time chat functionality.
 class ChatConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         # Extracts the course_id from the URL route and constructs a unique group name.
         self.room_name = self.scope['url_route']['kwargs']['course_id']
         self.room_group_name = f'chat_{self.room_name}'
+        self.course_id = int(self.room_name)
+
+        # Only the course's teacher and enrolled students may join its room.
+        if not await self.may_join():
+            await self.close()
+            return
 
         # Asynchronously adds the current channel to the group
         await self.channel_layer.group_add(
@@ -20,45 +36,224 @@ class ChatConsumer(AsyncWebsocketConsumer):
         # Accepts the WebSocket connection.
         await self.accept()
 
+        # Frames to the client go through a queue, whose size in bytes together with what the server has buffered
+        # for the client is limited, so a slow client cannot build an unlimited backlog.
+        self.bucket = TokenBucket(settings.CHAT_RATE_LIMIT, settings.CHAT_RATE_BURST)
+        self.outbox = asyncio.Queue()
+        self.queued_bytes = 0
+        self.closing = False
+        self.replayed = None
+        self.joined = False
+        self.writer = asyncio.create_task(self.write_frames())
+
+        # Replays the room's recent messages, oldest first, as a single batch. A consumer that raises is not sent
+        # a disconnect, so it cleans up after itself.
+        try:
+            history = await recent_messages.join(self.course_id)
+        except BaseException:
+            await self.disconnect(None)
+            raise
+        self.joined = True
+        # Messages broadcast while the history was loading may be in it too. They are not sent again.
+        self.replayed = {payload['id'] for payload in history}
+        if history:
+            await self.send_frame(json.dumps(history))
+
+    # Returns True if the user is signed in and may see the course, which must still exist.
+    @database_sync_to_async
+    def may_join(self):
+        user = self.scope['user']
+        if not user.is_authenticated:
+            return False
+        course = Course.objects.only('teacher_id').filter(pk=self.course_id).first()
+        return course is not None and has_course_access(user, course)
+
     async def disconnect(self, close_code):
+        # Connections refused in connect were never set up.
+        if not hasattr(self, 'writer'):
+            return
+
         # Asynchronously removes the channel from the group upon disconnecting.
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
         )
 
+        # Undoes as much of connect as was done, which is all of it unless it failed part way.
+        self.writer.cancel()
+
+        # Saves pending messages once the room has no members left in this process.
+        if self.joined and recent_messages.leave(self.course_id):
+            await write_buffer.flush()
+
     # Handles receiving messages from WebSocket clients.
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
+        # Checks the cheap limits before decoding anything.
+        if text_data is None:
+            await self.reject('invalid')
+            return
+        if len(text_data) > settings.CHAT_MAX_MESSAGE_LENGTH:
+            await self.reject('too_large')
+            return
+        if not self.bucket.take():
+            await self.reject('rate_limited')
+            return
+
         # Deserializes the text data into JSON.
-        text_data_json = json.loads(text_data)
-        message = text_data_json['message']
+        try:
+            message = json.loads(text_data)['message']
+        except (ValueError, TypeError, KeyError):
+            message = None
+        if not isinstance(message, str):
+            await self.reject('invalid')
+            return
         
-        # Retrieves the username of the sender, defaulting to 'Anonymous' if unauthenticated.
+        # Only signed-in members get this far, so every message has its sender.
         user = self.scope["user"]
-        username = user.get_username() if user.is_authenticated else 'Anonymous'
-        user_id = str(user.id) if user.is_authenticated else 'Anonymous'        
 
-        # Sends the message to the group, including the sender's username and ID.
-        await self.channel_layer.group_send(
+        # Queues the message for saving; the broadcast does not wait for the database.
+        chat_message = ChatMessage(
+            course_id=self.course_id,
+            user_id=user.id,
+            username=user.get_username(),
+            message=message,
+        )
+        await write_buffer.add(chat_message)
+
+        # Sends the message to the group, including the sender's username and ID. Busy rooms batch it.
+        await coalescer.send(
+            self.channel_layer,
             self.room_group_name,
-            {
-                'type': 'chat_message',
-                'message': message,
-                'username': username,
-                'user_id': str(user_id),    # Include the username in the event
-            }
+            serialize_chat_message(chat_message),
+            recent_messages.members[self.course_id],
         )
 
+    # Tells the sender why their frame was dropped, and counts the limit.
+    async def reject(self, limit):
+        await count_chat_limit(limit)
+        await self.send_frame(json.dumps({'error': limit}))
+
+    # Queues a frame for the client. A client with more than CHAT_OUTBOUND_BUFFER_SIZE bytes waiting, in the queue
+    # or in the server's buffer for its socket, is too slow to keep up and is disconnected.
+    async def send_frame(self, text):
+        if self.closing:
+            return
+        pending_send_bytes = self.scope.get('pending_send_bytes')
+        waiting = self.queued_bytes + len(text) + (pending_send_bytes() if pending_send_bytes else 0)
+        if waiting > settings.CHAT_OUTBOUND_BUFFER_SIZE:
+            self.writer.cancel()
+            await self.drop_slow_client()
+            return
+        self.queued_bytes += len(text)
+        self.outbox.put_nowait(text)
+
+    # Sends queued frames one at a time, as fast as the server takes them. A frame the server has not taken
+    # within CHAT_SEND_TIMEOUT seconds means the client stopped reading.
+    async def write_frames(self):
+        while True:
+            text = await self.outbox.get()
+            self.queued_bytes -= len(text)
+            try:
+                await asyncio.wait_for(self.send(text_data=text), settings.CHAT_SEND_TIMEOUT)
+            except asyncio.TimeoutError:
+                await self.drop_slow_client()
+                return
+
+    # Disconnects a client that cannot keep up. It reconnects and gets the recent history.
+    async def drop_slow_client(self):
+        self.closing = True
+        await count_chat_limit('slow_client')
+        await self.close(code=SLOW_CLIENT_CLOSE_CODE)
+
     # Handles messages sent to the group from any user's channel.
     async def chat_message(self, event):
-        # Extracts message content and sender details from the event.
-        message = event['message']
-        username = event.get('username', 'Anonymous')  # Fallback to 'Anonymous' if username is not provided.
-        user_id = event['user_id']
+        payload = {
+            'id': event['id'],
+            'message': event['message'],
+            'username': event.get('username', 'Anonymous'),  # Fallback to 'Anonymous' if username is not provided.
+            'user_id': event['user_id'],
+        }
+        recent_messages.record(self.course_id, payload)
+        if self.is_replayed([payload]):
+            return
 
         # Sends the message data to the WebSocket client, including the sender's username.
+        await self.send_frame(json.dumps(payload))
+
+    # Handles a busy room's batch of messages, which was encoded once as an array for every member.
+    async def chat_batch(self, event):
+        recent_messages.record_batch(self.course_id, event['id'], event['text'])
+        text = event['text']
+        if self.replayed:
+            replayed = self.replayed
+            payloads = json.loads(text)
+            if self.is_replayed(payloads):
+                return
+            text = json.dumps([payload for payload in payloads if payload['id'] not in replayed])
+        await self.send_frame(text)
+
+    # Returns True if all the messages were already in the replayed history. Broadcasts arrive in order,
+    # so once one is not, none of the later ones are and the check stops.
+    def is_replayed(self, payloads):
+        if not self.replayed:
+            return False
+        if all(payload['id'] in self.replayed for payload in payloads):
+            return True
+        if payloads[-1]['id'] not in self.replayed:
+            self.replayed = None
+        return False
+
+# Defines a WebSocket consumer that pushes a user's notifications as they are created.
+class NotificationConsumer(AsyncWebsocketConsumer):
+    async def connect(self):
+        # Only authenticated users have a notification channel.
+        user = self.scope["user"]
+        if not user.is_authenticated:
+            await self.close()
+            return
+
+        # Each user listens on their own group.
+        self.group_name = notification_group_name(user.id)
+        await self.channel_layer.group_add(
+            self.group_name,
+            self.channel_name
+        )
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        # Removes the channel from the user's group, if it was ever added.
+        if hasattr(self, 'group_name'):
+            await self.channel_layer.group_discard(
+                self.group_name,
+                self.channel_name
+            )
+
+    # Handles notifications sent to the user's group.
+    async def notification_message(self, event):
         await self.send(text_data=json.dumps({
-            'message': message,
-            'username': username,
-            'user_id': user_id,
+            'notification': event['notification'],
         }))
+
+# Defines a WebSocket consumer that streams new status updates to the profile feed.
+class UserPostFeedConsumer(AsyncWebsocketConsumer):
+    async def connect(self):
+        # Only authenticated users can follow the feed.
+        if not self.scope["user"].is_authenticated:
+            await self.close()
+            return
+
+        await self.channel_layer.group_add(
+            FEED_GROUP_NAME,
+            self.channel_name
+        )
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        await self.channel_layer.group_discard(
+            FEED_GROUP_NAME,
+            self.channel_name
+        )
+
+    # Forwards a post that was already encoded once for all viewers.
+    async def user_post_message(self, event):
+        await self.send(text_data=event['text'])
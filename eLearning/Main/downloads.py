@@ -0,0 +1,226 @@
+import logging
+import mimetypes
+import os
+import posixpath
+import re
+import zipfile
+from urllib.parse import quote
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from django.views.static import serve
+
+logger = logging.getLogger(__name__)
+
+# A single byte range. Requests for several ranges at once are answered with the whole file.
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+# Size of the blocks read when a byte range has to be streamed by Django.
+STREAM_BLOCK_SIZE = 64 * 1024
+
+# Returns the (first, last) byte positions requested by a Range header, None to send the whole file,
+# or False if the range starts beyond the end of the file.
+def parse_range(header, size):
+    match = RANGE_RE.match(header.replace(' ', ''))
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first:
+        first = int(first)
+        if last and int(last) < first:
+            # Invalid ranges are ignored.
+            return None
+        if first >= size:
+            return False
+        last = min(int(last), size - 1) if last else size - 1
+    else:
+        # A suffix range: the last N bytes.
+        if int(last) == 0 or size == 0:
+            return False
+        first, last = max(size - int(last), 0), size - 1
+    return first, last
+
+# Validators for a stored file, from its size and modification time.
+def file_validators(storage, name):
+    size = storage.size(name)
+    modified = storage.get_modified_time(name)
+    etag = quote_etag(f'{size:x}-{int(modified.timestamp() * 1_000_000):x}')
+    return size, etag, int(modified.timestamp())
+
+# Reads bytes first to last of an open file, a block at a time.
+def read_range(f, first, last):
+    f.seek(first)
+    remaining = last - first + 1
+    while remaining > 0:
+        block = f.read(min(STREAM_BLOCK_SIZE, remaining))
+        if not block:
+            break
+        remaining -= len(block)
+        yield block
+
+# Top-level directory of MEDIA_ROOT that holds course files.
+COURSE_FILES_DIRECTORY = 'course_files'
+
+# Serves MEDIA_ROOT during development, except course files, which are only sent by the access-checked download
+# view. The path is normalized first, as serve() does, so '..' cannot reach them either.
+def serve_public_media(request, path, document_root=None, show_indexes=False):
+    if posixpath.normpath(path).lstrip('/').split('/')[0] == COURSE_FILES_DIRECTORY:
+        raise Http404('Course files are only available through their download link.')
+    return serve(request, path, document_root=document_root, show_indexes=show_indexes)
+
+# Serves a stored course file. Conditional requests are answered with 304 and single byte ranges with 206.
+# With COURSE_FILE_SERVE_MODE set, the front proxy is told to send the file itself; otherwise whole files and
+# ranges that run to the end of the file are handed to the server's wsgi.file_wrapper, which sends them with
+# sendfile() where the server supports it.
+def serve_course_file(request, course_file):
+    storage, name = course_file.file.storage, course_file.file.name
+    size, etag, last_modified = file_validators(storage, name)
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        mode = settings.COURSE_FILE_SERVE_MODE
+        if mode == 'x-accel-redirect':
+            response = offloaded_response(course_file, 'X-Accel-Redirect', settings.COURSE_FILE_ACCEL_PREFIX + quote(name))
+        elif mode == 'x-sendfile':
+            response = offloaded_response(course_file, 'X-Sendfile', storage.path(name))
+        else:
+            response = file_response(request, course_file, size, etag, last_modified)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    # Access depends on the user, so only the user's own browser may keep the file, revalidating on every use.
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+# Hands the transfer to the front proxy, which also answers range requests.
+def offloaded_response(course_file, header, location):
+    response = HttpResponse(content_type=guess_content_type(course_file.file.name))
+    response['Content-Disposition'] = content_disposition(download_name(course_file))
+    response[header] = location
+    return response
+
+def file_response(request, course_file, size, etag, last_modified):
+    byte_range = None
+    if 'HTTP_RANGE' in request.META and range_applies(request, etag, last_modified):
+        byte_range = parse_range(request.META['HTTP_RANGE'], size)
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    # FileResponse sets the type, disposition and length from the open file, counting from its position.
+    f = course_file.file.storage.open(course_file.file.name, 'rb')
+    if byte_range is None:
+        response = FileResponse(f, filename=download_name(course_file))
+    else:
+        first, last = byte_range
+        f.seek(first)
+        response = FileResponse(f, status=206, filename=download_name(course_file))
+        response['Content-Range'] = f'bytes {first}-{last}/{size}'
+        if last != size - 1:
+            # A file wrapper would send to the end of the file, so ranges that stop short are streamed instead.
+            response['Content-Length'] = last - first + 1
+            response.streaming_content = read_range(f, first, last)
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+# A Range sent with If-Range only applies if the file has not changed since the client's copy.
+def range_applies(request, etag, last_modified):
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        return if_range == etag
+    return if_range == http_date(last_modified)
+
+def guess_content_type(name):
+    return mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+# Name offered to the browser: the file's display name, with the stored file's extension. Stored names are
+# content hashes, which mean nothing to users.
+def download_name(course_file):
+    extension = os.path.splitext(course_file.file.name)[1]
+    name = course_file.file_name or os.path.basename(course_file.file.name)
+    return name if name.lower().endswith(extension.lower()) else name + extension
+
+def content_disposition(name, disposition='inline'):
+    return f"{disposition}; filename*=UTF-8''{quote(name)}"
+
+# Extensions of formats that are compressed already. They are stored in archives as they are, since deflating
+# them again costs CPU for next to no gain.
+COMPRESSED_EXTENSIONS = frozenset({
+    '.7z', '.bz2', '.gz', '.rar', '.xz', '.zip',
+    '.docx', '.epub', '.odp', '.ods', '.odt', '.pdf', '.pptx', '.xlsx',
+    '.gif', '.heic', '.jpeg', '.jpg', '.png', '.webp',
+    '.aac', '.avi', '.m4a', '.m4v', '.mkv', '.mov', '.mp3', '.mp4', '.ogg', '.webm',
+})
+
+# A write-only file that hands over whatever has been written to it, so a ZipFile can write into a generator.
+# ZipFile cannot seek in it, so each entry's sizes and checksum follow its data instead of preceding it.
+class ArchiveBuffer:
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+# Sends all of a course's files as one ZIP archive, built while it is sent.
+def serve_course_archive(course):
+    files = course.files.order_by('uploaded_at', 'id').iterator()
+    response = StreamingHttpResponse(stream_archive(files), content_type='application/zip')
+    response['Content-Disposition'] = content_disposition(safe_name(f'{course.title}.zip'), 'attachment')
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+# Yields a ZIP archive of the course files, a block at a time. Only one block of one file is held in memory at
+# once, however many files there are.
+def stream_archive(course_files):
+    buffer = ArchiveBuffer()
+    names = set()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for course_file in course_files:
+            storage, name = course_file.file.storage, course_file.file.name
+            try:
+                f = storage.open(name, 'rb')
+            except FileNotFoundError:
+                # One missing file should not cut every other file off the archive.
+                logger.warning('Course file %s is missing and was left out of the archive', name)
+                continue
+            with f:
+                info = zipfile.ZipInfo(archive_name(course_file, names), timezone.localtime(course_file.uploaded_at).timetuple()[:6])
+                stored = os.path.splitext(name)[1].lower() in COMPRESSED_EXTENSIONS
+                info.compress_type = zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED
+                # Telling ZipFile the size lets it decide up front whether the entry needs ZIP64 sizes.
+                info.file_size = storage.size(name)
+                with archive.open(info, 'w') as entry:
+                    for block in iter(lambda: f.read(STREAM_BLOCK_SIZE), b''):
+                        entry.write(block)
+                        data = buffer.take()
+                        if data:
+                            yield data
+            yield buffer.take()
+    yield buffer.take()
+
+# Name of a file in the archive: its download name, numbered if an earlier file already has it.
+def archive_name(course_file, names):
+    stem, extension = os.path.splitext(safe_name(download_name(course_file)))
+    name, number = stem + extension, 1
+    while name.lower() in names:
+        number += 1
+        name = f'{stem} ({number}){extension}'
+    names.add(name.lower())
+    return name
+
+# Keeps a name from being read as a path.
+def safe_name(name):
+    return name.replace('/', '_').replace('\\', '_')
@@ -0,0 +1,27 @@
+import json
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from .serializers import UserPostSerializer
+
+# Channel group that every open status feed listens on.
+FEED_GROUP_NAME = 'user_post_feed'
+
+# Sends an encoded post to every feed listener.
+def send_to_feed(text):
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    async_to_sync(channel_layer.group_send)(
+        FEED_GROUP_NAME,
+        {
+            'type': 'user_post_message',
+            'text': text,
+        }
+    )
+
+# Broadcasts a new post once its transaction commits. The post is serialized and JSON-encoded once here,
+# and consumers forward the same text to each viewer. Photo URLs are relative so they suit any viewer.
+def broadcast_user_post(post):
+    text = json.dumps({'post': UserPostSerializer(post).data})
+    transaction.on_commit(lambda: send_to_feed(text), robust=True)
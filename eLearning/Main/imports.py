@@ -0,0 +1,88 @@
+import os
+import posixpath
+import uuid
+import zipfile
+import zlib
+from django.conf import settings
+from django.core.files import File
+from django.core.files.move import file_move_safe
+from django.db import transaction
+from .models import CourseFile
+
+# Files at least this large must not be compressed more than COURSE_IMPORT_MAX_RATIO times. Smaller files
+# cannot do harm however well they compress.
+RATIO_CHECK_MIN_SIZE = 1024 * 1024
+
+# Raised for archives that cannot be imported. The message is shown to the teacher.
+class ArchiveImportError(Exception):
+    pass
+
+# Path an archive waiting to be imported is kept at.
+def archive_path(archive_id):
+    return os.path.join(settings.COURSE_IMPORT_DIR, f'{archive_id}.zip')
+
+# Keeps an uploaded archive until a worker imports it, moving it rather than copying it where the upload is
+# already on disk. Returns the path it was kept at.
+def keep_archive(upload):
+    if upload.size > settings.COURSE_UPLOAD_MAX_SIZE:
+        raise ArchiveImportError(f'Archives must be at most {settings.COURSE_UPLOAD_MAX_SIZE} bytes.')
+    if not zipfile.is_zipfile(upload):
+        raise ArchiveImportError('The file is not a ZIP archive.')
+    os.makedirs(settings.COURSE_IMPORT_DIR, exist_ok=True)
+    path = archive_path(uuid.uuid4())
+    if hasattr(upload, 'temporary_file_path'):
+        file_move_safe(upload.temporary_file_path(), path)
+    else:
+        with open(path, 'wb') as f:
+            for chunk in upload.chunks():
+                f.write(chunk)
+    return path
+
+# Display name of an archived file: its path in the archive, without the extension.
+def archive_file_name(member_name):
+    return posixpath.splitext(member_name)[0][:CourseFile._meta.get_field('file_name').max_length]
+
+# Files of an archive worth importing, leaving out folders and the hidden files that archivers add.
+def archive_members(archive):
+    return [
+        member for member in archive.infolist()
+        if not member.is_dir() and not any(part.startswith(('.', '__MACOSX')) for part in member.filename.split('/'))
+    ]
+
+# Refuses archives that would extract to too many files or too many bytes. The sizes checked are the ones the
+# archive declares; zipfile never extracts more than a file's declared size, and fails on a file whose content
+# does not match its checksum.
+def check_archive(members):
+    if not members:
+        raise ArchiveImportError('The archive contains no files.')
+    if len(members) > settings.COURSE_IMPORT_MAX_FILES:
+        raise ArchiveImportError(f'Archives may contain at most {settings.COURSE_IMPORT_MAX_FILES} files.')
+    if sum(member.file_size for member in members) > settings.COURSE_IMPORT_MAX_SIZE:
+        raise ArchiveImportError(f'Archives may contain at most {settings.COURSE_IMPORT_MAX_SIZE} bytes once extracted.')
+    for member in members:
+        if member.file_size >= RATIO_CHECK_MIN_SIZE and member.file_size > member.compress_size * settings.COURSE_IMPORT_MAX_RATIO:
+            raise ArchiveImportError(f'{member.filename} is compressed too well to be a real file.')
+
+# Adds every file in the archive at `path` to the course, streaming each one from the archive into storage.
+# Returns the new course files. Nothing is added if any file cannot be read.
+def import_archive(course, path):
+    field = CourseFile._meta.get_field('file')
+    saved = []
+    try:
+        with zipfile.ZipFile(path) as archive, transaction.atomic():
+            members = archive_members(archive)
+            check_archive(members)
+            course_files = []
+            for member in members:
+                basename = posixpath.basename(member.filename)
+                with archive.open(member) as f:
+                    name = field.storage.save(field.generate_filename(None, basename), File(f, name=basename), max_length=field.max_length)
+                saved.append(name)
+                course_files.append(CourseFile(course=course, file=name, file_name=archive_file_name(member.filename)))
+            return CourseFile.objects.bulk_create(course_files)
+    except (zipfile.BadZipFile, zlib.error, NotImplementedError, RuntimeError, EOFError) as e:
+        # Damaged archives, and ones that are encrypted or use a compression method zipfile does not support.
+        # The references to files stored so far were rolled back, so copies no other file uses are deleted.
+        for name in saved:
+            field.storage.delete_unreferenced(name)
+        raise ArchiveImportError(f'The archive could not be read: {e}')
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from Main.chat import get_chat_limit_counts, reset_chat_limit_counts
+
+# Shows how often the chat connection limits have been hit.
+class Command(BaseCommand):
+    help = 'Shows how often each chat connection limit has been hit.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Resets the counts to zero after showing them.')
+
+    def handle(self, *args, **options):
+        for limit, count in get_chat_limit_counts().items():
+            self.stdout.write(f'{limit}: {count}')
+        if options['reset']:
+            reset_chat_limit_counts()
+            self.stdout.write(self.style.SUCCESS('Reset the chat limit counts.'))
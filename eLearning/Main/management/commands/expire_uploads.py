@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from Main.uploads import expire_uploads
+
+# Deletes unfinished chunked uploads that have expired, with their partial files.
+class Command(BaseCommand):
+    help = 'Deletes chunked course file uploads left unfinished for longer than COURSE_UPLOAD_EXPIRY_HOURS.'
+
+    def handle(self, *args, **options):
+        count = expire_uploads()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {count} expired uploads.'))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from Main import search
+
+# Rebuilds the people search index from the user table.
+class Command(BaseCommand):
+    help = 'Rebuilds the people search index used by live search.'
+
+    def handle(self, *args, **options):
+        search.rebuild_index()
+        self.stdout.write(self.style.SUCCESS('Rebuilt the people search index.'))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, Q
+from Main.models import User
+
+# Rebuilds every user's unread notification counter from the Notification table.
+class Command(BaseCommand):
+    help = 'Rebuilds the unread notification counters from the Notification table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of counters written per UPDATE batch.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        # Only users whose stored counter disagrees with the table need to be written.
+        drifted = User.objects.annotate(
+            actual=Count('notifications', filter=Q(notifications__read=False))
+        ).exclude(unread_notification_count=F('actual')).only('id', 'unread_notification_count')
+
+        # Walk the drifted users in primary key order, one batch per UPDATE.
+        fixed = 0
+        last_pk = 0
+        while True:
+            batch = list(drifted.filter(pk__gt=last_pk).order_by('pk')[:batch_size])
+            if not batch:
+                break
+            for user in batch:
+                user.unread_notification_count = user.actual
+            fixed += User.objects.bulk_update(batch, ['unread_notification_count'])
+            last_pk = batch[-1].pk
+
+        self.stdout.write(self.style.SUCCESS(f'Reconciled {fixed} unread notification counter(s).'))
@@ -0,0 +1,30 @@
+import random
+from django.conf import settings
+from .routers import RequestRouting, request_routing
+
+# Cookie marking a client that wrote recently, whose requests read from the primary.
+PIN_COOKIE = 'db_primary'
+
+# Routes each request's reads to a read replica, unless the request could miss its client's own writes: requests
+# with unsafe methods, and requests from a client that wrote in the last REPLICA_PIN_SECONDS (replication lag),
+# read from the primary. A request that writes reads from the primary from then on, and pins its client.
+class ReplicaRoutingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+
+        routing = RequestRouting(
+            random.choice(settings.DATABASE_REPLICAS),
+            pinned=request.method not in ('GET', 'HEAD', 'OPTIONS') or PIN_COOKIE in request.COOKIES,
+        )
+        token = request_routing.set(routing)
+        try:
+            response = self.get_response(request)
+        finally:
+            request_routing.reset(token)
+        if routing.wrote:
+            response.set_cookie(PIN_COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS, httponly=True, samesite='Lax')
+        return response
@@ -0,0 +1,28 @@
+# Generated by Django 5.0.2 on 2026-10-18 18:58
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def populate_unread_notification_count(apps, schema_editor):
+    # Seed the new counter from the existing unread notifications.
+    User = apps.get_model('Main', 'User')
+    users = User.objects.annotate(unread=Count('notifications', filter=Q(notifications__read=False))).filter(unread__gt=0)
+    for user in users.iterator():
+        User.objects.filter(pk=user.pk).update(unread_notification_count=user.unread)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Main', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='unread_notification_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_unread_notification_count, migrations.RunPython.noop),
+    ]
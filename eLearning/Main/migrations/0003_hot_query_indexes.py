@@ -0,0 +1,39 @@
+# Generated by Django 5.0.2 on 2026-10-18 18:59
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def remove_duplicate_enrollments(apps, schema_editor):
+    # Keep the earliest enrollment of each (student, course) pair so the unique constraint can be added.
+    Enrollment = apps.get_model('Main', 'Enrollment')
+    duplicates = Enrollment.objects.values('student', 'course').annotate(first_id=Min('id'), total=Count('id')).filter(total__gt=1)
+    for duplicate in duplicates:
+        Enrollment.objects.filter(student=duplicate['student'], course=duplicate['course']).exclude(id=duplicate['first_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Main', '0002_user_unread_notification_count'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='coursefeedback',
+            index=models.Index(fields=['course', '-created_at'], name='feedback_course_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(condition=models.Q(('read', False)), fields=['recipient', '-created_at'], name='notification_unread_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userpost',
+            index=models.Index(fields=['-created_at'], name='userpost_created_idx'),
+        ),
+        migrations.RunPython(remove_duplicate_enrollments, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='enrollment',
+            constraint=models.UniqueConstraint(fields=('student', 'course'), name='unique_enrollment'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.0.2 on 2026-10-18 19:10
+
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    # SQLite gets an FTS5 table kept in sync by signals; PostgreSQL gets a GIN expression index it maintains itself.
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE main_user_search USING fts5("
+            "first_name, last_name, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+        )
+        schema_editor.execute(
+            'INSERT INTO main_user_search (rowid, first_name, last_name) '
+            'SELECT id, first_name, last_name FROM "Main_user"'
+        )
+    elif vendor == 'postgresql':
+        schema_editor.execute(
+            'CREATE INDEX main_user_name_search_idx ON "Main_user" USING gin ('
+            "to_tsvector('simple', coalesce(first_name, '') || ' ' || coalesce(last_name, '')))"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS main_user_search')
+    elif vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS main_user_name_search_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Main', '0003_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
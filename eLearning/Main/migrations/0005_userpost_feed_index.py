@@ -0,0 +1,21 @@
+# Generated by Django 5.0.2 on 2026-10-18 19:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Main', '0004_user_search_index'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='userpost',
+            name='userpost_created_idx',
+        ),
+        migrations.AddIndex(
+            model_name='userpost',
+            index=models.Index(fields=['-created_at', '-id'], name='userpost_feed_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.0.2 on 2026-10-18 19:31
+
+import Main.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Main', '0007_uploadsession'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContentBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('size', models.PositiveBigIntegerField()),
+                ('references', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='coursefile',
+            name='file',
+            field=models.FileField(storage=Main.storage.get_course_file_storage, upload_to='course_files/'),
+        ),
+    ]
@@ -1,6 +1,11 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
 from django.core.exceptions import ValidationError
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+import uuid
+from .storage import get_course_file_storage
 
 # Custom User model extending Django's AbstractUser. Adds role, real name, date of birth, bio, and profile photo fields.
 class User(AbstractUser):
@@ -14,6 +19,8 @@ class User(AbstractUser):
     dob = models.DateField(verbose_name='Date of Birth', null=True, blank=True)
     bio = models.TextField(null=True, blank=True)
     photo = models.ImageField(upload_to='images/', blank=True, null=True, default='images/default.jpg')
+    # Maintained count of unread notifications, so page renders do not need to COUNT(*) the table.
+    unread_notification_count = models.PositiveIntegerField(default=0, editable=False)
 
     def clean(self):
         # Validate that non-superusers must have a role.
@@ -27,9 +34,18 @@ class User(AbstractUser):
         super().save(*args, **kwargs)
 
     def get_unread_notifications(self):
-        # Helper method to get unread notifications for the user.
+        # Helper method to get unread notifications for the user, skipping the query when none are unread.
+        if not self.unread_notification_count:
+            return self.notifications.none()
         return self.notifications.filter(read=False)
 
+    @classmethod
+    def change_unread_notification_count(cls, user_ids, delta):
+        # Adjusts the unread notification counter of the given users in one UPDATE, never going below zero.
+        cls.objects.filter(pk__in=user_ids).update(
+            unread_notification_count=Greatest(F('unread_notification_count') + delta, 0)
+        )
+
 # Model to represent categories for courses
 class Category(models.Model):
     name = models.CharField(max_length=200)
@@ -55,7 +71,7 @@ class Course(models.Model):
 # Represents files associated with a course.   
 class CourseFile(models.Model):
     course = models.ForeignKey(Course, related_name='files', on_delete=models.CASCADE)
-    file = models.FileField(upload_to='course_files/')
+    file = models.FileField(upload_to='course_files/', storage=get_course_file_storage)
     file_name = models.CharField(max_length=255)
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
@@ -63,6 +79,36 @@ class CourseFile(models.Model):
         # String representation of the file.
         return f"{self.file.name} for {self.course.title}"
 
+# Counts the course files sharing one stored copy of identical content.
+class ContentBlob(models.Model):
+    name = models.CharField(max_length=255, unique=True)
+    size = models.PositiveBigIntegerField()
+    references = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        # String representation of the stored copy.
+        return f"{self.name} ({self.references} references)"
+
+# Tracks a course file being uploaded in fixed-size chunks, until it is assembled into a CourseFile.
+class UploadSession(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    course = models.ForeignKey(Course, related_name='upload_sessions', on_delete=models.CASCADE)
+    uploader = models.ForeignKey(User, on_delete=models.CASCADE)
+    file_name = models.CharField(max_length=255)
+    original_name = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    chunk_size = models.PositiveIntegerField()
+    # Optional SHA-256 of the whole file, checked once it is assembled.
+    checksum = models.CharField(max_length=64, blank=True)
+    # Bytes received so far. Chunks are written in order, so this is also where the next one starts.
+    received = models.PositiveBigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        # String representation of the upload.
+        return f"Upload of {self.original_name} for {self.course_id} ({self.received}/{self.size} bytes)"
+
 # Represents feedback left for a course.
 class CourseFeedback(models.Model):
     course = models.ForeignKey(Course, related_name='feedback', on_delete=models.CASCADE)
@@ -70,6 +116,12 @@ class CourseFeedback(models.Model):
     content = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Serves a course's feedback list, newest first.
+            models.Index(fields=['course', '-created_at'], name='feedback_course_created_idx'),
+        ]
+
     def __str__(self):
         # String representation of the feedback.
         return f"Feedback by {self.user.get_full_name()} on {self.created_at.strftime('%Y-%m-%d %H:%M:%S')}"
@@ -80,16 +132,32 @@ class Enrollment(models.Model):
     course = models.ForeignKey(Course, on_delete=models.CASCADE)
     enrolled_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        constraints = [
+            # A student can only be enrolled once in a course; the constraint's index also serves (student, course) lookups.
+            models.UniqueConstraint(fields=['student', 'course'], name='unique_enrollment'),
+        ]
+
     def __str__(self):
         # String representation of the post.
         return f"{self.student.username} enrolled in {self.course.title}"
 
+def has_course_access(user, course):
+    # Only the course's teacher and its enrolled students can see its content.
+    return course.teacher_id == user.id or Enrollment.objects.filter(student=user, course=course).exists()
+
 # Represents a user's post or status update.
 class UserPost(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='user_post')
     content = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Serves the status feed, newest first, with the id as the keyset tie-breaker.
+            models.Index(fields=['-created_at', '-id'], name='userpost_feed_idx'),
+        ]
+
     def __str__(self):
         # String representation of the post.
         return f"Status update by {self.user.get_full_name()} on {self.created_at}"
@@ -102,6 +170,48 @@ class Notification(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='notifications', null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # Serves a user's unread notifications, newest first. Partial on read=False, so it only holds unread rows
+            # and matches the NOT "read" predicate the ORM emits for that filter.
+            models.Index(fields=['recipient', '-created_at'], condition=models.Q(read=False), name='notification_unread_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        # Keeps the recipient's unread counter in step with new unread notifications, and with edits (e.g. in the
+        # admin) that change whether a notification is read or who it is for.
+        old = None
+        if not self._state.adding:
+            old = Notification.objects.filter(pk=self.pk).values('recipient_id', 'read').first()
+        super().save(*args, **kwargs)
+        if old == {'recipient_id': self.recipient_id, 'read': self.read}:
+            return
+        if old is not None and not old['read']:
+            User.change_unread_notification_count([old['recipient_id']], -1)
+        if not self.read:
+            User.change_unread_notification_count([self.recipient_id], 1)
+
     def __str__(self):
         # String representation of the notification.
-        return f"Notification for {self.recipient.username}: {self.message}"
\ No newline at end of file
+        return f"Notification for {self.recipient.username}: {self.message}"
+
+# Represents a message sent in a course's chat room.
+class ChatMessage(models.Model):
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='chat_messages')
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    username = models.CharField(max_length=150)
+    message = models.TextField()
+    # Identifies the message before it is written, so copies from the live broadcast and the database can be matched.
+    message_id = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    # Set when the message is sent, not when the write-behind buffer saves it.
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # Serves a room's latest messages.
+            models.Index(fields=['course', '-created_at'], name='chatmessage_course_created_idx'),
+        ]
+
+    def __str__(self):
+        # String representation of the message.
+        return f"Message by {self.username} in {self.course_id} on {self.created_at}"
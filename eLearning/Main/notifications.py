@@ -0,0 +1,67 @@
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from .models import Notification, User
+
+# Name of the per-user channel group that receives pushed notifications.
+def notification_group_name(user_id):
+    return f'notifications_{user_id}'
+
+# Builds the JSON payload for a notification, matching the fetch_notifications endpoint.
+def serialize_notification(notification):
+    return {
+        'id': notification.id,
+        'message': notification.message,
+        'read': notification.read,
+    }
+
+# Sends a serialized notification to the recipient's group on the channel layer.
+def send_to_user(user_id, payload):
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    async_to_sync(channel_layer.group_send)(
+        notification_group_name(user_id),
+        {
+            'type': 'notification_message',
+            'notification': payload,
+        }
+    )
+
+# Pushes a notification once the surrounding transaction commits, so clients never see rolled back rows.
+# Failures are logged rather than raised: clients fall back to polling when the socket is unavailable.
+def push_notification(notification):
+    payload = serialize_notification(notification)
+    transaction.on_commit(lambda: send_to_user(notification.recipient_id, payload), robust=True)
+
+# Creates a notification and pushes it to the recipient.
+def notify(recipient, message, course=None):
+    notification = Notification.objects.create(recipient=recipient, message=message, course=course)
+    push_notification(notification)
+    return notification
+
+# Creates the same notification for many recipients with a single INSERT and pushes each one.
+def bulk_notify(recipient_ids, message, course=None):
+    notifications = Notification.objects.bulk_create([
+        Notification(recipient_id=recipient_id, message=message, course=course)
+        for recipient_id in recipient_ids
+    ])
+    User.change_unread_notification_count(recipient_ids, 1)
+    for notification in notifications:
+        push_notification(notification)
+    return notifications
+
+# Marks a single notification as read, decrementing the counter only if it was unread.
+@transaction.atomic
+def mark_read(notification):
+    if Notification.objects.filter(pk=notification.pk, read=False).update(read=True):
+        User.change_unread_notification_count([notification.recipient_id], -1)
+    notification.read = True
+
+# Marks all of a user's notifications as read, decrementing the counter by the number changed.
+@transaction.atomic
+def mark_all_read(user):
+    count = user.notifications.filter(read=False).update(read=True)
+    if count:
+        User.change_unread_notification_count([user.pk], -count)
+    return count
@@ -0,0 +1,49 @@
+import base64
+from datetime import datetime
+from django.conf import settings
+from django.db.models import Q
+from rest_framework.pagination import CursorPagination
+
+# Encodes a (timestamp, id) position as an opaque, URL-safe cursor.
+def encode_cursor(timestamp, pk):
+    raw = f'{timestamp.isoformat()}|{pk}'
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+# Decodes a cursor back into its (timestamp, id) position. Raises ValueError for malformed cursors.
+def decode_cursor(cursor):
+    try:
+        timestamp, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(timestamp), int(pk)
+    except (TypeError, UnicodeError, ValueError) as e:
+        raise ValueError('Invalid cursor.') from e
+
+# Returns one page of a queryset ordered newest first by (field, id), and the cursor for the next page.
+# Each page is a range scan from the cursor position, so its cost does not grow with the page number.
+def keyset_page(queryset, cursor, page_size, field='created_at'):
+    if cursor:
+        timestamp, pk = decode_cursor(cursor)
+        queryset = queryset.filter(Q(**{f'{field}__lt': timestamp}) | Q(**{field: timestamp, 'pk__lt': pk}))
+
+    items = list(queryset.order_by(f'-{field}', '-pk')[:page_size + 1])
+    next_cursor = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        last = items[-1]
+        next_cursor = encode_cursor(getattr(last, field), last.pk)
+    return items, next_cursor
+
+# Cursor pagination for the API viewsets. Pages are read from the cursor position along an indexed ordering,
+# so response time stays flat however deep the client pages. Clients may pick a page size up to API_MAX_PAGE_SIZE.
+class CappedCursorPagination(CursorPagination):
+    page_size = settings.API_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.API_MAX_PAGE_SIZE
+    ordering = 'id'
+
+# Newest rows first, along the primary key.
+class NewestFirstCursorPagination(CappedCursorPagination):
+    ordering = '-id'
+
+# Status updates in feed order, along the (created_at, id) feed index.
+class UserPostCursorPagination(CappedCursorPagination):
+    ordering = ('-created_at', '-id')
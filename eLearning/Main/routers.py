@@ -0,0 +1,62 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+
+# Routing state of the request being handled. Outside requests it is None, and everything uses the primary.
+request_routing = ContextVar('request_routing', default=None)
+
+# Apps whose reads must never lag behind their writes: a session read from a replica just after login could log
+# the user out again.
+PRIMARY_ONLY_APPS = {'sessions'}
+
+# Where one request reads from: a single replica, so its reads agree with each other, until it is pinned to the
+# primary by a write.
+class RequestRouting:
+    def __init__(self, replica, pinned=False):
+        self.replica = replica
+        self.pinned = pinned
+        self.wrote = False
+
+# Makes the reads inside the block use the primary. Data cached or tagged under version stamps must be read there:
+# stamps move as soon as a write commits on the primary, before the replicas have caught up.
+@contextmanager
+def primary_reads():
+    routing = request_routing.get()
+    if routing is None or routing.pinned:
+        yield
+        return
+    routing.pinned = True
+    try:
+        yield
+    finally:
+        # A write in the block keeps the request pinned.
+        routing.pinned = routing.wrote
+
+# Sends the reads of requests to a read replica from DATABASE_REPLICAS, and every write to the primary
+# ('default'). ReplicaRoutingMiddleware pins requests that must see their client's own writes to the primary.
+# Work outside requests (Celery tasks, management commands, chat consumers) reads from the primary.
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        routing = request_routing.get()
+        if routing is None or routing.pinned or model._meta.app_label in PRIMARY_ONLY_APPS:
+            return 'default'
+        return routing.replica
+
+    def db_for_write(self, model, **hints):
+        routing = request_routing.get()
+        if routing is not None:
+            # Later reads in the request, and the client's next requests, must see this write.
+            routing.pinned = routing.wrote = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {'default', *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema from the primary.
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
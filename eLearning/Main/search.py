@@ -0,0 +1,114 @@
+import hashlib
+import re
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, connections, router
+from django.db.models import Q
+from .models import User
+
+# SQLite FTS5 table holding the searchable user names, keyed by user id.
+SQLITE_SEARCH_TABLE = 'main_user_search'
+
+# PostgreSQL text search vector over user names. The GIN index created in the migrations uses the same expression.
+POSTGRES_SEARCH_VECTOR = "to_tsvector('simple', coalesce(first_name, '') || ' ' || coalesce(last_name, ''))"
+
+# Only the columns that live_results.html needs are loaded for results.
+RESULT_FIELDS = ('username', 'first_name', 'last_name', 'role')
+
+# Roles whose users can be found. Superusers without a role are left out.
+SEARCHED_ROLES = ('ST', 'TE')
+
+# Longer queries are truncated to this many words.
+MAX_TOKENS = 5
+
+# Splits a query into lowercase words, dropping anything with a meaning in the match syntax.
+def tokenize(query):
+    return re.findall(r'\w+', query.lower())[:MAX_TOKENS]
+
+# Searches students and teachers by name prefix, best matches first, with the results cached for a short time.
+def search_users(query, limit=None):
+    limit = limit or settings.LIVE_SEARCH_LIMIT
+    tokens = tokenize(query)
+    if not tokens:
+        return []
+
+    normalized = ' '.join(tokens)
+    cache_key = 'live_search:%s:%d' % (hashlib.md5(normalized.encode()).hexdigest(), limit)
+    users = cache.get(cache_key)
+    if users is None:
+        users = _search(tokens, limit)
+        cache.set(cache_key, users, settings.LIVE_SEARCH_CACHE_TIMEOUT)
+    return users
+
+def _search(tokens, limit):
+    # The index is read from wherever users are read from, which may be a replica.
+    connection = connections[router.db_for_read(User)]
+    if connection.vendor == 'sqlite':
+        ids = _sqlite_search(connection, tokens, limit)
+    elif connection.vendor == 'postgresql':
+        ids = _postgres_search(connection, tokens, limit)
+    else:
+        # No search index on other databases: fall back to a capped prefix match on the first word.
+        return list(User.objects.filter(
+            Q(first_name__istartswith=tokens[0]) | Q(last_name__istartswith=tokens[0]),
+            role__in=SEARCHED_ROLES
+        ).only(*RESULT_FIELDS)[:limit])
+
+    # Load the matched users in one query and keep the rank order.
+    users = User.objects.filter(pk__in=ids).only(*RESULT_FIELDS).in_bulk()
+    return [users[pk] for pk in ids if pk in users]
+
+# Roles are filtered in the index query, before the LIMIT, so users who cannot be found never take up results.
+def _sqlite_search(connection, tokens, limit):
+    # Every word must match as a prefix; rank is FTS5's built-in bm25 score.
+    match = ' '.join(f'"{token}"*' for token in tokens)
+    roles = ', '.join(['%s'] * len(SEARCHED_ROLES))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT s.rowid FROM {SQLITE_SEARCH_TABLE} s JOIN "{User._meta.db_table}" u ON u.id = s.rowid '
+            f'WHERE {SQLITE_SEARCH_TABLE} MATCH %s AND u.role IN ({roles}) ORDER BY s.rank LIMIT %s',
+            [match, *SEARCHED_ROLES, limit]
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+def _postgres_search(connection, tokens, limit):
+    # Every word must match as a prefix; results are ordered by ts_rank.
+    tsquery = ' & '.join(f'{token}:*' for token in tokens)
+    roles = ', '.join(['%s'] * len(SEARCHED_ROLES))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT id FROM "{User._meta.db_table}" '
+            f"WHERE {POSTGRES_SEARCH_VECTOR} @@ to_tsquery('simple', %s) AND role IN ({roles}) "
+            f"ORDER BY ts_rank({POSTGRES_SEARCH_VECTOR}, to_tsquery('simple', %s)) DESC LIMIT %s",
+            [tsquery, *SEARCHED_ROLES, tsquery, limit]
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+# Writes a user's current names to the search index. PostgreSQL maintains its expression index itself.
+def index_user(user):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {SQLITE_SEARCH_TABLE} WHERE rowid = %s', [user.pk])
+        cursor.execute(
+            f'INSERT INTO {SQLITE_SEARCH_TABLE} (rowid, first_name, last_name) VALUES (%s, %s, %s)',
+            [user.pk, user.first_name, user.last_name]
+        )
+
+# Removes a deleted user from the search index.
+def remove_user(user_id):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {SQLITE_SEARCH_TABLE} WHERE rowid = %s', [user_id])
+
+# Rebuilds the whole search index from the user table, e.g. after bulk writes that skip signals.
+def rebuild_index():
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {SQLITE_SEARCH_TABLE}')
+        cursor.execute(
+            f'INSERT INTO {SQLITE_SEARCH_TABLE} (rowid, first_name, last_name) '
+            f'SELECT id, first_name, last_name FROM "{User._meta.db_table}"'
+        )
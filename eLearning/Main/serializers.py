@@ -1,8 +1,14 @@
 from django.contrib.auth import get_user_model
 from rest_framework import serializers
 from .models import *
+import re
 from django.utils.dateformat import DateFormat
 from django.utils.formats import get_format
+from django.utils.encoding import filepath_to_uri
+from django.core.files.storage import FileSystemStorage
+from django.db.models import QuerySet, Count, Prefetch
+from django.core.exceptions import FieldDoesNotExist
+from .thumbnails import photo_variant_name
 
 User = get_user_model()
 
@@ -25,12 +31,84 @@ class UserSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("You do not have permission to update a user.")
         return super().update(instance, validated_data)
     
-# Serializer for the Course model with nested category and teacher
-class CourseSerializer(serializers.ModelSerializer):
+# Reads a comma separated query parameter into a set of names.
+def query_param_set(request, name):
+    value = request.query_params.get(name, '') if request is not None else ''
+    return {item.strip() for item in value.split(',') if item.strip()}
+
+# Lets API clients pick the returned fields with ?fields=a,b and nest related objects with ?expand=a,b.
+# Meta.expandable_fields maps a field to the serializer used when it is expanded, Meta.optional_fields are
+# only returned when asked for in ?fields=, and Meta.annotations gives the expression behind annotated fields.
+class DynamicFieldsMixin:
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        requested = query_param_set(request, 'fields')
+        expand = query_param_set(request, 'expand')
+
+        for name, serializer_class in getattr(self.Meta, 'expandable_fields', {}).items():
+            if name in expand:
+                many = self.Meta.model._meta.get_field(name).many_to_many
+                self.fields[name] = serializer_class(many=many, read_only=True)
+
+        optional = set(getattr(self.Meta, 'optional_fields', ()))
+        for name in list(self.fields):
+            if (requested and name not in requested) or (name in optional and name not in requested):
+                self.fields.pop(name)
+
+    # Applies the joins, prefetches, annotations and column list needed to render the selected fields,
+    # so a list costs the same number of queries however many rows it returns.
+    def optimize_queryset(self, queryset):
+        model = self.Meta.model
+        annotations = getattr(self.Meta, 'annotations', {})
+        columns = [model._meta.pk.name]
+        for name, field in self.fields.items():
+            if name in annotations:
+                queryset = queryset.annotate(**{name: annotations[name]})
+                continue
+            try:
+                model_field = model._meta.get_field(field.source)
+            except FieldDoesNotExist:
+                continue
+            nested = isinstance(field, serializers.BaseSerializer)
+            if model_field.many_to_many:
+                related = model_field.related_model.objects.all() if nested else model_field.related_model.objects.only('pk')
+                queryset = queryset.prefetch_related(Prefetch(model_field.name, queryset=related))
+            elif model_field.concrete:
+                columns.append(model_field.name)
+                if nested:
+                    queryset = queryset.select_related(model_field.name)
+        return queryset.only(*columns)
+
+# Short representation of a user, used when expanding user relations.
+class UserSummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = User
+        fields = ['id', 'username', 'first_name', 'last_name', 'role']
+
+# Serializer for the Category model
+class CategorySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Category
+        fields = ['id', 'name']
+
+# Serializer for the Course model, with sparse fieldsets, expandable category, teacher and students, and an
+# optional student_count computed by the database
+class CourseSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    student_count = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = Course
-        fields = ['id', 'title', 'description', 'created_at', 'updated_at', 'teacher', 'students', 'category']
+        fields = ['id', 'title', 'description', 'created_at', 'updated_at', 'teacher', 'students', 'category', 'student_count']
+        optional_fields = ['student_count']
+        expandable_fields = {
+            'teacher': UserSummarySerializer,
+            'students': UserSummarySerializer,
+            'category': CategorySerializer,
+        }
+        annotations = {
+            'student_count': Count('enrollment'),
+        }
 
 # Serializer for CourseFeedback model with user details
 class CourseFeedbackSerializer(serializers.ModelSerializer):
@@ -40,25 +118,103 @@ class CourseFeedbackSerializer(serializers.ModelSerializer):
         model = CourseFeedback
         fields = '__all__'
 
+# Date format characters whose output depends only on the day, hour and minute.
+MINUTE_FORMAT_CHARS = frozenset('bdDEFjlLmMnNoStwWyYz' 'aAfgGhHiP')
+
+# Returns a function that formats datetimes the same way as DateFormat(value).format(format_string). When the
+# format shows nothing finer than minutes, each formatted minute is remembered, so rows sharing one skip the
+# translated month and a.m./p.m. lookups.
+def compile_datetime_format(format_string):
+    format_string = str(format_string)
+    # Letters escaped with a backslash are printed as they are.
+    format_chars = {char for char in re.sub(r'\\.', '', format_string) if char.isalpha()}
+    per_minute = format_chars <= MINUTE_FORMAT_CHARS
+    formatted = {}
+
+    def format_datetime(value):
+        key = (value.date(), value.hour, value.minute) if per_minute else value
+        text = formatted.get(key)
+        if text is None:
+            text = formatted[key] = DateFormat(value).format(format_string)
+        return text
+
+    return format_datetime
+
+# Read path for lists of posts. Values shared by every row (date format, photo URL prefix, role labels) are resolved
+# once per response, and each row is built as a plain dict from only the columns it needs. The output is the same as
+# serializing each post with UserPostSerializer.
+class UserPostListSerializer(serializers.ListSerializer):
+    # Columns read for each post when given an unevaluated queryset.
+    columns = ('id', 'content', 'created_at', 'user__first_name', 'user__last_name', 'user__photo', 'user__role')
+
+    def to_representation(self, data):
+        if isinstance(data, QuerySet):
+            rows = data.values_list(*self.columns)
+        else:
+            rows = (
+                (post.id, post.content, post.created_at, post.user.first_name, post.user.last_name, post.user.photo.name, post.user.role)
+                for post in (data.all() if hasattr(data, 'all') else data)
+            )
+
+        format_datetime = compile_datetime_format(get_format('DATETIME_FORMAT'))
+        role_labels = dict(User.ROLE_CHOICES)
+        photo_url = self.photo_url_builder()
+        return [{
+            'id': post_id,
+            'content': content,
+            'created_at': format_datetime(created_at),
+            'user_full_name': f'{first_name} {last_name}'.strip(),
+            'user_photo_url': photo_url(photo) if photo else None,
+            'user_role': role_labels.get(role, role),
+        } for post_id, content, created_at, first_name, last_name, photo, role in rows]
+
+    # Returns a function that turns a stored photo name into the URL of its variant, absolute when serializing for
+    # a request. URLs are remembered per name, since a page of posts usually has few distinct authors.
+    def photo_url_builder(self):
+        request = self.context.get('request')
+        storage = User._meta.get_field('photo').storage
+        variant = self.child.photo_variant
+        if isinstance(storage, FileSystemStorage):
+            # Local storage URLs are the base URL (always ending in '/') plus the quoted name, so the prefix is resolved once.
+            base_url = request.build_absolute_uri(storage.base_url) if request else storage.base_url
+            build = lambda name: base_url + filepath_to_uri(name).lstrip('/')
+        elif request:
+            build = lambda name: request.build_absolute_uri(storage.url(name))
+        else:
+            build = storage.url
+        urls = {}
+
+        def photo_url(name):
+            url = urls.get(name)
+            if url is None:
+                url = urls[name] = build(photo_variant_name(storage, name, variant))
+            return url
+
+        return photo_url
+
 # Serializer for UserPost with dynamic user information
 class UserPostSerializer(serializers.ModelSerializer):
     user_full_name = serializers.SerializerMethodField()
     user_photo_url = serializers.SerializerMethodField()
     user_role = serializers.SerializerMethodField()
     created_at = serializers.SerializerMethodField()
+    # Name of the photo variant linked to by user_photo_url.
+    photo_variant = 'feed'
 
     class Meta:
         model = UserPost
         # Including the user in write_only to avoid exposing user details in response 
         fields = ['id', 'user', 'content', 'created_at', 'user_full_name', 'user_photo_url', 'user_role']
         extra_kwargs = {'user': {'write_only': True, 'required': False}}
+        list_serializer_class = UserPostListSerializer
 
-    # Method to get the URL of the user's photo
+    # Method to get the URL of the user's photo variant, absolute when serializing for a request
     def get_user_photo_url(self, obj):
         request = self.context.get('request')
-        if obj.user.photo and hasattr(obj.user.photo, 'url'):
-            photo_url = obj.user.photo.url
-            return request.build_absolute_uri(photo_url)
+        photo = obj.user.photo
+        if photo and hasattr(photo, 'url'):
+            photo_url = photo.storage.url(photo_variant_name(photo.storage, photo.name, self.photo_variant))
+            return request.build_absolute_uri(photo_url) if request else photo_url
         return None
     
     # Method to get the role of the user who made the post
@@ -0,0 +1,86 @@
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.conf import settings
+from .models import User, UserPost, Category, Course, Enrollment, CourseFeedback, CourseFile, Notification
+from .versions import bump_version
+from . import search
+from .feed import broadcast_user_post
+from .thumbnails import create_variants
+
+# Tunes each new SQLite connection with the PRAGMAs of the database profile.
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for pragma, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {pragma} = {value}')
+
+# User fields that are held in the people search index and shown as names in cached pages.
+NAME_FIELDS = {'first_name', 'last_name'}
+
+# Keeps the search index in step with user names.
+@receiver(post_save, sender=User)
+def index_user_for_search(sender, instance, update_fields=None, raw=False, **kwargs):
+    # Saves that only touch other fields (e.g. last_login on every login) leave the index alone.
+    if raw or (update_fields is not None and not NAME_FIELDS.intersection(update_fields)):
+        return
+    search.index_user(instance)
+
+@receiver(post_delete, sender=User)
+def remove_user_from_search(sender, instance, **kwargs):
+    search.remove_user(instance.pk)
+
+# Creates the variants of a saved profile photo, so pages showing it do not have to. Variants that already exist
+# are kept, so only a new photo is resized.
+@receiver(post_save, sender=User)
+def create_photo_variants(sender, instance, update_fields=None, raw=False, **kwargs):
+    if raw or not instance.photo or (update_fields is not None and 'photo' not in update_fields):
+        return
+    create_variants(instance.photo.storage, instance.photo.name)
+
+# Streams new status updates to open feeds, whichever view created them.
+@receiver(post_save, sender=UserPost)
+def broadcast_new_user_post(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        broadcast_user_post(instance)
+
+# Uncounts deleted unread notifications, whether deleted on their own or with their course or recipient.
+@receiver(post_delete, sender=Notification)
+def uncount_deleted_notification(sender, instance, **kwargs):
+    if not instance.read:
+        User.change_unread_notification_count([instance.recipient_id], -1)
+
+# Releases a deleted course file's stored copy once the deletion commits, whether the file was deleted on its
+# own or with its course. The copy itself goes when no other course file shares it.
+@receiver(post_delete, sender=CourseFile)
+def release_course_file(sender, instance, **kwargs):
+    if instance.file.name:
+        storage, name = instance.file.storage, instance.file.name
+        transaction.on_commit(lambda: storage.delete(name))
+
+# Models whose changes move their version stamp, for conditional GET and cached pages.
+VERSIONED_MODELS = (User, Category, Course, Enrollment, CourseFeedback, UserPost)
+
+# Fields whose saves alter nothing that a versioned response shows, such as last_login on every login.
+UNVERSIONED_FIELDS = {'last_login'}
+
+# Bumps the model's version once the change commits, so no reader can cache the old data under the new version.
+def bump_model_version(sender, update_fields=None, **kwargs):
+    if update_fields is not None and update_fields <= UNVERSIONED_FIELDS:
+        return
+    name = sender._meta.model_name
+    transaction.on_commit(lambda: bump_version(name), robust=True)
+
+for model in VERSIONED_MODELS:
+    post_save.connect(bump_model_version, sender=model, dispatch_uid=f'bump_version_on_save_{model._meta.model_name}')
+    post_delete.connect(bump_model_version, sender=model, dispatch_uid=f'bump_version_on_delete_{model._meta.model_name}')
+
+# Moves the 'teacher' version when a teacher's displayed name may have changed, for the cached catalog.
+@receiver(post_save, sender=User)
+def bump_teacher_version(sender, instance, update_fields=None, raw=False, **kwargs):
+    if raw or instance.role != 'TE' or (update_fields is not None and not NAME_FIELDS.intersection(update_fields)):
+        return
+    transaction.on_commit(lambda: bump_version('teacher'), robust=True)
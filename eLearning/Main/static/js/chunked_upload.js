@@ -0,0 +1,96 @@
+// Uploads a file in chunks through the chunked upload API. Failed chunks are retried after asking the
+// server where the upload stands, and an upload interrupted by leaving the page resumes from its last
+// chunk when the same file is uploaded again.
+var ChunkedUpload = (function() {
+    var MAX_RETRIES = 5;
+
+    function csrfToken() {
+        return document.querySelector('[name=csrfmiddlewaretoken]').value;
+    }
+
+    function request(method, url, body) {
+        return fetch(url, {
+            method: method,
+            body: body,
+            headers: {'X-CSRFToken': csrfToken()},
+            credentials: 'same-origin'
+        }).then(function(response) {
+            return response.json().then(function(data) {
+                if (!response.ok) {
+                    var error = new Error(data.detail || 'Upload failed.');
+                    error.status = response.status;
+                    throw error;
+                }
+                return data;
+            });
+        });
+    }
+
+    function wait(ms) {
+        return new Promise(function(resolve) { setTimeout(resolve, ms); });
+    }
+
+    // Uploads remembered across page loads are keyed by the file's name, size and modification time.
+    function storageKey(startUrl, file) {
+        return 'chunked-upload:' + startUrl + ':' + file.name + ':' + file.size + ':' + file.lastModified;
+    }
+
+    function startOrResume(startUrl, file, fileName) {
+        var key = storageKey(startUrl, file);
+        var sessionUrl = localStorage.getItem(key);
+        var resume = sessionUrl
+            ? request('GET', sessionUrl).then(function(session) { return [sessionUrl, session]; })
+            : Promise.reject();
+        return resume.catch(function() {
+            var form = new FormData();
+            form.append('name', file.name);
+            form.append('file_name', fileName);
+            form.append('size', file.size);
+            return request('POST', startUrl, form).then(function(session) {
+                localStorage.setItem(key, session.url);
+                return [session.url, session];
+            });
+        });
+    }
+
+    function sendChunks(sessionUrl, file, session, onProgress, retries) {
+        if (session.received >= session.size) {
+            return Promise.resolve(session);
+        }
+        var index = session.next_chunk;
+        var start = index * session.chunk_size;
+        var chunk = file.slice(start, Math.min(start + session.chunk_size, session.size));
+        return request('PUT', sessionUrl + 'chunks/' + index + '/', chunk).then(function(updated) {
+            onProgress(updated.received, updated.size);
+            return sendChunks(sessionUrl, file, updated, onProgress, 0);
+        }, function(error) {
+            if (retries >= MAX_RETRIES || (error.status && error.status < 500 && error.status !== 409)) {
+                throw error;
+            }
+            // Asks where the upload stands before trying again, in case the chunk did arrive.
+            return wait(1000 * Math.pow(2, retries)).then(function() {
+                return request('GET', sessionUrl);
+            }).then(function(current) {
+                return sendChunks(sessionUrl, file, current, onProgress, retries + 1);
+            }, function() {
+                return sendChunks(sessionUrl, file, session, onProgress, retries + 1);
+            });
+        });
+    }
+
+    // Uploads `file` to the course whose upload start URL is `startUrl`, resolving with the new course file.
+    function upload(startUrl, file, fileName, onProgress) {
+        onProgress = onProgress || function() {};
+        return startOrResume(startUrl, file, fileName).then(function(started) {
+            var sessionUrl = started[0];
+            return sendChunks(sessionUrl, file, started[1], onProgress, 0).then(function() {
+                return request('POST', sessionUrl + 'complete/');
+            }).then(function(courseFile) {
+                localStorage.removeItem(storageKey(startUrl, file));
+                return courseFile;
+            });
+        });
+    }
+
+    return {upload: upload};
+})();
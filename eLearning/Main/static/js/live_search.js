@@ -1,17 +1,34 @@
 $(document).ready(function() {
+    var searchTimer = null;
+    var lastQuery = '';
+    var pendingRequest = null;
+
     $('#live-search').keyup(function() {
-        var query = $(this).val();
+        var query = $.trim($(this).val());
         var searchURL = $(this).data('search-url'); // Use the URL from the data attribute
+
+        // Wait for a pause in typing, and skip keys that do not change the query (arrows, shift, ...)
+        clearTimeout(searchTimer);
+        if (query === lastQuery) {
+            return;
+        }
         if (query.length > 2) {
-            $.ajax({
-                url: searchURL,
-                data: {'query': query},
-                success: function(data) {
-                    $('#live-search-results').html(data);
+            searchTimer = setTimeout(function() {
+                lastQuery = query;
+                if (pendingRequest) {
+                    pendingRequest.abort(); // Drop results for an older query
                 }
-            });
+                pendingRequest = $.ajax({
+                    url: searchURL,
+                    data: {'query': query},
+                    success: function(data) {
+                        $('#live-search-results').html(data);
+                    }
+                });
+            }, 250);
         } else {
+            lastQuery = query;
             $('#live-search-results').html('');
         }
     });
-});
\ No newline at end of file
+});
@@ -0,0 +1,132 @@
+import hashlib
+import os
+import posixpath
+import tempfile
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import F
+from django.utils.deconstruct import deconstructible
+
+# Size of the blocks read and written while copying and hashing files.
+BLOCK_SIZE = 64 * 1024
+
+# A file already on local disk. FileSystemStorage moves files that have a temporary path instead of copying them.
+class LocalFile(File):
+    def __init__(self, file, name=None, content_hash=None):
+        super().__init__(file, name)
+        # SHA-256 of the content, when the caller has already computed it.
+        self.content_hash = content_hash
+
+    def temporary_file_path(self):
+        return self.file.name
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+# Stores each file under the SHA-256 of its content, so identical uploads share one copy on disk.
+# Every copy has a ContentBlob row counting the files that use it: saving adds a reference, deleting removes
+# one, and the copy itself is deleted with the last reference. Files saved before content addressing was
+# introduced have no row and are deleted as before.
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    # Name of the copy of content with this hash, in the directory the upload was meant for.
+    def blob_name(self, directory, digest, extension):
+        return posixpath.join(directory, digest[:2], digest + extension.lower())
+
+    def _save(self, name, content):
+        directory, extension = posixpath.dirname(name), os.path.splitext(name)[1]
+        incoming = None
+        digest = getattr(content, 'content_hash', None)
+        if digest is None and hasattr(content, 'temporary_file_path'):
+            digest = hash_file(content.temporary_file_path())
+        elif digest is None:
+            incoming, digest = self.write_incoming(directory, content)
+            content = LocalFile(open(incoming, 'rb'), name=name)
+
+        try:
+            name = self.blob_name(directory, digest, extension)
+            self.add_blob(name, content)
+        finally:
+            if incoming is not None:
+                content.close()
+                if os.path.exists(incoming):
+                    os.remove(incoming)
+        return name
+
+    # Copies the content to a temporary file next to its final place, hashing it in the same pass.
+    def write_incoming(self, directory, content):
+        os.makedirs(self.path(directory), exist_ok=True)
+        digest = hashlib.sha256()
+        f = tempfile.NamedTemporaryFile(dir=self.path(directory), prefix='.incoming-', delete=False)
+        try:
+            with f:
+                for block in content.chunks(BLOCK_SIZE):
+                    digest.update(block)
+                    f.write(block)
+        except Exception:
+            os.remove(f.name)
+            raise
+        return f.name, digest.hexdigest()
+
+    # Adds a reference to the copy, storing the content first if it is new.
+    def add_blob(self, name, content):
+        from .models import ContentBlob
+        with transaction.atomic():
+            # The row lock keeps a concurrent delete of the last reference from removing the copy under us.
+            blob, created = ContentBlob.objects.select_for_update().get_or_create(name=name, defaults={'size': content.size})
+            if created and self.exists(name):
+                # A copy without a row was left behind by a save or delete that did not finish, and may be incomplete.
+                super().delete(name)
+            if created or not self.exists(name):
+                super()._save(name, content)
+            ContentBlob.objects.filter(pk=blob.pk).update(references=F('references') + 1)
+
+    # Adds a reference to content that is already stored. Returns False if there is no copy with this name.
+    def add_reference(self, name):
+        from .models import ContentBlob
+        with transaction.atomic():
+            if not ContentBlob.objects.select_for_update().filter(name=name).exists() or not self.exists(name):
+                return False
+            ContentBlob.objects.filter(name=name).update(references=F('references') + 1)
+            return True
+
+    # Removes a reference, deleting the copy once nothing refers to it.
+    def delete(self, name):
+        from .models import ContentBlob
+        with transaction.atomic():
+            blob = ContentBlob.objects.select_for_update().filter(name=name).first()
+            if blob is None:
+                super().delete(name)
+                return
+            ContentBlob.objects.filter(pk=blob.pk).update(references=F('references') - 1)
+            if blob.references > 1:
+                return
+        transaction.on_commit(lambda: self.delete_unreferenced(name))
+
+    # Deletes the copy and its row if nothing refers to it. The same content may have been stored again since
+    # its last reference was removed, so the check and the delete are made under the row lock add_blob takes.
+    def delete_unreferenced(self, name):
+        from .models import ContentBlob
+        with transaction.atomic():
+            blob, _ = ContentBlob.objects.select_for_update().get_or_create(name=name, defaults={'size': 0})
+            if blob.references:
+                return
+            super().delete(name)
+            blob.delete()
+        # Drops the hash prefix directory once it is empty.
+        try:
+            os.rmdir(os.path.dirname(self.path(name)))
+        except OSError:
+            pass
+
+course_file_storage = ContentAddressedStorage()
+
+# Returns the storage for course files. Fields refer to it through this callable, so migrations do not depend
+# on the storage's settings.
+def get_course_file_storage():
+    return course_file_storage
@@ -0,0 +1,46 @@
+import os
+from celery import shared_task
+from django.conf import settings
+from .imports import ArchiveImportError, import_archive
+from .models import Course, Enrollment
+from .notifications import bulk_notify
+
+# Notifies every student enrolled in a course, writing one batch of notifications per INSERT.
+@shared_task
+def notify_course_students(course_id, message):
+    course = Course.objects.filter(pk=course_id).first()
+    if course is None:
+        return 0
+
+    batch_size = settings.NOTIFICATION_BATCH_SIZE
+    enrolled = Enrollment.objects.filter(course=course).order_by('student_id').values_list('student_id', flat=True)
+    last_student_id = 0
+    total = 0
+    while True:
+        # Walk the students in id order, one chunk of recipients at a time.
+        student_ids = list(enrolled.filter(student_id__gt=last_student_id)[:batch_size])
+        if not student_ids:
+            break
+        bulk_notify(student_ids, message, course=course)
+        last_student_id = student_ids[-1]
+        total += len(student_ids)
+    return total
+
+# Imports the course files in an uploaded archive, then deletes it. The teacher is told how the import went, and
+# each enrolled student gets one notification for the whole archive.
+@shared_task
+def import_course_archive(course_id, path):
+    try:
+        course = Course.objects.filter(pk=course_id).first()
+        if course is None:
+            return 0
+        try:
+            course_files = import_archive(course, path)
+        except ArchiveImportError as e:
+            bulk_notify([course.teacher_id], f"Importing files into {course.title} failed. {e}", course=course)
+            return 0
+        bulk_notify([course.teacher_id], f"{len(course_files)} files were imported into {course.title}.", course=course)
+        notify_course_students(course.pk, f"{len(course_files)} new files added to {course.title}.")
+        return len(course_files)
+    finally:
+        os.remove(path)
@@ -1,12 +1,13 @@
 from django import template
-from Main.models import Notification 
 
 register = template.Library()
 
+# Reads the maintained counter on the user instead of counting the Notification table.
 @register.simple_tag
 def get_unread_notifications_count(user):
-    return Notification.objects.filter(recipient=user, read=False).count()
+    return user.unread_notification_count
 
+# Returns the latest unread notifications, without querying when the counter says there are none.
 @register.simple_tag
 def get_unread_notifications(user):
-    return Notification.objects.filter(recipient=user, read=False).order_by('-created_at')
+    return user.get_unread_notifications().order_by('-created_at')[:5]
@@ -0,0 +1,9 @@
+from django import template
+from ..thumbnails import photo_variant_url
+
+register = template.Library()
+
+# URL of a fixed-size variant of a photo, e.g. {{ user.photo|photo_variant:'nav' }}.
+@register.filter
+def photo_variant(photo, variant):
+    return photo_variant_url(photo, variant) or ''
@@ -7,6 +7,60 @@ from django.core.exceptions import ValidationError
 from rest_framework.test import APIClient
 from rest_framework import status
 from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection, connections, router, DatabaseError, IntegrityError
+from django.http import Http404, HttpResponse
+from django.test import RequestFactory
+from django.contrib.sessions.models import Session
+from .middleware import PIN_COOKIE, ReplicaRoutingMiddleware
+from .routers import PrimaryReplicaRouter
+from .versions import bump_version, get_versions
+from .views import CourseViewSet
+from rest_framework.test import force_authenticate
+from unittest import skipUnless
+import re
+from django.core.files.uploadedfile import SimpleUploadedFile
+from unittest import mock
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from eLearning.routing import websocket_urlpatterns
+from .notifications import notification_group_name, bulk_notify, mark_read, mark_all_read
+from .feed import FEED_GROUP_NAME
+import json
+from .downloads import serve_public_media
+from .tasks import import_course_archive, notify_course_students
+from .search import search_users
+from .serializers import UserPostSerializer, compile_datetime_format
+from django.utils.dateformat import DateFormat
+from .pagination import CappedCursorPagination
+from .catalog import get_course_catalog
+from rest_framework import serializers
+from rest_framework.test import APIRequestFactory
+from datetime import timedelta
+from django.core.cache import cache
+from django.core.management import call_command
+from io import BytesIO, StringIO
+import asyncio
+from contextlib import nullcontext
+import hashlib
+import os
+import shutil
+import tempfile
+import zipfile
+import zlib
+from kombu.exceptions import OperationalError as KombuOperationalError
+from django.conf import settings
+from django.utils import timezone
+from PIL import Image
+from .thumbnails import photo_variant_url, variant_name
+from .transports import TransportBufferMiddleware, find_transport, transport_buffer_size
+from functools import partial
+from .uploads import write_chunk
+from .chat import ChatCoalescer, ChatWriteBuffer, RecentChatMessages, serialize_chat_message, get_chat_limit_counts
 
 # Get the custom user model
 User = get_user_model()
@@ -108,6 +162,46 @@ class CourseCategoryModelTest(TestCase):
     def test_course_str(self):
         self.assertEqual(str(self.course), 'Biology 101')
 
+# Testing the versioned cache of the course catalog.
+class CourseCatalogCacheTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.teacher = User.objects.create_user(username='catalog_teacher', role='TE', first_name='Cat', last_name='Alog')
+        cls.student = User.objects.create_user(username='catalog_student', role='ST', password='1234')
+        cls.category = Category.objects.create(name='Catalog')
+        cls.course = Course.objects.create(title='Catalog 101', description='Cached', teacher=cls.teacher, category=cls.category)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_cache_hit_costs_no_queries(self):
+        get_course_catalog()
+        with self.assertNumQueries(0):
+            catalog = get_course_catalog()
+        self.assertEqual(catalog[0]['courses'][0]['teacher_name'], 'Cat Alog')
+
+    def test_changes_invalidate_the_catalog(self):
+        # Test that saving a course, a category or a teacher's name is visible on the next read
+        get_course_catalog()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.course.title = 'Catalog 201'
+            self.course.save()
+        self.assertEqual(get_course_catalog()[0]['courses'][0]['title'], 'Catalog 201')
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(name='Second')
+        self.assertEqual(len(get_course_catalog()), 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.teacher.first_name = 'Dog'
+            self.teacher.save()
+        self.assertEqual(get_course_catalog()[0]['courses'][0]['teacher_name'], 'Dog Alog')
+
+    def test_courses_page_marks_enrollments(self):
+        Enrollment.objects.create(student=self.student, course=self.course)
+        self.client.login(username='catalog_student', password='1234')
+        response = self.client.get(reverse('courses'))
+        self.assertContains(response, 'Catalog 101')
+        self.assertContains(response, 'Enrolled')
+
 # Testing the course editing functionality to ensure that courses can be edited successfully.
 class CourseEditViewTest(TestCase):
     @classmethod
@@ -219,6 +313,74 @@ class CourseFeedbackModelTest(TestCase):
         expected_str = f"Feedback by {self.feedback.user.get_full_name()} on {self.feedback.created_at.strftime('%Y-%m-%d %H:%M:%S')}"
         self.assertEqual(str(self.feedback), expected_str)
 
+# Testing the paginated course detail page and its fixed query budget.
+@override_settings(FEEDBACK_PAGE_SIZE=3)
+class CourseDetailPageTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.teacher = User.objects.create_user(username='detail_teacher', role='TE', password='1234')
+        cls.student = User.objects.create_user(username='detail_student', role='ST', password='1234', first_name='Detail', last_name='Student')
+        cls.outsider = User.objects.create_user(username='detail_outsider', role='ST', password='1234')
+        category = Category.objects.create(name='Details')
+        cls.course = Course.objects.create(title='Detail 101', description='Details', teacher=cls.teacher, category=category)
+        Enrollment.objects.create(student=cls.student, course=cls.course)
+
+    def add_content(self, count):
+        CourseFeedback.objects.bulk_create([CourseFeedback(course=self.course, user=self.student, content=f'Feedback {i}') for i in range(count)])
+        CourseFile.objects.bulk_create([CourseFile(course=self.course, file=f'course_files/file{i}.pdf', file_name=f'File {i}') for i in range(count)])
+
+    def count_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('course_detail', kwargs={'pk': self.course.pk}))
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_query_budget_is_fixed(self):
+        # Test that the first render costs the same number of queries with little or much content
+        self.client.login(username='detail_student', password='1234')
+        self.add_content(2)
+        few = self.count_queries()
+        self.add_content(20)
+        self.assertEqual(self.count_queries(), few)
+
+    def test_feedback_loaded_by_page(self):
+        # Test that following the cursors from the page returns all feedback exactly once
+        self.add_content(7)
+        self.client.login(username='detail_student', password='1234')
+        response = self.client.get(reverse('course_detail', kwargs={'pk': self.course.pk}))
+        self.assertEqual(len(response.context['feedback_list']), 3)
+        seen = response.content.decode().count('Posted on')
+        cursor = response.context['next_cursor']
+        while cursor:
+            data = self.client.get(reverse('course_feedback_page', kwargs={'pk': self.course.pk}), {'cursor': cursor}).json()
+            seen += data['html'].count('Posted on')
+            cursor = data['next_cursor']
+        self.assertEqual(seen, 7)
+
+    def test_feedback_post_does_not_load_the_page(self):
+        # Test that a successful feedback post redirects without reading the feedback page
+        self.client.login(username='detail_student', password='1234')
+        with mock.patch('Main.views.keyset_page') as keyset_page:
+            response = self.client.post(reverse('course_detail', kwargs={'pk': self.course.pk}), {'content': 'Great course'})
+        self.assertRedirects(response, reverse('course_detail', kwargs={'pk': self.course.pk}), fetch_redirect_response=False)
+        keyset_page.assert_not_called()
+        self.assertTrue(CourseFeedback.objects.filter(course=self.course, content='Great course').exists())
+
+    def test_feedback_page_requires_access(self):
+        self.client.login(username='detail_outsider', password='1234')
+        response = self.client.get(reverse('course_feedback_page', kwargs={'pk': self.course.pk}))
+        self.assertEqual(response.status_code, 403)
+
+    def test_detail_page_requires_access(self):
+        # Test that outsiders are sent back to the course list, and the teacher sees the page without the feedback form
+        self.client.login(username='detail_outsider', password='1234')
+        response = self.client.get(reverse('course_detail', kwargs={'pk': self.course.pk}))
+        self.assertRedirects(response, reverse('courses'), fetch_redirect_response=False)
+        self.client.login(username='detail_teacher', password='1234')
+        response = self.client.get(reverse('course_detail', kwargs={'pk': self.course.pk}))
+        self.assertEqual((response.context['is_teacher'], response.context['is_enrolled']), (True, False))
+
+
 # Testing the course enrollment and unenrollment functionalities from a user's perspective.
 class CourseEnrollmentViewTest(TestCase):
     @classmethod
@@ -269,6 +431,676 @@ class NotificationFetchTest(TestCase):
         self.assertEqual(notifications[0]['message'], 'Unread Message')  # Verify it's the correct notification
         self.assertFalse(notifications[0]['read']) # Verify the notification is indeed unread
 
+# Testing the maintained unread notification counter.
+class UnreadNotificationCounterTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # Setup for a user who receives several notifications
+        cls.user = User.objects.create_user(username='counter_user', role='ST', password='1234')
+
+    def unread_count(self):
+        return User.objects.get(pk=self.user.pk).unread_notification_count
+
+    def test_counter_follows_create_and_read(self):
+        # Test that creating, reading and bulk reading change the counter
+        first = Notification.objects.create(recipient=self.user, message='First')
+        bulk_notify([self.user.id], 'Second')
+        Notification.objects.create(recipient=self.user, message='Already read', read=True)
+        self.assertEqual(self.unread_count(), 2)
+        mark_read(first)
+        mark_read(first)  # Reading twice only counts once
+        self.assertEqual(self.unread_count(), 1)
+        self.assertEqual(mark_all_read(self.user), 1)
+        self.assertEqual(self.unread_count(), 0)
+
+    def test_counter_follows_edits_and_deletes(self):
+        # Test that editing read, deleting a notification and deleting its course all change the counter
+        teacher = User.objects.create_user(username='counter_teacher', role='TE')
+        course = Course.objects.create(title='Counting 101', description='Counting', teacher=teacher, category=Category.objects.create(name='Counting'))
+        first = Notification.objects.create(recipient=self.user, message='First')
+        Notification.objects.create(recipient=self.user, message='Second', course=course)
+        Notification.objects.create(recipient=self.user, message='Third', course=course, read=True)
+        self.assertEqual(self.unread_count(), 2)
+        first.read = True
+        first.save()
+        self.assertEqual(self.unread_count(), 1)
+        first.read = False
+        first.save()
+        first.save()  # Saving without a change leaves the counter alone
+        self.assertEqual(self.unread_count(), 2)
+        first.delete()
+        self.assertEqual(self.unread_count(), 1)
+        course.delete()
+        self.assertEqual(self.unread_count(), 0)
+
+    def test_navbar_skips_notification_queries_when_nothing_unread(self):
+        # Test that a page render does not query the Notification table when the counter is zero
+        self.client.login(username='counter_user', password='1234')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('courses'))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([q for q in queries if 'main_notification' in q['sql'].lower()])
+
+    def test_reconcile_command_rebuilds_counters(self):
+        # Test that the reconcile command fixes a drifted counter
+        Notification.objects.create(recipient=self.user, message='Unread')
+        User.objects.filter(pk=self.user.pk).update(unread_notification_count=7)
+        out = StringIO()
+        call_command('reconcile_notification_counts', stdout=out)
+        self.assertEqual(self.unread_count(), 1)
+        self.assertIn('Reconciled 1', out.getvalue())
+
+# Testing that notifications are pushed to the recipient's WebSocket group.
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class NotificationPushTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # Setup for a teacher who is notified when a student enrolls
+        cls.teacher = User.objects.create_user(username='push_teacher', role='TE', password='1234')
+        cls.student = User.objects.create_user(username='push_student', role='ST', password='1234', first_name='Push', last_name='Student')
+        cls.category = Category.objects.create(name='Music')
+        cls.course = Course.objects.create(title='Music 101', description='A course on Music', teacher=cls.teacher, category=cls.category)
+
+    def test_enroll_pushes_notification_to_teacher(self):
+        # Test that enrolling sends the teacher's notification to their group after commit
+        channel_layer = get_channel_layer()
+        channel_name = async_to_sync(channel_layer.new_channel)()
+        async_to_sync(channel_layer.group_add)(notification_group_name(self.teacher.id), channel_name)
+        self.client.login(username='push_student', password='1234')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(reverse('enroll_course', kwargs={'course_id': self.course.id}))
+        event = async_to_sync(channel_layer.receive)(channel_name)
+        self.assertEqual(event['type'], 'notification_message')
+        self.assertEqual(event['notification']['message'], 'Push Student has enrolled in Music 101.')
+        self.assertFalse(event['notification']['read'])
+
+    async def test_consumer_delivers_notification(self):
+        # Test that a connected user receives notifications sent to their group
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), '/ws/notifications/')
+        communicator.scope['user'] = self.teacher
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        await get_channel_layer().group_send(notification_group_name(self.teacher.id), {
+            'type': 'notification_message',
+            'notification': {'id': 1, 'message': 'Hello', 'read': False},
+        })
+        response = await communicator.receive_json_from()
+        self.assertEqual(response['notification']['message'], 'Hello')
+        await communicator.disconnect()
+
+# Testing the batched fan-out of course material notifications.
+class CourseNotificationFanOutTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # Setup for a course with several enrolled students
+        cls.teacher = User.objects.create_user(username='fanout_teacher', role='TE', password='1234')
+        cls.category = Category.objects.create(name='Geography')
+        cls.course = Course.objects.create(title='Geography 101', description='A course on Geography', teacher=cls.teacher, category=cls.category)
+        cls.students = [User.objects.create_user(username=f'fanout_student{i}', role='ST') for i in range(5)]
+        for student in cls.students:
+            Enrollment.objects.create(student=student, course=cls.course)
+
+    @override_settings(NOTIFICATION_BATCH_SIZE=2)
+    def test_fan_out_writes_in_batches(self):
+        # Test that every student is notified using one INSERT per batch of recipients
+        with self.assertNumQueries(1 + 3 * 3 + 1):  # course, three batches of (select, insert, counter update), final empty select
+            total = notify_course_students(self.course.id, 'New material added to Geography 101.')
+        self.assertEqual(total, 5)
+        for student in self.students:
+            self.assertTrue(Notification.objects.filter(recipient=student, course=self.course).exists())
+
+    def test_course_edit_enqueues_fan_out(self):
+        # Test that uploading material enqueues the fan-out instead of notifying inline
+        self.client.login(username='fanout_teacher', password='1234')
+        with mock.patch('Main.views.notify_course_students') as task:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(reverse('course_edit', kwargs={'pk': self.course.pk}), {
+                    'title': self.course.title,
+                    'description': self.course.description,
+                    'category': self.category.id,
+                    'files': SimpleUploadedFile('notes.txt', b'notes'),
+                })
+        task.apply_async.assert_called_once_with((self.course.pk, 'New material added to Geography 101.'))
+        self.assertFalse(Notification.objects.exists())
+        with self.captureOnCommitCallbacks(execute=True):
+            CourseFile.objects.get(course=self.course).file.delete()
+
+    def test_course_edit_succeeds_when_broker_is_down(self):
+        # Test that saved material is not turned into an error page when the fan-out cannot be queued
+        self.client.login(username='fanout_teacher', password='1234')
+        with mock.patch('Main.views.notify_course_students') as task, self.assertLogs('Main.views', 'ERROR'):
+            task.apply_async.side_effect = KombuOperationalError('Broker unavailable')
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(reverse('course_edit', kwargs={'pk': self.course.pk}), {
+                    'title': self.course.title,
+                    'description': self.course.description,
+                    'category': self.category.id,
+                    'files': SimpleUploadedFile('notes.txt', b'notes'),
+                })
+        self.assertRedirects(response, reverse('course_detail', kwargs={'pk': self.course.pk}), fetch_redirect_response=False)
+        self.assertTrue(CourseFile.objects.filter(course=self.course).exists())
+        with self.captureOnCommitCallbacks(execute=True):
+            CourseFile.objects.get(course=self.course).file.delete()
+
+# Testing chunked, resumable uploads of course files.
+@override_settings(COURSE_UPLOAD_CHUNK_SIZE=4)
+class ChunkedUploadTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.teacher = User.objects.create_user(username='upload_teacher', role='TE', password='1234')
+        cls.other_teacher = User.objects.create_user(username='upload_other', role='TE', password='1234')
+        cls.category = Category.objects.create(name='Film')
+        cls.course = Course.objects.create(title='Film 101', description='A course on Film', teacher=cls.teacher, category=cls.category)
+
+    def setUp(self):
+        # Uploads go to temporary directories
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root, COURSE_UPLOAD_PARTIAL_DIR=os.path.join(media_root, 'partial'))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.client.login(username='upload_teacher', password='1234')
+
+    def start(self, data=b'0123456789', **extra):
+        response = self.client.post(reverse('upload_start', kwargs={'course_id': self.course.id}), {
+            'name': 'lecture.mp4', 'file_name': 'Lecture 1', 'size': len(data), **extra,
+        })
+        self.assertEqual(response.status_code, 201)
+        return response.json()
+
+    def put_chunk(self, session, index, data):
+        return self.client.put(
+            reverse('upload_chunk', kwargs={'session_id': session['id'], 'index': index}),
+            data, content_type='application/octet-stream'
+        )
+
+    def complete(self, session):
+        with mock.patch('Main.views.notify_course_students'):
+            return self.client.post(reverse('upload_complete', kwargs={'session_id': session['id']}))
+
+    def test_chunks_are_assembled_into_course_file(self):
+        # Test that chunks sent in order become one course file, created only on completion
+        session = self.start()
+        self.assertEqual((session['chunk_size'], session['next_chunk']), (4, 0))
+        for index, chunk in enumerate((b'0123', b'4567', b'89')):
+            response = self.put_chunk(session, index, chunk)
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['received'], 10)
+        self.assertFalse(CourseFile.objects.exists())
+
+        response = self.complete(session)
+        self.assertEqual(response.status_code, 201)
+        course_file = CourseFile.objects.get(course=self.course)
+        self.assertEqual(course_file.file_name, 'Lecture 1')
+        digest = hashlib.sha256(b'0123456789').hexdigest()
+        self.assertEqual(course_file.file.name, f'course_files/{digest[:2]}/{digest}.mp4')
+        with course_file.file.open('rb') as f:
+            self.assertEqual(f.read(), b'0123456789')
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertEqual(os.listdir(settings.COURSE_UPLOAD_PARTIAL_DIR), [])
+
+    def test_upload_resumes_after_interrupted_chunk(self):
+        # Test that a short chunk is discarded, the status reports where to resume, and repeated chunks are ignored
+        session = self.start()
+        self.put_chunk(session, 0, b'0123')
+        response = self.put_chunk(session, 1, b'45')
+        self.assertEqual(response.status_code, 400)
+        status = self.client.get(reverse('upload_status', kwargs={'session_id': session['id']})).json()
+        self.assertEqual((status['received'], status['next_chunk']), (4, 1))
+
+        self.assertEqual(self.put_chunk(session, 0, b'0123').json()['received'], 4)
+        self.assertEqual(self.put_chunk(session, 2, b'89').status_code, 409)
+        self.put_chunk(session, 1, b'4567')
+        self.put_chunk(session, 2, b'89')
+        self.assertEqual(self.complete(session).status_code, 201)
+        with CourseFile.objects.get().file.open('rb') as f:
+            self.assertEqual(f.read(), b'0123456789')
+
+    def test_incomplete_or_corrupt_upload_is_not_assembled(self):
+        # Test that completion requires every byte and a matching checksum
+        session = self.start(checksum=hashlib.sha256(b'0123456789').hexdigest())
+        self.put_chunk(session, 0, b'0123')
+        self.assertEqual(self.complete(session).status_code, 409)
+        self.put_chunk(session, 1, b'4567')
+        self.put_chunk(session, 2, b'8X')
+        self.assertEqual(self.complete(session).status_code, 400)
+        self.assertFalse(CourseFile.objects.exists())
+        # A corrupt upload starts again from the first chunk
+        self.assertEqual(UploadSession.objects.get().received, 0)
+
+    def test_uploads_are_private_to_their_teacher(self):
+        # Test that only the course's teacher can start an upload, and only its uploader can use it
+        session = self.start()
+        self.client.login(username='upload_other', password='1234')
+        response = self.client.post(reverse('upload_start', kwargs={'course_id': self.course.id}), {'name': 'x', 'size': 1})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.put_chunk(session, 0, b'0123').status_code, 404)
+        self.assertEqual(self.complete(session).status_code, 404)
+
+    def test_chunk_is_received_before_the_upload_is_locked(self):
+        # Test that the chunk is read from the request outside the transaction that appends it
+        session = self.start()
+        depths = []
+        class Stream(BytesIO):
+            def read(stream, size=-1):
+                depths.append(len(connection.savepoint_ids))
+                return super().read(size)
+        depth = len(connection.savepoint_ids)
+        write_chunk(session['id'], 0, Stream(b'0123'))
+        self.assertEqual(set(depths), {depth})
+        self.assertEqual(UploadSession.objects.get().received, 4)
+        self.assertEqual(os.listdir(settings.COURSE_UPLOAD_PARTIAL_DIR), [f"{session['id']}.part"])
+
+    def test_uploads_are_announced_once_per_batch(self):
+        # Test that files completed within the announcement delay give the students a single notification
+        cache.clear()
+        with mock.patch('Main.views.notify_course_students') as task:
+            for i in range(3):
+                session = self.start(data=b'file %d' % i)
+                self.put_chunk(session, 0, b'file')
+                self.put_chunk(session, 1, b' %d' % i)
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.assertEqual(self.client.post(reverse('upload_complete', kwargs={'session_id': session['id']})).status_code, 201)
+        task.apply_async.assert_called_once_with((self.course.id, 'New material added to Film 101.'), countdown=settings.COURSE_FILE_ANNOUNCE_DELAY)
+
+    def test_upload_completes_when_broker_is_down(self):
+        # Test that a completed upload is kept when its announcement cannot be queued, and the next upload retries it
+        cache.clear()
+        with mock.patch('Main.views.notify_course_students') as task:
+            task.apply_async.side_effect = [KombuOperationalError('Broker unavailable'), None]
+            for i in range(2):
+                session = self.start(data=b'file %d' % i)
+                self.put_chunk(session, 0, b'file')
+                self.put_chunk(session, 1, b' %d' % i)
+                with self.assertLogs('Main.views', 'ERROR') if i == 0 else nullcontext(), self.captureOnCommitCallbacks(execute=True):
+                    self.assertEqual(self.client.post(reverse('upload_complete', kwargs={'session_id': session['id']})).status_code, 201)
+        self.assertEqual(task.apply_async.call_count, 2)
+        self.assertEqual(CourseFile.objects.count(), 2)
+
+    def test_expired_uploads_are_removed(self):
+        # Test that expired uploads are deleted with their partial files
+        session = self.start()
+        UploadSession.objects.update(created_at=timezone.now() - timedelta(hours=settings.COURSE_UPLOAD_EXPIRY_HOURS + 1))
+        call_command('expire_uploads', stdout=StringIO())
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertFalse(os.path.exists(os.path.join(settings.COURSE_UPLOAD_PARTIAL_DIR, f"{session['id']}.part")))
+
+# Testing the import of course files from a ZIP archive.
+class CourseArchiveImportTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.teacher = User.objects.create_user(username='import_teacher', role='TE', password='1234')
+        category = Category.objects.create(name='Imports')
+        cls.course = Course.objects.create(title='Imports 101', description='Imports', teacher=cls.teacher, category=category)
+        cls.students = [User.objects.create_user(username=f'import_student{i}', role='ST') for i in range(3)]
+        for student in cls.students:
+            Enrollment.objects.create(student=student, course=cls.course)
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root, COURSE_IMPORT_DIR=os.path.join(media_root, 'imports'))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.client.login(username='import_teacher', password='1234')
+
+    def make_archive(self, files):
+        buffer = BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for name, content in files.items():
+                archive.writestr(name, content)
+        return buffer.getvalue()
+
+    # Uploads the archive and runs the import the view queued, returning the task's result.
+    def import_archive(self, content):
+        with mock.patch('Main.views.import_course_archive') as task:
+            response = self.client.post(reverse('course_import', kwargs={'course_id': self.course.id}), {
+                'archive': SimpleUploadedFile('material.zip', content, content_type='application/zip'),
+            })
+        self.assertRedirects(response, reverse('course_detail', kwargs={'pk': self.course.id}), fetch_redirect_response=False)
+        course_id, path = task.delay.call_args.args
+        self.assertTrue(os.path.exists(path))
+        result = import_course_archive(course_id, path)
+        self.assertFalse(os.path.exists(path))
+        return result
+
+    def notifications(self, user):
+        return list(Notification.objects.filter(recipient=user).values_list('message', flat=True))
+
+    def test_files_are_added_with_one_notification_per_student(self):
+        # Test that each file is added under its path in the archive, and everyone is notified once
+        content = self.make_archive({
+            'Week 1/Intro.pdf': b'intro', 'Week 2/Slides.pptx': b'slides', 'Week 2/.DS_Store': b'', '__MACOSX/._Intro.pdf': b'',
+        })
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.import_archive(content), 2)
+        self.assertEqual(sum(query['sql'].startswith('INSERT INTO "Main_coursefile"') for query in queries), 1)
+        course_files = list(CourseFile.objects.filter(course=self.course).order_by('id'))
+        self.assertEqual([f.file_name for f in course_files], ['Week 1/Intro', 'Week 2/Slides'])
+        with course_files[0].file.open('rb') as f:
+            self.assertEqual(f.read(), b'intro')
+        self.assertEqual(self.notifications(self.teacher), ['2 files were imported into Imports 101.'])
+        for student in self.students:
+            self.assertEqual(self.notifications(student), ['2 new files added to Imports 101.'])
+
+    def test_archive_is_removed_when_import_cannot_be_queued(self):
+        # Test that the kept archive is deleted and the teacher told when the task cannot be queued
+        with mock.patch('Main.views.import_course_archive') as task, self.assertLogs('Main.views', 'ERROR'):
+            task.delay.side_effect = KombuOperationalError('Broker unavailable')
+            response = self.client.post(reverse('course_import', kwargs={'course_id': self.course.id}), {
+                'archive': SimpleUploadedFile('material.zip', self.make_archive({'a.txt': b'a'}), content_type='application/zip'),
+            })
+        self.assertRedirects(response, reverse('course_edit', kwargs={'pk': self.course.id}), fetch_redirect_response=False)
+        self.assertEqual(os.listdir(settings.COURSE_IMPORT_DIR), [])
+
+    def test_zip_bombs_are_refused(self):
+        # Test that archives extracting to too much data, too many files or suspicious ratios add nothing
+        bomb = self.make_archive({'zeros.txt': bytes(2 * 1024 * 1024)})
+        self.assertEqual(self.import_archive(bomb), 0)
+        with override_settings(COURSE_IMPORT_MAX_FILES=2):
+            self.assertEqual(self.import_archive(self.make_archive({f'{i}.txt': b'x' for i in range(3)})), 0)
+        with override_settings(COURSE_IMPORT_MAX_SIZE=5):
+            self.assertEqual(self.import_archive(self.make_archive({'a.txt': b'abc', 'b.txt': b'abc'})), 0)
+        self.assertFalse(CourseFile.objects.exists())
+        self.assertEqual(self.notifications(self.teacher), [
+            'Importing files into Imports 101 failed. zeros.txt is compressed too well to be a real file.',
+            'Importing files into Imports 101 failed. Archives may contain at most 2 files.',
+            'Importing files into Imports 101 failed. Archives may contain at most 5 bytes once extracted.',
+        ])
+        self.assertFalse(Notification.objects.filter(recipient__in=self.students).exists())
+
+    def test_damaged_archive_adds_nothing(self):
+        # Test that a file failing its checksum undoes the whole import, including copies already stored
+        content = bytearray(self.make_archive({'first.txt': b'first file', 'second.txt': b'second file'}))
+        position = content.rindex(zlib.compress(b'second file')[2:-4])
+        content[position] ^= 0xFF
+        self.assertEqual(self.import_archive(bytes(content)), 0)
+        self.assertFalse(CourseFile.objects.exists())
+        self.assertFalse(ContentBlob.objects.exists())
+        stored = [name for _, _, names in os.walk(os.path.join(settings.MEDIA_ROOT, 'course_files')) for name in names]
+        self.assertEqual(stored, [])
+
+    def test_only_zip_archives_are_accepted(self):
+        # Test that other files are refused before anything is queued
+        with mock.patch('Main.views.import_course_archive') as task:
+            response = self.client.post(reverse('course_import', kwargs={'course_id': self.course.id}), {
+                'archive': SimpleUploadedFile('notes.txt', b'notes'),
+            }, follow=True)
+        self.assertContains(response, 'The file is not a ZIP archive.')
+        task.delay.assert_not_called()
+
+
+# Testing the streamed archive of all of a course's files.
+class CourseArchiveTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.teacher = User.objects.create_user(username='archive_teacher', role='TE', password='1234')
+        cls.student = User.objects.create_user(username='archive_student', role='ST', password='1234')
+        User.objects.create_user(username='archive_outsider', role='ST', password='1234')
+        category = Category.objects.create(name='Archives')
+        cls.course = Course.objects.create(title='Archives 101', description='Archives', teacher=cls.teacher, category=category)
+        Enrollment.objects.create(student=cls.student, course=cls.course)
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.url = reverse('download_course_archive', kwargs={'course_id': self.course.id})
+        self.client.login(username='archive_student', password='1234')
+
+    def add_file(self, name, content, file_name):
+        return CourseFile.objects.create(course=self.course, file=SimpleUploadedFile(name, content), file_name=file_name)
+
+    def test_archive_contains_every_file(self):
+        # Test that the archive holds each file under its download name, deflating only uncompressed formats
+        self.add_file('notes.txt', b'notes ' * 1000, 'Notes')
+        self.add_file('other.txt', b'other notes', 'Notes')
+        self.add_file('slides.pdf', b'%PDF slides', 'Week 1/2 slides')
+        response = self.client.get(self.url)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        self.assertEqual(response['Content-Disposition'], "attachment; filename*=UTF-8''Archives%20101.zip")
+        with zipfile.ZipFile(BytesIO(b''.join(response.streaming_content))) as archive:
+            self.assertIsNone(archive.testzip())
+            infos = archive.infolist()
+            self.assertEqual([info.filename for info in infos], ['Notes.txt', 'Notes (2).txt', 'Week 1_2 slides.pdf'])
+            self.assertEqual(archive.read('Notes.txt'), b'notes ' * 1000)
+            self.assertEqual([info.compress_type for info in infos], [zipfile.ZIP_DEFLATED, zipfile.ZIP_DEFLATED, zipfile.ZIP_STORED])
+
+    @mock.patch('Main.downloads.STREAM_BLOCK_SIZE', 4)
+    def test_archive_is_streamed_in_blocks(self):
+        # Test that the archive is sent as it is built, never more than a block of file data at a time
+        self.add_file('video.mp4', b'v' * 40, 'Video')
+        response = self.client.get(self.url)
+        chunks = list(response.streaming_content)
+        self.assertGreater(len(chunks), 10)
+        self.assertLess(max(len(chunk) for chunk in chunks[1:10]), 10)
+        with zipfile.ZipFile(BytesIO(b''.join(chunks))) as archive:
+            self.assertEqual(archive.read('Video.mp4'), b'v' * 40)
+
+    def test_missing_files_are_left_out(self):
+        # Test that a file missing from storage does not break the archive
+        missing = self.add_file('gone.txt', b'gone', 'Gone')
+        os.remove(missing.file.path)
+        self.add_file('kept.txt', b'kept', 'Kept')
+        with self.assertLogs('Main.downloads', 'WARNING'):
+            body = b''.join(self.client.get(self.url).streaming_content)
+        with zipfile.ZipFile(BytesIO(body)) as archive:
+            self.assertEqual(archive.namelist(), ['Kept.txt'])
+
+    def test_only_teacher_and_enrolled_students_can_download(self):
+        # Test that the archive is refused to users outside the course
+        self.client.login(username='archive_teacher', password='1234')
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.client.login(username='archive_outsider', password='1234')
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+
+# Testing that identical course files share one stored copy, released with its last reference.
+class ContentAddressedStorageTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.teacher = User.objects.create_user(username='blob_teacher', role='TE', password='1234')
+        cls.other_teacher = User.objects.create_user(username='blob_other', role='TE', password='1234')
+        category = Category.objects.create(name='Slides')
+        cls.course = Course.objects.create(title='Slides 101', description='Slides', teacher=cls.teacher, category=category)
+        cls.second_course = Course.objects.create(title='Slides 201', description='Slides', teacher=cls.teacher, category=category)
+        cls.other_course = Course.objects.create(title='Slides 301', description='Slides', teacher=cls.other_teacher, category=category)
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root, COURSE_UPLOAD_PARTIAL_DIR=os.path.join(media_root, 'partial'))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def add_file(self, course, content=b'slides'):
+        return CourseFile.objects.create(course=course, file=SimpleUploadedFile('deck.PDF', content), file_name='Deck')
+
+    def test_identical_uploads_share_one_copy(self):
+        # Test that files are stored under their content hash, once however often they are uploaded
+        first = self.add_file(self.course)
+        second = self.add_file(self.second_course)
+        digest = hashlib.sha256(b'slides').hexdigest()
+        self.assertEqual(first.file.name, f'course_files/{digest[:2]}/{digest}.pdf')
+        self.assertEqual(second.file.name, first.file.name)
+        self.assertEqual(ContentBlob.objects.get(name=first.file.name).references, 2)
+        self.assertEqual(os.listdir(os.path.dirname(first.file.path)), [f'{digest}.pdf'])
+        self.assertNotEqual(self.add_file(self.course, b'other slides').file.name, first.file.name)
+
+    def test_copy_is_deleted_with_last_reference(self):
+        # Test that deleting a course file keeps a shared copy, and the last deletion removes it
+        first = self.add_file(self.course)
+        second = self.add_file(self.second_course)
+        path = first.file.path
+        self.client.login(username='blob_teacher', password='1234')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('delete_course_file', kwargs={'file_id': first.id}))
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(ContentBlob.objects.get().references, 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.second_course.delete()
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(ContentBlob.objects.exists())
+
+    def test_copy_stored_again_before_cleanup_is_kept(self):
+        # Test that content saved again between the removal of its last reference and the cleanup survives it
+        first = self.add_file(self.course)
+        path = first.file.path
+        with self.captureOnCommitCallbacks() as callbacks:
+            first.delete()
+        again = self.add_file(self.second_course)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(ContentBlob.objects.get(name=again.file.name).references, 1)
+        with again.file.open('rb') as f:
+            self.assertEqual(f.read(), b'slides')
+        self.assertTrue(os.path.exists(path))
+
+    def test_copy_without_row_is_replaced(self):
+        # Test that a new row always stores the content, replacing a leftover copy that may be incomplete
+        digest = hashlib.sha256(b'slides').hexdigest()
+        path = os.path.join(settings.MEDIA_ROOT, 'course_files', digest[:2], f'{digest}.pdf')
+        os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(b'sli')
+        course_file = self.add_file(self.course)
+        self.assertEqual(course_file.file.path, path)
+        with course_file.file.open('rb') as f:
+            self.assertEqual(f.read(), b'slides')
+
+    def test_files_saved_before_content_addressing_are_deleted(self):
+        # Test that a file without a reference count is deleted with its course file
+        path = os.path.join(settings.MEDIA_ROOT, 'course_files', 'legacy.pdf')
+        os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(b'legacy')
+        course_file = CourseFile.objects.create(course=self.course, file='course_files/legacy.pdf', file_name='Legacy')
+        with self.captureOnCommitCallbacks(execute=True):
+            course_file.delete()
+        self.assertFalse(os.path.exists(path))
+
+    def test_known_content_is_added_without_upload(self):
+        # Test that a teacher re-uploading their own content gets the file at once, and others still upload
+        existing = self.add_file(self.course)
+        checksum = hashlib.sha256(b'slides').hexdigest()
+        self.client.login(username='blob_teacher', password='1234')
+        with mock.patch('Main.views.notify_course_students'):
+            response = self.client.post(reverse('upload_start', kwargs={'course_id': self.second_course.id}), {
+                'name': 'deck.pdf', 'file_name': 'Deck again', 'size': 6, 'checksum': checksum,
+            })
+        self.assertEqual(response.status_code, 201)
+        course_file = CourseFile.objects.get(pk=response.json()['file']['id'])
+        self.assertEqual((course_file.course, course_file.file.name), (self.second_course, existing.file.name))
+        self.assertEqual(ContentBlob.objects.get().references, 2)
+        self.assertFalse(UploadSession.objects.exists())
+
+        self.client.login(username='blob_other', password='1234')
+        response = self.client.post(reverse('upload_start', kwargs={'course_id': self.other_course.id}), {
+            'name': 'deck.pdf', 'size': 6, 'checksum': checksum,
+        })
+        self.assertIn('chunk_size', response.json())
+
+    def test_download_uses_display_name(self):
+        # Test that downloads are named after the file, not its content hash
+        course_file = self.add_file(self.course)
+        Enrollment.objects.create(student=User.objects.create_user(username='blob_student', role='ST', password='1234'), course=self.course)
+        self.client.login(username='blob_student', password='1234')
+        response = self.client.get(reverse('download_course_file', kwargs={'file_id': course_file.id}))
+        self.assertIn('filename="Deck.pdf"', response['Content-Disposition'])
+        response.close()
+
+# Testing the course file download view: access checks, conditional requests, byte ranges and proxy offloading.
+class CourseFileDownloadTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.teacher = User.objects.create_user(username='download_teacher', role='TE', password='1234')
+        cls.student = User.objects.create_user(username='download_student', role='ST', password='1234')
+        cls.outsider = User.objects.create_user(username='download_outsider', role='ST', password='1234')
+        category = Category.objects.create(name='Video')
+        cls.course = Course.objects.create(title='Video 101', description='A course on Video', teacher=cls.teacher, category=category)
+        Enrollment.objects.create(student=cls.student, course=cls.course)
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.course_file = CourseFile.objects.create(course=self.course, file=SimpleUploadedFile('lecture.txt', b'0123456789'), file_name='Lecture')
+        self.url = reverse('download_course_file', kwargs={'file_id': self.course_file.id})
+        self.client.login(username='download_student', password='1234')
+
+    def body(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_only_teacher_and_enrolled_students_can_download(self):
+        # Test that enrolled students and the teacher get the file and others are refused
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), b'0123456789')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('private', response['Cache-Control'])
+        self.client.login(username='download_teacher', password='1234')
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.client.login(username='download_outsider', password='1234')
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def test_course_files_are_not_public_media(self):
+        # Test that the DEBUG media route refuses course files, however the path is written, but serves other media
+        request = RequestFactory().get('/')
+        for path in (self.course_file.file.name, 'images/../' + self.course_file.file.name, '/' + self.course_file.file.name):
+            with self.assertRaises(Http404):
+                serve_public_media(request, path, document_root=settings.MEDIA_ROOT)
+        with open(os.path.join(settings.MEDIA_ROOT, 'logo.txt'), 'wb') as logo:
+            logo.write(b'logo')
+        response = serve_public_media(request, 'logo.txt', document_root=settings.MEDIA_ROOT)
+        self.assertEqual(b''.join(response.streaming_content), b'logo')
+
+    def test_unchanged_file_is_not_sent_again(self):
+        # Test that If-None-Match and If-Modified-Since are answered with 304
+        response = self.client.get(self.url)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+
+    def test_byte_ranges(self):
+        # Test bounded, open-ended and suffix ranges, and ranges outside the file
+        for header, content, content_range in (
+            ('bytes=2-4', b'234', 'bytes 2-4/10'),
+            ('bytes=7-', b'789', 'bytes 7-9/10'),
+            ('bytes=-2', b'89', 'bytes 8-9/10'),
+            ('bytes=5-99', b'56789', 'bytes 5-9/10'),
+        ):
+            response = self.client.get(self.url, HTTP_RANGE=header)
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(response['Content-Range'], content_range)
+            self.assertEqual(int(response['Content-Length']), len(content))
+            self.assertEqual(self.body(response), content)
+        response = self.client.get(self.url, HTTP_RANGE='bytes=10-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */10')
+        # Malformed and multiple ranges get the whole file
+        for header in ('bytes=4-2', 'bytes=0-1,4-5', 'lines=1-2'):
+            self.assertEqual(self.client.get(self.url, HTTP_RANGE=header).status_code, 200)
+
+    def test_range_applies_only_to_unchanged_file(self):
+        # Test that If-Range with a stale validator gets the whole file
+        etag = self.client.get(self.url)['ETag']
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE=etag).status_code, 206)
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE='"stale"').status_code, 200)
+
+    def test_proxy_modes_hand_off_transfer(self):
+        # Test that the offloading modes return the header the proxy needs and no body
+        with override_settings(COURSE_FILE_SERVE_MODE='x-accel-redirect'):
+            response = self.client.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected/' + self.course_file.file.name)
+        self.assertEqual(response.content, b'')
+        with override_settings(COURSE_FILE_SERVE_MODE='x-sendfile'):
+            response = self.client.get(self.url)
+        self.assertEqual(response['X-Sendfile'], self.course_file.file.path)
+
 # Testing the API interaction, specifically the creation of user posts through the API.
 class UserPostAPITest(TestCase):
     @classmethod
@@ -286,6 +1118,119 @@ class UserPostAPITest(TestCase):
         self.assertEqual(UserPost.objects.get().content, 'Hello World') # Verifying the content of the created post
 
 
+# Query Plan Tests
+
+
+# Testing that the hot query shapes are served by an index rather than a full table scan.
+@skipUnless(connection.vendor in ('sqlite', 'postgresql'), 'Query plan checks are written for SQLite and PostgreSQL.')
+class HotQueryPlanTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # Seeding enough rows in each table for the planner to prefer an index
+        cls.teacher = User.objects.create_user(username='plan_teacher', role='TE')
+        category = Category.objects.create(name='Planning')
+        students = [User.objects.create_user(username=f'plan_student{i}', role='ST') for i in range(20)]
+        courses = [Course.objects.create(title=f'Plan {i}', description='Plans', teacher=cls.teacher, category=category) for i in range(10)]
+        cls.student, cls.course = students[0], courses[0]
+        Enrollment.objects.bulk_create([Enrollment(student=student, course=course) for student in students for course in courses])
+        CourseFeedback.objects.bulk_create([CourseFeedback(course=course, user=student, content='Good') for student in students for course in courses])
+        UserPost.objects.bulk_create([UserPost(user=student, content=f'Post {i}') for i in range(10) for student in students])
+        Notification.objects.bulk_create([Notification(recipient=student, message=f'Note {i}', read=i % 2 == 0) for i in range(10) for student in students])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def assertUsesIndex(self, queryset):
+        # Fails if the plan scans the whole table or sorts the rows itself.
+        table = queryset.model._meta.db_table
+        if connection.vendor == 'postgresql':
+            # Disable sequential scans so a plan that still uses one has no index to fall back on.
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+            plan = queryset.explain()
+            self.assertNotIn('Seq Scan', plan, plan)
+        else:
+            plan = queryset.explain()
+            self.assertIsNone(re.search(rf'\bSCAN {table}\b(?! USING)', plan), plan)
+            self.assertNotIn('USE TEMP B-TREE FOR ORDER BY', plan, plan)
+
+    def test_unread_notifications_query(self):
+        self.assertUsesIndex(Notification.objects.filter(recipient=self.student, read=False).order_by('-created_at')[:5])
+
+    def test_enrollment_lookup_query(self):
+        self.assertUsesIndex(Enrollment.objects.filter(student=self.student, course=self.course))
+
+    def test_course_feedback_query(self):
+        self.assertUsesIndex(CourseFeedback.objects.filter(course=self.course).order_by('-created_at'))
+
+    def test_latest_user_posts_query(self):
+        self.assertUsesIndex(UserPost.objects.order_by('-created_at', '-id')[:5])
+
+    def test_enrollment_is_unique(self):
+        # Test that the same student cannot be enrolled twice in a course
+        with self.assertRaises(IntegrityError):
+            Enrollment.objects.create(student=self.student, course=self.course)
+
+
+# Testing conditional GET support on the polling and API endpoints.
+class ConditionalGetTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.teacher = User.objects.create_user(username='etag_teacher', role='TE', password='1234')
+        cls.category = Category.objects.create(name='Etags')
+        cls.course = Course.objects.create(title='Caching 101', description='Validators', teacher=cls.teacher, category=cls.category)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_fetch_notifications_not_modified(self):
+        # Test that an unchanged notification list is answered with 304, and a new notification changes the tag
+        self.client.login(username='etag_teacher', password='1234')
+        response = self.client.get(reverse('fetch_notifications'))
+        etag = response['ETag']
+        response = self.client.get(reverse('fetch_notifications'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        Notification.objects.create(recipient=self.teacher, message='New')
+        response = self.client.get(reverse('fetch_notifications'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['notifications']), 1)
+
+    def test_viewset_not_modified_until_change(self):
+        # Test that the course list answers 304 without any query until a course changes
+        client = APIClient()
+        client.force_authenticate(user=self.teacher)
+        response = client.get('/api/courses/', format='json')
+        etag = response['ETag']
+        self.assertIn('no-cache', response['Cache-Control'])
+        with self.assertNumQueries(0):
+            response = client.get('/api/courses/', format='json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.course.title = 'Caching 102'
+            self.course.save()
+        response = client.get('/api/courses/', format='json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['title'], 'Caching 102')
+
+    def test_login_does_not_change_tag(self):
+        # Test that the last_login save of a login leaves the user version, and so the tags, alone
+        before = get_versions(['user'])['user']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(self.client.login(username='etag_teacher', password='1234'))
+        self.assertEqual(get_versions(['user'])['user'], before)
+
+    def test_expanded_teacher_rename_changes_tag(self):
+        # Test that renaming the teacher invalidates the list with the teacher expanded
+        client = APIClient()
+        client.force_authenticate(user=self.teacher)
+        etag = client.get('/api/courses/?expand=teacher', format='json')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.teacher.first_name = 'Renamed'
+            self.teacher.save()
+        response = client.get('/api/courses/?expand=teacher', format='json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['teacher']['first_name'], 'Renamed')
+
+
 # Live Search Tests
         
 
@@ -376,6 +1321,98 @@ class CourseViewSetTest(TestCase):
         self.assertEqual(response.data['title'], 'Python Programming') # Data integrity check
         self.client.force_authenticate(user=None) 
 
+# Testing sparse fieldsets, expansions and the query budget of the courses API.
+class CourseAPIFieldsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.teacher = User.objects.create_user(username='fields_teacher', role='TE', first_name='Field', last_name='Teacher')
+        cls.category = Category.objects.create(name='Fields')
+        students = [User.objects.create_user(username=f'fields_student{i}', role='ST') for i in range(3)]
+        for i in range(4):
+            course = Course.objects.create(title=f'Fields {i}', description='Sparse', teacher=cls.teacher, category=cls.category)
+            for student in students[:i]:
+                Enrollment.objects.create(student=student, course=course)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.teacher)
+
+    def get_courses(self, **params):
+        response = self.client.get('/api/courses/', params, format='json')
+        self.assertEqual(response.status_code, 200)
+        return sorted(response.data['results'], key=lambda course: course['id'])
+
+    def test_sparse_fields_and_student_count(self):
+        # Test that only the requested fields are returned, with the count computed by annotation
+        courses = self.get_courses(fields='id,title,student_count')
+        self.assertEqual(set(courses[0]), {'id', 'title', 'student_count'})
+        self.assertEqual([course['student_count'] for course in courses], [0, 1, 2, 3])
+
+    def test_default_fields_unchanged(self):
+        courses = self.get_courses()
+        self.assertNotIn('student_count', courses[0])
+        self.assertEqual(len(courses[3]['students']), 3)
+
+    def test_expand(self):
+        # Test that expanded relations are nested objects instead of ids
+        courses = self.get_courses(fields='id,teacher,category,students', expand='teacher,category,students')
+        self.assertEqual(courses[0]['teacher']['first_name'], 'Field')
+        self.assertEqual(courses[0]['category'], {'id': self.category.id, 'name': 'Fields'})
+        self.assertEqual(len(courses[2]['students']), 2)
+
+    def test_query_count_does_not_grow_with_courses(self):
+        # Test that listing costs a fixed number of queries however many courses there are
+        for params in ({}, {'fields': 'id,student_count'}, {'expand': 'teacher,category,students'}):
+            with self.subTest(params=params):
+                with CaptureQueriesContext(connection) as before:
+                    self.get_courses(**params)
+                Course.objects.create(title='Extra', description='More', teacher=self.teacher, category=self.category)
+                with CaptureQueriesContext(connection) as after:
+                    self.get_courses(**params)
+                self.assertEqual(len(before), len(after))
+                self.assertLessEqual(len(after), 2)
+
+
+# Testing cursor pagination and page-size caps on the API viewsets.
+class APIPaginationTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.teacher = User.objects.create_user(username='page_teacher', role='TE')
+        category = Category.objects.create(name='Paging')
+        course = Course.objects.create(title='Paging 101', description='Pages', teacher=cls.teacher, category=category)
+        CourseFeedback.objects.bulk_create([CourseFeedback(course=course, user=cls.teacher, content=f'Feedback {i}') for i in range(5)])
+        UserPost.objects.bulk_create([UserPost(user=cls.teacher, content=f'Post {i}') for i in range(5)])
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.teacher)
+
+    def collect(self, url):
+        # Follows the next links, returning the ids of every page
+        pages = []
+        while url:
+            response = self.client.get(url, format='json')
+            self.assertEqual(response.status_code, 200)
+            pages.append([row['id'] for row in response.data['results']])
+            url = response.data['next']
+        return pages
+
+    def test_feedback_pages_newest_first(self):
+        pages = self.collect('/api/feedback/?page_size=2')
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        self.assertEqual(sum(pages, []), list(CourseFeedback.objects.order_by('-id').values_list('id', flat=True)))
+
+    def test_user_posts_in_feed_order(self):
+        pages = self.collect('/api/userposts/?page_size=3')
+        self.assertEqual(sum(pages, []), list(UserPost.objects.order_by('-created_at', '-id').values_list('id', flat=True)))
+
+    def test_page_size_is_capped(self):
+        User.objects.bulk_create([User(username=f'page_user{i}', role='ST') for i in range(CappedCursorPagination.max_page_size + 5)])
+        response = self.client.get('/api/profiles/', {'page_size': 10000}, format='json')
+        self.assertEqual(len(response.data['results']), CappedCursorPagination.max_page_size)
+        self.assertIsNotNone(response.data['next'])
+
+
 # This test class is for testing the Course API functionality.
 class CourseAPITest(TestCase):
     def test_course_list(self):
@@ -402,6 +1439,548 @@ class ProfileViewTest(TestCase):
         self.assertContains(response, self.user.username) # Profile should contain the user's username
 
 
+# Testing the keyset-paginated status feed.
+@override_settings(FEED_PAGE_SIZE=3)
+class UserPostFeedTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # Creating more posts than fit on one page, some sharing a timestamp
+        cls.user = User.objects.create_user(username='feed_user', role='ST', password='1234')
+        posts = UserPost.objects.bulk_create([UserPost(user=cls.user, content=f'Post {i}') for i in range(8)])
+        UserPost.objects.filter(pk__in=[post.pk for post in posts[:4]]).update(created_at=posts[0].created_at)
+
+    def test_api_pages_cover_every_post_once(self):
+        # Test that following the cursors returns each post exactly once, newest first
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        seen, cursor = [], None
+        while True:
+            response = client.get(reverse('latest_user_posts'), {'cursor': cursor} if cursor else {})
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.data['results']), 3)
+            seen += [post['id'] for post in response.data['results']]
+            cursor = response.data['next_cursor']
+            if not cursor:
+                break
+        expected = list(UserPost.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_invalid_cursor(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        response = client.get(reverse('latest_user_posts'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_profile_renders_first_page_only(self):
+        # Test that the profile renders one page of posts with their authors loaded in the same query
+        self.client.login(username='feed_user', password='1234')
+        response = self.client.get(reverse('profile'))
+        self.assertEqual(len(response.context['user_post']), 3)
+        self.assertIsNotNone(response.context['next_cursor'])
+        with self.assertNumQueries(0):
+            [post.user.get_full_name() for post in response.context['user_post']]
+
+
+# Testing that new posts are streamed to the feed group, encoded once.
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class UserPostStreamTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='stream_user', role='TE', password='1234', first_name='Stream', last_name='User')
+
+    def test_new_posts_are_broadcast(self):
+        # Test that posts from the form view and from the API both reach the feed group
+        channel_layer = get_channel_layer()
+        channel_name = async_to_sync(channel_layer.new_channel)()
+        async_to_sync(channel_layer.group_add)(FEED_GROUP_NAME, channel_name)
+        self.client.login(username='stream_user', password='1234')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('user_post_update'), {'content': 'From the form'})
+            self.client.post(reverse('latest_user_posts'), {'content': 'From the API'})
+        for content in ('From the form', 'From the API'):
+            event = async_to_sync(channel_layer.receive)(channel_name)
+            post = json.loads(event['text'])['post']
+            self.assertEqual(post['content'], content)
+            self.assertEqual(post['user_full_name'], 'Stream User')
+            self.assertEqual(post['user_role'], 'Teacher')
+
+    async def test_consumer_forwards_encoded_post(self):
+        # Test that the feed consumer forwards the pre-encoded text unchanged
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), '/ws/feed/')
+        communicator.scope['user'] = self.user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        await get_channel_layer().group_send(FEED_GROUP_NAME, {'type': 'user_post_message', 'text': '{"post": {"id": 1}}'})
+        self.assertEqual(await communicator.receive_from(), '{"post": {"id": 1}}')
+        await communicator.disconnect()
+
+
+# Testing the chat consumer: saved and replayed history, batching for busy rooms, and connection limits.
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}, CHAT_FLUSH_BATCH_SIZE=2, CHAT_HISTORY_SIZE=3)
+class ChatConsumerTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.teacher = User.objects.create_user(username='chat_teacher', role='TE', password='1234')
+        cls.category = Category.objects.create(name='Drama')
+        cls.course = Course.objects.create(title='Drama 101', description='A course on Drama', teacher=cls.teacher, category=cls.category)
+
+    def setUp(self):
+        # Each test starts with an empty buffer, no rooms in memory and no limit counts
+        cache.clear()
+        for name, instance in (('write_buffer', ChatWriteBuffer()), ('recent_messages', RecentChatMessages()), ('coalescer', ChatCoalescer())):
+            patcher = mock.patch(f'Main.consumers.{name}', instance)
+            setattr(self, name, patcher.start())
+            self.addCleanup(patcher.stop)
+
+    async def join(self):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/chat/{self.course.id}/')
+        communicator.scope['user'] = self.teacher
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def test_messages_are_saved_in_batches(self):
+        # Test that nothing is written until a batch fills, then the batch is written at once
+        communicator = await self.join()
+        await communicator.send_json_to({'message': 'first'})
+        self.assertEqual((await communicator.receive_json_from())['message'], 'first')
+        self.assertEqual(await ChatMessage.objects.acount(), 0)
+        await communicator.send_json_to({'message': 'second'})
+        await communicator.receive_json_from()
+        # The full batch is written in the background
+        await asyncio.gather(*self.write_buffer.tasks)
+        self.assertEqual(await ChatMessage.objects.acount(), 2)
+        message = await ChatMessage.objects.aget(message='first')
+        self.assertEqual(message.user_id, self.teacher.id)
+        self.assertEqual(message.username, 'chat_teacher')
+        await communicator.disconnect()
+
+    async def test_only_members_can_join(self):
+        # Test that anonymous users, users outside the course and rooms of missing courses are refused
+        outsider = await sync_to_async(User.objects.create_user)(username='chat_outsider', role='ST')
+        student = await sync_to_async(User.objects.create_user)(username='chat_student', role='ST')
+        await Enrollment.objects.acreate(student=student, course=self.course)
+        for user, course_id, allowed in (
+            (AnonymousUser(), self.course.id, False), (outsider, self.course.id, False),
+            (self.teacher, 999999, False), (student, self.course.id, True),
+        ):
+            with self.subTest(user=str(user), course_id=course_id):
+                communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/chat/{course_id}/')
+                communicator.scope['user'] = user
+                connected, _ = await communicator.connect()
+                self.assertEqual(connected, allowed)
+                await communicator.disconnect()
+        self.assertEqual(self.recent_messages.members[self.course.id], 0)
+
+    async def test_bad_message_does_not_lose_the_batch(self):
+        # Test that a message that cannot be saved is dropped on its own, and the rest of its batch is saved
+        good = ChatMessage(course_id=self.course.id, username='good', message='good')
+        bad = ChatMessage(course_id=None, username='bad', message='bad')
+        with self.assertLogs('Main.chat', 'ERROR'):
+            await self.write_buffer.add(good)
+            await self.write_buffer.add(bad)
+            await asyncio.gather(*self.write_buffer.tasks)
+        self.assertEqual([message async for message in ChatMessage.objects.values_list('message', flat=True)], ['good'])
+
+    @override_settings(CHAT_FLUSH_INTERVAL_MS=10)
+    async def test_partial_batch_is_saved_after_interval(self):
+        # Test that a message is saved after the flush interval even if the batch is not full
+        communicator = await self.join()
+        await communicator.send_json_to({'message': 'lonely'})
+        await communicator.receive_json_from()
+        await asyncio.sleep(0.1)
+        self.assertEqual(await ChatMessage.objects.acount(), 1)
+        await communicator.disconnect()
+
+    async def test_joining_client_gets_recent_messages_without_query(self):
+        # Test that the last messages are loaded once, then replayed from memory to later clients
+        for i in range(4):
+            await ChatMessage.objects.acreate(course=self.course, username='old', message=f'old {i}')
+        first = await self.join()
+        replay = [message['message'] for message in await first.receive_json_from()]
+        self.assertEqual(replay, ['old 1', 'old 2', 'old 3'])
+        await first.send_json_to({'message': 'new'})
+        await first.receive_json_from()
+
+        with mock.patch.object(RecentChatMessages, 'load') as load:
+            second = await self.join()
+            replay = [message['message'] for message in await second.receive_json_from()]
+        self.assertEqual(replay, ['old 2', 'old 3', 'new'])
+        load.assert_not_called()
+        self.assertTrue(await second.receive_nothing())
+        await first.disconnect()
+        await second.disconnect()
+
+    async def test_replayed_messages_are_not_sent_again(self):
+        # Test that a broadcast which was already in the replayed history is skipped, and later ones are sent
+        message = await ChatMessage.objects.acreate(course=self.course, username='early', message='early')
+        communicator = await self.join()
+        self.assertEqual([payload['message'] for payload in await communicator.receive_json_from()], ['early'])
+        group_name = f'chat_{self.course.id}'
+        await get_channel_layer().group_send(group_name, {'type': 'chat_message', **serialize_chat_message(message)})
+        self.assertTrue(await communicator.receive_nothing())
+        await get_channel_layer().group_send(group_name, {
+            'type': 'chat_message', 'id': 'later', 'message': 'later', 'username': 'later', 'user_id': 'Anonymous',
+        })
+        self.assertEqual((await communicator.receive_json_from())['message'], 'later')
+        await communicator.disconnect()
+
+    async def test_last_member_leaving_saves_pending_messages(self):
+        # Test that pending messages are written when the room empties
+        communicator = await self.join()
+        await communicator.send_json_to({'message': 'goodbye'})
+        await communicator.receive_json_from()
+        await communicator.disconnect()
+        self.assertTrue(await ChatMessage.objects.filter(message='goodbye').aexists())
+
+    @override_settings(CHAT_COALESCE_MIN_MEMBERS=2)
+    async def test_busy_room_sends_batches(self):
+        # Test that a room at the member threshold sends a burst as one array frame to every member
+        first = await self.join()
+        second = await self.join()
+        for text in ('one', 'two', 'three'):
+            await first.send_json_to({'message': text})
+        for communicator in (first, second):
+            batch = await communicator.receive_json_from()
+            self.assertEqual([message['message'] for message in batch], ['one', 'two', 'three'])
+            self.assertTrue(await communicator.receive_nothing())
+        await second.disconnect()
+
+        # Batched messages are part of the history replayed to new members
+        third = await self.join()
+        self.assertEqual([message['message'] for message in await third.receive_json_from()], ['one', 'two', 'three'])
+        await first.disconnect()
+        await third.disconnect()
+
+    @override_settings(CHAT_COALESCE_MIN_RATE=2)
+    @mock.patch('Main.chat.monotonic', return_value=100.0)
+    async def test_message_rate_switches_batching_on(self, monotonic):
+        # Test that messages are sent singly until the room reaches the rate threshold
+        communicator = await self.join()
+        await communicator.send_json_to({'message': 'quiet'})
+        self.assertEqual((await communicator.receive_json_from())['message'], 'quiet')
+        await communicator.send_json_to({'message': 'busy'})
+        await communicator.send_json_to({'message': 'busier'})
+        batch = await communicator.receive_json_from()
+        self.assertEqual([message['message'] for message in batch], ['busy', 'busier'])
+        await communicator.disconnect()
+
+    @override_settings(CHAT_MAX_MESSAGE_LENGTH=30)
+    async def test_oversized_and_invalid_frames_are_rejected(self):
+        # Test that oversized, malformed and binary frames are answered with an error and not broadcast
+        communicator = await self.join()
+        await communicator.send_json_to({'message': 'x' * 30})
+        self.assertEqual(await communicator.receive_json_from(), {'error': 'too_large'})
+        for frame in ('not json', '{"text": "hi"}', '{"message": 1}'):
+            await communicator.send_to(text_data=frame)
+            self.assertEqual(await communicator.receive_json_from(), {'error': 'invalid'})
+        await communicator.send_to(bytes_data=b'binary')
+        self.assertEqual(await communicator.receive_json_from(), {'error': 'invalid'})
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+        self.assertEqual(await ChatMessage.objects.acount(), 0)
+        counts = await sync_to_async(get_chat_limit_counts)()
+        self.assertEqual(counts['too_large'], 1)
+        self.assertEqual(counts['invalid'], 4)
+
+    @override_settings(CHAT_RATE_LIMIT=0, CHAT_RATE_BURST=2)
+    async def test_messages_beyond_rate_limit_are_rejected(self):
+        # Test that a connection may send its burst, after which messages are rejected
+        communicator = await self.join()
+        for text in ('one', 'two', 'three'):
+            await communicator.send_json_to({'message': text})
+        # The rejection is sent straight back, so it can overtake the broadcasts
+        frames = [await communicator.receive_json_from() for _ in range(3)]
+        self.assertIn({'error': 'rate_limited'}, frames)
+        self.assertEqual([frame['message'] for frame in frames if 'message' in frame], ['one', 'two'])
+        await communicator.disconnect()
+        self.assertEqual((await sync_to_async(get_chat_limit_counts)())['rate_limited'], 1)
+
+    @override_settings(CHAT_OUTBOUND_BUFFER_SIZE=200)
+    async def test_slow_client_is_disconnected(self):
+        # Test that a client whose frames pile up in the server's transport is closed once they pass the limit
+        protocol = StalledProtocol()
+        communicator = WebsocketCommunicator(stalled_server(protocol), f'/ws/chat/{self.course.id}/')
+        communicator.scope['user'] = self.teacher
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        for i in range(5):
+            await get_channel_layer().group_send(f'chat_{self.course.id}', {
+                'type': 'chat_message', 'id': str(i), 'message': 'x' * 50, 'username': 'flood', 'user_id': 'Anonymous',
+            })
+        outputs = []
+        while not outputs or outputs[-1]['type'] != 'websocket.close':
+            outputs.append(await communicator.receive_output())
+        self.assertEqual(outputs[-1], {'type': 'websocket.close', 'code': 1013})
+        # Frames before the close were sent until the limit was reached
+        self.assertGreater(len(outputs), 1)
+        self.assertLess(len(outputs), 6)
+        self.assertTrue(all(output['type'] == 'websocket.send' for output in outputs[:-1]))
+        self.assertLessEqual(protocol.transport._tempDataLen, 200)
+        self.assertEqual((await sync_to_async(get_chat_limit_counts)())['slow_client'], 1)
+        await communicator.disconnect()
+
+    @override_settings(CHAT_SEND_TIMEOUT=0.05)
+    async def test_client_whose_sends_stall_is_disconnected(self):
+        # Test that a client is closed when the server does not take a frame in time, as servers do for clients
+        # that stopped reading
+        application = URLRouter(websocket_urlpatterns)
+        async def server(scope, receive, send):
+            async def stalling_send(message):
+                if message['type'] == 'websocket.send':
+                    await asyncio.Event().wait()
+                await send(message)
+            return await application(scope, receive, stalling_send)
+        communicator = WebsocketCommunicator(server, f'/ws/chat/{self.course.id}/')
+        communicator.scope['user'] = self.teacher
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        await get_channel_layer().group_send(f'chat_{self.course.id}', {
+            'type': 'chat_message', 'id': 'stuck', 'message': 'stuck', 'username': 'flood', 'user_id': 'Anonymous',
+        })
+        self.assertEqual(await communicator.receive_output(), {'type': 'websocket.close', 'code': 1013})
+        self.assertEqual((await sync_to_async(get_chat_limit_counts)())['slow_client'], 1)
+        await communicator.disconnect()
+
+    async def test_failed_join_cleans_up(self):
+        # Test that a connection whose history cannot be loaded leaves no member counted and no writer running
+        tasks = asyncio.all_tasks()
+        with mock.patch.object(RecentChatMessages, 'load', side_effect=DatabaseError):
+            communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/chat/{self.course.id}/')
+            communicator.scope['user'] = self.teacher
+            # The connection is accepted before the history is loaded.
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            with self.assertRaises(DatabaseError):
+                await communicator.receive_output()
+        await asyncio.sleep(0)
+        self.assertEqual(self.recent_messages.members[self.course.id], 0)
+        self.assertEqual([task for task in asyncio.all_tasks() - tasks if not task.done()], [])
+
+
+# Stands in for a daphne protocol whose client stopped reading: every frame sent stays in its transport's
+# buffer, counted the way Twisted counts data it has not written yet.
+class StalledProtocol:
+    def __init__(self):
+        self.transport = mock.Mock(dataBuffer=b'', offset=0, _tempDataLen=0, spec=['dataBuffer', 'offset', '_tempDataLen'])
+
+# The chat application as daphne runs it, sending through partial(handle_reply, protocol).
+def stalled_server(protocol):
+    application = TransportBufferMiddleware(URLRouter(websocket_urlpatterns))
+    async def server(scope, receive, send):
+        async def handle_reply(protocol, message):
+            protocol.transport._tempDataLen += len(message.get('text', ''))
+            await send(message)
+        return await application(scope, receive, partial(handle_reply, protocol))
+    return server
+
+
+# Testing that the pending bytes of daphne's and asyncio's transports are found.
+class TransportBufferTest(TestCase):
+    def test_twisted_transport(self):
+        transport = mock.Mock(dataBuffer=b'x' * 100, offset=40, _tempDataLen=25, spec=['dataBuffer', 'offset', '_tempDataLen'])
+        send = partial(mock.Mock(), mock.Mock(transport=transport))
+        self.assertIs(find_transport(send), transport)
+        self.assertEqual(transport_buffer_size(transport), 85)
+
+    def test_asyncio_transport(self):
+        transport = mock.Mock(spec=['get_write_buffer_size'])
+        transport.get_write_buffer_size.return_value = 12
+        self.assertEqual(transport_buffer_size(transport), 12)
+
+    def test_send_without_transport(self):
+        self.assertIsNone(find_transport(mock.AsyncMock()))
+        # A transport that keeps its buffer elsewhere cannot be measured
+        self.assertIsNone(find_transport(partial(mock.Mock(), mock.Mock(transport=mock.Mock(spec=['write'])))))
+
+    def test_unmeasured_transport_is_logged_once(self):
+        # Test that falling back to the consumer's own limits is logged, once per process
+        async def application(scope, receive, send):
+            pass
+        middleware = TransportBufferMiddleware(application)
+        with mock.patch.object(TransportBufferMiddleware, 'warned', False):
+            with self.assertLogs('Main.transports', 'WARNING') as logs:
+                async_to_sync(middleware)({'type': 'websocket'}, None, mock.AsyncMock())
+                async_to_sync(middleware)({'type': 'websocket'}, None, mock.AsyncMock())
+        self.assertEqual(len(logs.records), 1)
+
+
+# Testing that the list fast path of UserPostSerializer matches serializing each post.
+class UserPostListSerializerTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        teacher = User.objects.create_user(username='fast_teacher', role='TE', first_name='Fast', last_name='Teacher')
+        student = User.objects.create_user(username='fast_student', role='ST', first_name='Quick', last_name='')
+        student.photo = ''
+        student.save()
+        posts = UserPost.objects.bulk_create([UserPost(user=teacher if i % 2 else student, content=f'Post {i}') for i in range(6)])
+        for i, post in enumerate(posts):
+            UserPost.objects.filter(pk=post.pk).update(created_at=post.created_at - timedelta(hours=13 * i))
+
+    def test_matches_per_field_serializer(self):
+        request = APIRequestFactory().get('/api/userposts/', HTTP_HOST='localhost')
+        queryset = UserPost.objects.select_related('user').order_by('id')
+        for context in ({'request': request}, {}):
+            with self.subTest(request='request' in context):
+                expected = serializers.ListSerializer(list(queryset), child=UserPostSerializer(), context=context).data
+                self.assertEqual(UserPostSerializer(queryset, many=True, context=context).data, expected)
+                self.assertEqual(UserPostSerializer(list(queryset), many=True, context=context).data, expected)
+
+    def test_datetime_format_matches_dateformat(self):
+        # Test that formats with and without seconds, and with escaped letters, format like DateFormat
+        base = timezone.now().replace(second=5)
+        values = [base, base + timedelta(seconds=30), base + timedelta(minutes=1), base + timedelta(days=40)]
+        for format_string in ('N j, Y, P', 'Y-m-d H:i:s', r'\a\t H:i', 'l jS F Y h:i A'):
+            with self.subTest(format=format_string):
+                format_datetime = compile_datetime_format(format_string)
+                self.assertEqual([format_datetime(value) for value in values], [DateFormat(value).format(format_string) for value in values])
+
+    def test_queryset_is_read_in_one_query(self):
+        with self.assertNumQueries(1):
+            UserPostSerializer(UserPost.objects.all(), many=True).data
+
+
+# Testing the fixed-size variants of profile photos.
+class PhotoVariantTest(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def photo(self, size=(800, 600), mode='RGB', name='me.png'):
+        buffer = BytesIO()
+        Image.new(mode, size, 'red').save(buffer, 'PNG')
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+    def variant_size(self, user, variant):
+        with Image.open(os.path.join(settings.MEDIA_ROOT, variant_name(user.photo.name, variant))) as image:
+            return image.format, image.size
+
+    def test_variants_are_created_on_upload(self):
+        # Test that saving a photo stores every variant next to it, cropped or scaled as configured
+        user = User.objects.create_user(username='photo_user', role='ST', photo=self.photo(mode='RGBA'))
+        self.assertEqual(self.variant_size(user, 'nav'), ('JPEG', (60, 60)))
+        self.assertEqual(self.variant_size(user, 'feed'), ('JPEG', (60, 60)))
+        self.assertEqual(self.variant_size(user, 'profile'), ('JPEG', (400, 300)))
+        self.assertEqual(variant_name(user.photo.name, 'nav'), 'images/thumbnails/me.png.nav.jpg')
+
+    def test_missing_variants_are_created_on_first_use(self):
+        # Test that photos saved without variants get them when first shown, and unreadable photos fall back
+        user = User.objects.create_user(username='photo_user', role='ST', photo=self.photo())
+        path = os.path.join(settings.MEDIA_ROOT, variant_name(user.photo.name, 'nav'))
+        os.remove(path)
+        self.assertEqual(photo_variant_url(user.photo, 'nav'), '/images/images/thumbnails/me.png.nav.jpg')
+        self.assertTrue(os.path.exists(path))
+
+        user.photo.save('broken.jpg', SimpleUploadedFile('broken.jpg', b'not an image'), save=False)
+        with self.assertLogs('Main.thumbnails', 'WARNING'):
+            self.assertEqual(photo_variant_url(user.photo, 'feed'), user.photo.url)
+        self.assertIsNone(photo_variant_url(None, 'feed'))
+        with self.assertRaises(ValueError):
+            photo_variant_url(user.photo, 'poster')
+
+    def test_pages_and_api_link_to_variants(self):
+        # Test that the navbar, profile and post feed serve variants instead of the original photo
+        user = User.objects.create_user(username='photo_user', role='ST', password='1234', photo=self.photo())
+        UserPost.objects.create(user=user, content='Hello')
+        self.client.login(username='photo_user', password='1234')
+        content = self.client.get(reverse('profile')).content.decode()
+        for variant in ('nav', 'feed', 'profile'):
+            self.assertIn(f'/images/images/thumbnails/me.png.{variant}.jpg', content)
+        self.assertNotIn('src="/images/images/me.png"', content)
+
+        posts = UserPost.objects.select_related('user')
+        expected = 'http://testserver/images/images/thumbnails/me.png.feed.jpg'
+        request = APIRequestFactory().get('/api/userposts/')
+        self.assertEqual(UserPostSerializer(posts, many=True, context={'request': request}).data[0]['user_photo_url'], expected)
+        self.assertEqual(UserPostSerializer(posts.get(), context={'request': request}).data['user_photo_url'], expected)
+
+
+# Testing that new SQLite connections are tuned with the database profile's PRAGMAs.
+@skipUnless(connection.vendor == 'sqlite', 'SQLite only')
+class SQLitePragmaTest(TestCase):
+    @override_settings(SQLITE_PRAGMAS={'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'busy_timeout': 1234, 'mmap_size': 65536})
+    def test_new_connections_are_tuned(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        tuned = type(connections['default'])({**connection.settings_dict, 'NAME': os.path.join(directory, 'db.sqlite3')}, alias='tuned')
+        self.addCleanup(tuned.close)
+        values = []
+        with tuned.cursor() as cursor:
+            for pragma in ('journal_mode', 'synchronous', 'busy_timeout', 'mmap_size'):
+                cursor.execute(f'PRAGMA {pragma}')
+                values.append(cursor.fetchone()[0])
+        self.assertEqual(values, ['wal', 1, 1234, 65536])
+
+
+# Testing that requests read from a replica unless they could miss their own writes.
+@override_settings(DATABASE_REPLICAS=['replica1'], REPLICA_PIN_SECONDS=10)
+class ReplicaRoutingTest(TestCase):
+    # Handles the request through the middleware, noting where it reads `model` from before and after running `work`.
+    def handle(self, request, work=lambda: None, model=Course):
+        reads = []
+        def view(request):
+            reads.append(router.db_for_read(model))
+            work()
+            reads.append(router.db_for_read(model))
+            return HttpResponse()
+        return ReplicaRoutingMiddleware(view)(request), reads
+
+    def test_reads_go_to_a_replica(self):
+        # Test that reads in requests use the replica, and reads outside requests the primary
+        response, reads = self.handle(RequestFactory().get('/courses/'))
+        self.assertEqual(reads, ['replica1', 'replica1'])
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+        self.assertEqual(router.db_for_read(Course), 'default')
+        self.assertEqual(router.db_for_write(Course), 'default')
+
+    def test_writes_pin_the_request_and_client_to_the_primary(self):
+        # Test that a request reads its own writes, and so do the client's next requests
+        response, reads = self.handle(RequestFactory().get('/courses/'), lambda: Category.objects.create(name='Pinned'))
+        self.assertEqual(reads, ['replica1', 'default'])
+        self.assertEqual(response.cookies[PIN_COOKIE]['max-age'], 10)
+
+        request = RequestFactory().get('/courses/')
+        request.COOKIES[PIN_COOKIE] = '1'
+        self.assertEqual(self.handle(request)[1], ['default', 'default'])
+        self.assertEqual(self.handle(RequestFactory().post('/courses/'))[1], ['default', 'default'])
+
+    def test_sessions_are_read_from_the_primary(self):
+        # Test that sessions never lag behind a login
+        self.assertEqual(self.handle(RequestFactory().get('/'), model=Session)[1], ['default', 'default'])
+
+    def test_stamped_data_is_read_from_the_primary(self):
+        # Test that a catalog miss after a bump, and a versioned API response, do not read a lagging replica
+        def rebuild_catalog():
+            bump_version('course')
+            with CaptureQueriesContext(connection) as queries:
+                get_course_catalog()
+            self.assertEqual(len(queries), 2)
+        self.assertEqual(self.handle(RequestFactory().get('/courses/'), rebuild_catalog)[1], ['replica1', 'replica1'])
+
+        reads = []
+        db_for_read = PrimaryReplicaRouter.db_for_read
+        def record_read(router, model, **hints):
+            reads.append(db_for_read(router, model, **hints))
+            return reads[-1]
+        request = APIRequestFactory().get('/api/courses/')
+        force_authenticate(request, user=User.objects.create_user(username='replica_reader', role='ST'))
+        with mock.patch.object(PrimaryReplicaRouter, 'db_for_read', autospec=True, side_effect=record_read):
+            response = ReplicaRoutingMiddleware(CourseViewSet.as_view({'get': 'list'}))(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(reads)
+        self.assertNotIn('replica1', reads)
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_without_replicas_everything_uses_the_primary(self):
+        # Test that the router changes nothing until replicas are configured
+        response, reads = self.handle(RequestFactory().get('/courses/'), lambda: Category.objects.create(name='Primary'))
+        self.assertEqual(reads, ['default', 'default'])
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+
 # AJAX Search Tests
 
 
@@ -425,6 +2004,53 @@ class AjaxSearchTest(TestCase):
         self.assertIn('Searchable User', response.content.decode('utf-8'))
 
 
+# Testing the indexed people search behind live search.
+@override_settings(LIVE_SEARCH_LIMIT=3)
+class PeopleSearchTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # Creating users whose names share prefixes
+        cls.ada = User.objects.create_user(username='ada', role='ST', first_name='Ada', last_name='Lovelace')
+        cls.alan = User.objects.create_user(username='alan', role='TE', first_name='Alan', last_name='Turing')
+        for i in range(5):
+            User.objects.create_user(username=f'lovelace{i}', role='ST', first_name='Lovelace', last_name=f'Fan{i}')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_prefix_match(self):
+        # Test that partial words match the start of a name, and every word must match
+        self.assertIn(self.ada, search_users('ad'))
+        self.assertEqual(search_users('ada love'), [self.ada])
+        self.assertEqual(search_users('tur'), [self.alan])
+
+    def test_results_are_capped(self):
+        # Test that the number of results never exceeds the configured limit
+        self.assertEqual(len(search_users('lovelace')), 3)
+
+    def test_users_without_role_do_not_crowd_out_results(self):
+        # Test that the role filter is applied before the limit, so better matching superusers leave room for students
+        admins = [User.objects.create_superuser(username=f'ada_admin{i}', password='1234', first_name='Ada', last_name='Ada').pk for i in range(3)]
+        User.objects.filter(pk__in=admins).update(role='')
+        self.assertEqual(search_users('ada'), [self.ada])
+
+    def test_index_follows_renames_and_deletes(self):
+        # Test that the search index is kept in sync through model signals
+        self.alan.first_name = 'Grace'
+        self.alan.save()
+        self.assertEqual(search_users('grace'), [self.alan])
+        self.assertEqual(search_users('alan'), [])
+        self.alan.delete()
+        cache.clear()
+        self.assertEqual(search_users('grace'), [])
+
+    def test_repeated_query_is_cached(self):
+        # Test that a repeated query, after normalisation, is answered without touching the database
+        search_users('Ada')
+        with self.assertNumQueries(0):
+            self.assertEqual(search_users('  ADA '), [self.ada])
+
+
 # Custom Form Tests
         
 
@@ -0,0 +1,76 @@
+import logging
+import posixpath
+from io import BytesIO
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Variants are stored in a directory next to the original, named after it and the variant, e.g.
+# images/thumbnails/me.png.nav.jpg for images/me.png.
+VARIANT_DIRECTORY = 'thumbnails'
+
+def variant_name(name, variant):
+    directory, filename = posixpath.split(name)
+    return posixpath.join(directory, VARIANT_DIRECTORY, f'{filename}.{variant}.jpg')
+
+# Resizes an image to a variant: cropped to fill its size, or scaled down to fit within it. Transparent
+# areas are filled with white, since variants are JPEGs.
+def render_variant(image, size, crop):
+    if crop:
+        image = ImageOps.fit(image, size, Image.LANCZOS)
+    else:
+        image = image.copy()
+        image.thumbnail(size, Image.LANCZOS)
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    elif image.mode != 'RGB':
+        image = image.convert('RGB')
+    buffer = BytesIO()
+    image.save(buffer, 'JPEG', quality=settings.PHOTO_VARIANT_QUALITY, optimize=True, progressive=True)
+    return buffer.getvalue()
+
+# Stores the variants of the photo `name` that are missing, opening the original at most once. Returns the
+# names of the variants that exist afterwards.
+def create_variants(storage, name, variants=None):
+    variants = variants or settings.PHOTO_VARIANTS
+    missing = [variant for variant in variants if not storage.exists(variant_name(name, variant))]
+    if not missing:
+        return set(variants)
+    try:
+        with storage.open(name, 'rb') as f:
+            image = ImageOps.exif_transpose(Image.open(f))
+            image.load()
+    except FileNotFoundError:
+        return set(variants) - set(missing)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        logger.warning('Could not read photo %s for thumbnails', name, exc_info=True)
+        return set(variants) - set(missing)
+
+    for variant in missing:
+        options = settings.PHOTO_VARIANTS[variant]
+        target = variant_name(name, variant)
+        saved = storage.save(target, ContentFile(render_variant(image, options['size'], options['crop'])))
+        if saved != target:
+            # Another request stored the same variant first.
+            storage.delete(saved)
+    return set(variants)
+
+# Name of the file to serve for a variant of the photo, creating the variant on first use. Falls back to the
+# original if it cannot be read as an image.
+def photo_variant_name(storage, name, variant):
+    if variant not in settings.PHOTO_VARIANTS:
+        raise ValueError(f'Unknown photo variant {variant!r}.')
+    if variant in create_variants(storage, name, [variant]):
+        return variant_name(name, variant)
+    return name
+
+# URL of a variant of an image field's file, or None if there is no file.
+def photo_variant_url(photo, variant):
+    if not photo:
+        return None
+    return photo.storage.url(photo_variant_name(photo.storage, photo.name, variant))
@@ -0,0 +1,50 @@
+import logging
+from functools import partial
+
+logger = logging.getLogger(__name__)
+
+# Adds 'pending_send_bytes' to the scope of each WebSocket connection: a function returning how many bytes the
+# server has accepted from the application but not yet written to the client's socket. daphne accepts every frame
+# at once and buffers it in its Twisted transport, so a client that reads slowly never makes a send wait and only
+# shows up here. Must wrap the application outermost, where `send` is still the server's own.
+#
+# This looks inside the server: daphne's send is partial(handle_reply, protocol), and Twisted keeps unsent data in
+# private attributes. On servers where the transport cannot be found or measured, a warning is logged once and
+# slow clients are caught only by the chat consumer's own limits, CHAT_OUTBOUND_BUFFER_SIZE and CHAT_SEND_TIMEOUT,
+# which hold for servers whose send waits for the client.
+class TransportBufferMiddleware:
+    warned = False
+
+    def __init__(self, inner):
+        self.inner = inner
+
+    async def __call__(self, scope, receive, send):
+        transport = find_transport(send)
+        if transport is not None:
+            scope = dict(scope, pending_send_bytes=partial(transport_buffer_size, transport))
+        elif not TransportBufferMiddleware.warned:
+            TransportBufferMiddleware.warned = True
+            logger.warning('The server transport cannot be measured, so slow WebSocket clients are only detected by send timeouts.')
+        return await self.inner(scope, receive, send)
+
+# Returns the transport behind the server's send callable, or None if it cannot be found or measured.
+def find_transport(send):
+    if isinstance(send, partial):
+        for arg in send.args:
+            transport = getattr(arg, 'transport', None)
+            if transport is not None and is_measurable(transport):
+                return transport
+    return None
+
+def is_measurable(transport):
+    return hasattr(transport, 'get_write_buffer_size') or all(
+        hasattr(transport, name) for name in ('dataBuffer', 'offset', '_tempDataLen')
+    )
+
+def transport_buffer_size(transport):
+    # asyncio transports report their buffer themselves.
+    if hasattr(transport, 'get_write_buffer_size'):
+        return transport.get_write_buffer_size()
+    # Twisted TCP transports keep unsent data in dataBuffer from offset on, and the latest writes in a list
+    # of _tempDataLen bytes.
+    return len(transport.dataBuffer) - transport.offset + transport._tempDataLen
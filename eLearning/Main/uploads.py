@@ -0,0 +1,171 @@
+import os
+import re
+import shutil
+import tempfile
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.urls import reverse
+from django.utils import timezone
+from .models import CourseFile, UploadSession
+from .storage import LocalFile, hash_file
+
+# Size of the pieces read from the request, so no chunk is ever held in memory whole.
+STREAM_BLOCK_SIZE = 64 * 1024
+
+# A hex-encoded SHA-256.
+CHECKSUM_PATTERN = r'[0-9a-fA-F]{64}'
+
+# Raised for uploads that cannot go on as requested. The message is shown to the client.
+class UploadError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+# Path of the file that an upload's chunks are written to.
+def partial_path(session_id):
+    return os.path.join(settings.COURSE_UPLOAD_PARTIAL_DIR, f'{session_id}.part')
+
+# Builds the JSON payload describing an upload session, as returned by every upload endpoint.
+def serialize_upload_session(session):
+    return {
+        'id': str(session.id),
+        'url': reverse('upload_status', args=[session.id]),
+        'file_name': session.file_name,
+        'size': session.size,
+        'chunk_size': session.chunk_size,
+        'received': session.received,
+        # Index of the next chunk to send, which is where an interrupted upload resumes.
+        'next_chunk': session.received // session.chunk_size,
+    }
+
+# Starts an upload of `size` bytes to the course.
+def start_upload(course, uploader, original_name, file_name, size, checksum=''):
+    if size < 0 or size > settings.COURSE_UPLOAD_MAX_SIZE:
+        raise UploadError(f'Files must be at most {settings.COURSE_UPLOAD_MAX_SIZE} bytes.')
+    if checksum and not re.fullmatch(CHECKSUM_PATTERN, checksum):
+        raise UploadError('The checksum must be a hex-encoded SHA-256.')
+    session = UploadSession.objects.create(
+        course=course,
+        uploader=uploader,
+        original_name=os.path.basename(original_name),
+        file_name=file_name or os.path.basename(original_name),
+        size=size,
+        chunk_size=settings.COURSE_UPLOAD_CHUNK_SIZE,
+        checksum=checksum.lower(),
+    )
+    os.makedirs(settings.COURSE_UPLOAD_PARTIAL_DIR, exist_ok=True)
+    open(partial_path(session.id), 'wb').close()
+    return session
+
+# Adds a file to the course without uploading it, if the teacher already uploaded identical content (same
+# SHA-256 and extension) elsewhere. Only the teacher's own files count, so knowing a hash is not enough to
+# obtain someone else's file. Returns the new course file, or None if the content has to be uploaded.
+def reuse_known_content(course, uploader, original_name, file_name, checksum):
+    if not re.fullmatch(CHECKSUM_PATTERN, checksum):
+        return None
+    original_name = os.path.basename(original_name)
+    field = CourseFile._meta.get_field('file')
+    name = field.storage.blob_name(field.upload_to.rstrip('/'), checksum.lower(), os.path.splitext(original_name)[1])
+    if not CourseFile.objects.filter(file=name, course__teacher=uploader).exists() or not field.storage.add_reference(name):
+        return None
+    return CourseFile.objects.create(course=course, file=name, file_name=file_name or original_name)
+
+# Streams chunk `index` from `stream` to the upload's file. Chunks must arrive in order; sending a chunk that
+# was already received again is accepted and ignored, so clients can simply retry the chunk they were sending.
+def write_chunk(session_id, index, stream):
+    session = UploadSession.objects.get(pk=session_id)
+    offset = index * session.chunk_size
+    if offset < session.received:
+        return session
+    check_next_chunk(session, offset)
+
+    # The chunk is received into a file of its own first, so the upload is only locked while it is appended.
+    expected = min(session.chunk_size, session.size - offset)
+    fd, chunk_path = tempfile.mkstemp(suffix='.chunk', dir=settings.COURSE_UPLOAD_PARTIAL_DIR)
+    try:
+        with os.fdopen(fd, 'wb') as chunk:
+            written = 0
+            for block in iter(lambda: stream.read(STREAM_BLOCK_SIZE), b''):
+                written += len(block)
+                if written > expected:
+                    break
+                chunk.write(block)
+        if written != expected:
+            raise UploadError(f'Chunk {index} must be {expected} bytes.')
+
+        with transaction.atomic():
+            # The lock keeps two requests for the same upload from appending at once.
+            session = UploadSession.objects.select_for_update().get(pk=session_id)
+            if offset < session.received:
+                # Another request delivered the chunk meanwhile.
+                return session
+            check_next_chunk(session, offset)
+            with open(partial_path(session.id), 'r+b') as part, open(chunk_path, 'rb') as chunk:
+                # Drops whatever an earlier, interrupted attempt at this chunk left behind.
+                part.seek(offset)
+                part.truncate()
+                shutil.copyfileobj(chunk, part, STREAM_BLOCK_SIZE)
+            session.received = offset + written
+            session.save(update_fields=['received'])
+            return session
+    finally:
+        os.remove(chunk_path)
+
+# Refuses a chunk that is not the next one the upload expects.
+def check_next_chunk(session, offset):
+    if offset > session.received or offset >= session.size:
+        raise UploadError(f'Expected chunk {session.received // session.chunk_size}.', status=409)
+
+# Checks that an upload is complete and intact, then moves it into course_files/ and creates its CourseFile.
+def finish_upload(session_id):
+    with transaction.atomic():
+        session = UploadSession.objects.select_for_update().select_related('course').get(pk=session_id)
+        path = partial_path(session.id)
+        if session.received != session.size or os.path.getsize(path) != session.size:
+            raise UploadError(f'Only {session.received} of {session.size} bytes have been received.', status=409)
+
+        # The hash checks the upload and is also the name it is stored under.
+        digest = hash_file(path)
+        if session.checksum and digest != session.checksum:
+            # The data cannot be trusted, so the upload starts again from the first chunk.
+            session.received = 0
+            session.save(update_fields=['received'])
+            open(path, 'wb').close()
+            course_file = None
+        else:
+            course_file = CourseFile(course=session.course, file_name=session.file_name)
+            with open(path, 'rb') as part:
+                course_file.file.save(session.original_name, LocalFile(part, name=session.original_name, content_hash=digest), save=False)
+            course_file.save()
+            discard_upload(session)
+
+    if course_file is None:
+        raise UploadError('The file does not match its checksum. Please upload it again.')
+    return course_file
+
+# Deletes an upload session and whatever it received.
+def discard_upload(session):
+    path = partial_path(session.id)
+    session.delete()
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+# Deletes uploads that were started more than COURSE_UPLOAD_EXPIRY_HOURS ago, and old partial files that no
+# upload owns any more (e.g. after their course was deleted) or that hold a chunk whose request died. Returns how
+# many uploads were deleted.
+def expire_uploads():
+    cutoff = timezone.now() - timedelta(hours=settings.COURSE_UPLOAD_EXPIRY_HOURS)
+    expired = list(UploadSession.objects.filter(created_at__lt=cutoff))
+    for session in expired:
+        discard_upload(session)
+
+    if os.path.isdir(settings.COURSE_UPLOAD_PARTIAL_DIR):
+        names = {f'{session_id}.part' for session_id in UploadSession.objects.values_list('id', flat=True)}
+        for entry in os.scandir(settings.COURSE_UPLOAD_PARTIAL_DIR):
+            orphaned = entry.name.endswith('.chunk') or (entry.name.endswith('.part') and entry.name not in names)
+            if orphaned and entry.stat().st_mtime < cutoff.timestamp():
+                os.remove(entry.path)
+    return len(expired)
@@ -26,8 +26,16 @@ urlpatterns = [
     path('create_course/', views.course_create, name='create_course'), # Course creation route.
     path('courses/', views.courses, name='courses'), # View all courses route.
     path('edit_course/<int:pk>/', course_edit, name='course_edit'), # Course edit route.
+    path('course/<int:course_id>/import/', views.course_import, name='course_import'), # Import course files from a ZIP archive.
     path('course_detail/<int:pk>/', course_detail, name='course_detail'), # Detailed course view route.
+    path('course_detail/<int:pk>/feedback/', views.course_feedback_page, name='course_feedback_page'), # Next page of a course's feedback.
+    path('course_file/<int:file_id>/', views.download_course_file, name='download_course_file'), # Download a course file.
+    path('course/<int:course_id>/files.zip', views.download_course_archive, name='download_course_archive'), # Download all of a course's files as one archive.
     path('delete_course_file/<int:file_id>/', views.delete_course_file, name='delete_course_file'), # Delete a course file route.
+    path('course/<int:course_id>/uploads/', views.upload_start, name='upload_start'), # Start a chunked upload of a course file.
+    path('uploads/<uuid:session_id>/', views.upload_status, name='upload_status'), # Status of a chunked upload, or cancel it.
+    path('uploads/<uuid:session_id>/chunks/<int:index>/', views.upload_chunk, name='upload_chunk'), # Send one chunk of an upload.
+    path('uploads/<uuid:session_id>/complete/', views.upload_complete, name='upload_complete'), # Assemble a finished upload into a course file.
     path('enroll_course/<int:course_id>/', views.enroll_course, name='enroll_course'), # Enroll in a course route.
     path('course_students/<int:course_id>/', views.course_students, name='course_students'), # View all students enrolled in a course.
     path('user_post_update/', views.user_post_update, name='user_post_update'), # Update user post route (e.g., for status updates).
@@ -36,6 +44,7 @@ urlpatterns = [
     path('chat/<int:course_id>/', chat_room, name='chat_room'), # Chat room for a specific course.
     path('course/<int:course_id>/unenroll/<int:student_id>/', csrf_exempt(views.unenroll_student), name='unenroll_student'), # Unenroll a student from a course.
     path('notifications/read/<int:notification_id>/', views.read_notification, name='read_notification'), # Mark a notification as read.
+    path('notifications/read_all/', views.read_all_notifications, name='read_all_notifications'), # Mark all notifications as read.
     path('fetch_notifications/', views.fetch_notifications, name='fetch_notifications'), # Fetch unread notifications.
     path('api-auth/', include('rest_framework.urls', namespace='rest_framework')), # Include default login and logout views for the browsable API.
 ]
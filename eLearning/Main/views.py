@@ -12,11 +12,30 @@ from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from .serializers import *
 from .permissions import *
+from .notifications import notify, mark_read, mark_all_read
+from .tasks import import_course_archive, notify_course_students
+from .search import search_users
+from .catalog import get_course_catalog
+from .pagination import keyset_page, CappedCursorPagination, NewestFirstCursorPagination, UserPostCursorPagination
+from .versions import ConditionalGetMixin
+from .downloads import serve_course_archive, serve_course_file
+from .imports import ArchiveImportError, keep_archive
+from .uploads import UploadError, reuse_known_content, start_upload, write_chunk, finish_upload, discard_upload, serialize_upload_session
+from django.conf import settings
+from django.core.cache import cache
 from django.contrib.auth.models import User
 from django.urls import reverse
-from django.db.models import Count, Q
+from django.db.models import Count, Max
+from django.views.decorators.http import condition, require_POST, require_http_methods, require_safe
+from django.views.decorators.cache import cache_control
+from django.db import transaction
 from django.template.loader import render_to_string
 import json
+import logging
+import os
+from kombu.exceptions import OperationalError
+
+logger = logging.getLogger(__name__)
 
 User = get_user_model()
 
@@ -48,14 +67,16 @@ def profile(request, username=None):
     if viewed_user.role == 'TE':
         courses = Course.objects.filter(teacher=viewed_user).annotate(student_count=Count('enrollment'))
 
-    user_post = UserPost.objects.all().order_by('-created_at')
+    # Only the first page of the status feed is rendered; later pages are loaded on scroll from the API.
+    user_post, next_cursor = keyset_page(UserPost.objects.select_related('user'), None, settings.FEED_PAGE_SIZE)
 
     return render(request, 'Main/profile.html', {
         'viewed_user': viewed_user, 
         'logged_in_user': logged_in_user,  # Always pass the logged_in_user for actions
         'courses': courses,
         'enrolled_courses': enrolled_courses,
-        'user_post': user_post
+        'user_post': user_post,
+        'next_cursor': next_cursor,
     })
 
 @login_required
@@ -140,12 +161,9 @@ def course_edit(request, pk):
                 new_files.append(new_file)
 
             if new_files:
-                students_to_notify = course.students.all()
-                for student in students_to_notify:
-                    Notification.objects.create(
-                        recipient=student,
-                        message=f"New material added to {course.title}."
-                    )
+                # Fan out to the enrolled students on the worker queue once the files are committed.
+                message = f"New material added to {course.title}."
+                transaction.on_commit(lambda: queue_notification(course.pk, message))
 
             messages.success(request, 'Course updated successfully.')
             return redirect('course_detail', pk=course.pk)
@@ -154,48 +172,118 @@ def course_edit(request, pk):
 
     return render(request, 'Main/course_edit.html', {'form': form, 'course': course})
 
+@login_required
+@require_POST
+def course_import(request, course_id):
+    # Imports course files from an uploaded ZIP archive. A worker extracts it and notifies the teacher when done.
+    course = get_object_or_404(Course, pk=course_id, teacher=request.user)
+    archive = request.FILES.get('archive')
+    if archive is None:
+        messages.error(request, 'Please choose a ZIP archive to import.')
+        return redirect('course_edit', pk=course.pk)
+    try:
+        path = keep_archive(archive)
+    except ArchiveImportError as e:
+        messages.error(request, str(e))
+        return redirect('course_edit', pk=course.pk)
+    try:
+        import_course_archive.delay(course.pk, path)
+    except OperationalError:
+        # Only the task deletes the archive, so it goes now that there is no task.
+        logger.exception('Could not queue the import of %s.', path)
+        os.remove(path)
+        messages.error(request, 'The archive could not be imported right now. Please try again later.')
+        return redirect('course_edit', pk=course.pk)
+    messages.success(request, 'The archive is being imported. You will be notified once its files have been added.')
+    return redirect('course_detail', pk=course.pk)
+
 @login_required
 def courses(request):
-    # Displays a list of courses.
-    categories = Category.objects.prefetch_related('course_set').all()
+    # Displays a list of courses. The catalog comes from the cache; only the user's enrollments are queried.
+    categories = get_course_catalog()
     if request.user.role == 'ST':
-        enrolled_course_ids = list(request.user.courses_enrolled.values_list('id', flat=True))
+        enrolled_course_ids = set(request.user.courses_enrolled.values_list('id', flat=True))
     else:
-        enrolled_course_ids = []
+        enrolled_course_ids = set()
     return render(request, 'Main/courses.html', {'categories': categories, 'enrolled_course_ids': enrolled_course_ids})
 
+# Columns needed to render a feedback entry, with its author.
+FEEDBACK_FIELDS = ('content', 'created_at', 'user__first_name', 'user__last_name', 'user__photo')
+
+def course_feedback_queryset(course):
+    # A course's feedback with authors joined, read newest first along the (course, created_at) index.
+    return CourseFeedback.objects.filter(course=course).select_related('user').only(*FEEDBACK_FIELDS)
+
 @login_required
 def course_detail(request, pk):
-    # Displays details of a specific course.
-    course = get_object_or_404(Course, pk=pk)
-    is_teacher = request.user == course.teacher
-    is_enrolled = Enrollment.objects.filter(student=request.user, course=course).exists()
-
-    if is_teacher or is_enrolled:
-        feedback_form = CourseFeedbackForm()
-        feedback_list = CourseFeedback.objects.filter(course=course).order_by('-created_at')
-
-        if request.method == 'POST' and request.user.role == 'ST':
-            feedback_form = CourseFeedbackForm(request.POST)
-            if feedback_form.is_valid():
-                feedback = feedback_form.save(commit=False)
-                feedback.course = course
-                feedback.user = request.user
-                feedback.save()
-                messages.success(request, 'Feedback submitted successfully.')
-                return redirect('course_detail', pk=course.pk)
-
-        context = {
-            'course': course,
-            'is_enrolled': is_enrolled,
-            'feedback_form': feedback_form,
-            'feedback_list': feedback_list,
-        }
-
-        return render(request, 'Main/course_detail.html', context)
-    else:
+    # Displays details of a specific course. Files come from one prefetched query and only the first
+    # page of feedback is rendered; later pages are loaded on scroll from course_feedback_page.
+    course = get_object_or_404(Course.objects.prefetch_related('files'), pk=pk)
+    if not has_course_access(request.user, course):
         messages.error(request, "You do not have access to view this course.")
         return redirect('courses')
+    # Everyone else with access is an enrolled student.
+    is_teacher = course.teacher_id == request.user.id
+    is_enrolled = not is_teacher
+
+    feedback_form = CourseFeedbackForm()
+
+    if request.method == 'POST' and request.user.role == 'ST':
+        feedback_form = CourseFeedbackForm(request.POST)
+        if feedback_form.is_valid():
+            feedback = feedback_form.save(commit=False)
+            feedback.course = course
+            feedback.user = request.user
+            feedback.save()
+            messages.success(request, 'Feedback submitted successfully.')
+            return redirect('course_detail', pk=course.pk)
+
+    # Only fetched when the page is rendered, not before a successful post redirects.
+    feedback_list, next_cursor = keyset_page(course_feedback_queryset(course), None, settings.FEEDBACK_PAGE_SIZE)
+
+    context = {
+        'course': course,
+        'is_teacher': is_teacher,
+        'is_enrolled': is_enrolled,
+        'feedback_form': feedback_form,
+        'feedback_list': feedback_list,
+        'next_cursor': next_cursor,
+    }
+
+    return render(request, 'Main/course_detail.html', context)
+
+@login_required
+def course_feedback_page(request, pk):
+    # Returns the next page of a course's feedback as rendered HTML, with the cursor for the page after it.
+    course = get_object_or_404(Course.objects.only('teacher_id'), pk=pk)
+    if not has_course_access(request.user, course):
+        return HttpResponseForbidden("You do not have access to view this course.")
+    try:
+        feedback_list, next_cursor = keyset_page(
+            course_feedback_queryset(course), request.GET.get('cursor'), settings.FEEDBACK_PAGE_SIZE
+        )
+    except ValueError as e:
+        return JsonResponse({'detail': str(e)}, status=400)
+    html = render_to_string('Main/feedback_items.html', {'feedback_list': feedback_list}, request=request)
+    return JsonResponse({'html': html, 'next_cursor': next_cursor})
+
+@login_required
+@require_safe
+def download_course_file(request, file_id):
+    # Sends a course file to the course's teacher and enrolled students.
+    course_file = get_object_or_404(CourseFile.objects.select_related('course'), pk=file_id)
+    if not has_course_access(request.user, course_file.course):
+        return HttpResponseForbidden("You do not have access to this file.")
+    return serve_course_file(request, course_file)
+
+@login_required
+@require_safe
+def download_course_archive(request, course_id):
+    # Sends all of a course's files as one ZIP archive, to the course's teacher and enrolled students.
+    course = get_object_or_404(Course, pk=course_id)
+    if not has_course_access(request.user, course):
+        return HttpResponseForbidden("You do not have access to this course.")
+    return serve_course_archive(course)
 
 @login_required
 def delete_course_file(request, file_id):
@@ -207,8 +295,7 @@ def delete_course_file(request, file_id):
         return redirect('course_detail', pk=course.id)
     
     if request.method == "POST":
-        course_file.file.delete()  # Optional: Deletes the file from the filesystem
-        course_file.delete()
+        course_file.delete()  # The stored file is deleted once no other course file shares it
         messages.success(request, "File deleted successfully.")
         return redirect('course_detail', pk=course.id)
     else:
@@ -216,6 +303,97 @@ def delete_course_file(request, file_id):
         return redirect('course_detail', pk=course.id)
 
 
+# Chunked upload views
+# Large course files are uploaded in fixed-size chunks: start an upload, PUT its chunks in order, then complete it.
+# An interrupted upload resumes from the next_chunk reported by the upload's status.
+
+
+# Builds the JSON payload for a course file added through the upload API.
+def serialize_course_file(course_file):
+    return {
+        'id': course_file.id,
+        'file_name': course_file.file_name,
+        'url': reverse('download_course_file', args=[course_file.id]),
+    }
+
+# Queues the notification of a course's students, returning False if the broker cannot be reached. The material
+# is already saved by then, so the failure is logged rather than turned into an error page.
+def queue_notification(course_id, message, **options):
+    try:
+        notify_course_students.apply_async((course_id, message), **options)
+    except OperationalError:
+        logger.exception('Could not queue the notification of the students of course %s.', course_id)
+        return False
+    return True
+
+# Tells the course's students about new material once it is committed. Files are uploaded one request at a time,
+# so the first file of a batch schedules the notification and the rest of the batch joins it.
+def announce_course_file(course):
+    message = f"New material added to {course.title}."
+    delay = settings.COURSE_FILE_ANNOUNCE_DELAY
+    key = f'course_file_announcement:{course.pk}'
+    def announce():
+        # A batch whose notification could not be queued is announced by the next upload instead.
+        if cache.add(key, True, delay) and not queue_notification(course.pk, message, countdown=delay):
+            cache.delete(key)
+    transaction.on_commit(announce)
+
+@login_required
+@require_POST
+def upload_start(request, course_id):
+    # Starts an upload of a course file from its name, size in bytes and, optionally, its SHA-256.
+    # Content the teacher has already uploaded is added straight away, answering with the file instead of an upload.
+    course = get_object_or_404(Course, pk=course_id, teacher=request.user)
+    try:
+        size = int(request.POST['size'])
+        name = request.POST['name']
+        file_name = request.POST.get('file_name', '').strip()
+        checksum = request.POST.get('checksum', '')
+        course_file = reuse_known_content(course, request.user, name, file_name, checksum)
+        if course_file is not None:
+            announce_course_file(course)
+            return JsonResponse({'file': serialize_course_file(course_file)}, status=201)
+        session = start_upload(course, request.user, name, file_name, size, checksum)
+    except (KeyError, ValueError):
+        return JsonResponse({'detail': 'The file name and size are required.'}, status=400)
+    except UploadError as e:
+        return JsonResponse({'detail': str(e)}, status=e.status)
+    return JsonResponse(serialize_upload_session(session), status=201)
+
+@login_required
+@require_http_methods(['GET', 'DELETE'])
+def upload_status(request, session_id):
+    # Reports how much of an upload was received, or cancels it.
+    session = get_object_or_404(UploadSession, pk=session_id, uploader=request.user)
+    if request.method == 'DELETE':
+        discard_upload(session)
+        return HttpResponse(status=204)
+    return JsonResponse(serialize_upload_session(session))
+
+@login_required
+@require_http_methods(['PUT'])
+def upload_chunk(request, session_id, index):
+    # Receives one chunk as the raw request body, streaming it to disk.
+    get_object_or_404(UploadSession.objects.only('pk'), pk=session_id, uploader=request.user)
+    try:
+        session = write_chunk(session_id, index, request)
+    except UploadError as e:
+        return JsonResponse({'detail': str(e)}, status=e.status)
+    return JsonResponse(serialize_upload_session(session))
+
+@login_required
+@require_POST
+def upload_complete(request, session_id):
+    # Assembles a fully received upload into a course file and tells the enrolled students.
+    get_object_or_404(UploadSession.objects.only('pk'), pk=session_id, uploader=request.user)
+    try:
+        course_file = finish_upload(session_id)
+    except UploadError as e:
+        return JsonResponse({'detail': str(e)}, status=e.status)
+    announce_course_file(course_file.course)
+    return JsonResponse(serialize_course_file(course_file), status=201)
+
+
 # Enrollment-related Views
 
 
@@ -226,10 +404,7 @@ def enroll_course(request, course_id):
     enrollment, created = Enrollment.objects.get_or_create(student=request.user, course=course)
     if created:
         # Create a notification for the teacher of the course
-        Notification.objects.create(
-            recipient=course.teacher,
-            message=f"{request.user.get_full_name()} has enrolled in {course.title}."
-        )
+        notify(course.teacher, f"{request.user.get_full_name()} has enrolled in {course.title}.")
         messages.success(request, f"You have enrolled in the course: {course.title}")
     else:
         messages.info(request, f"You are already enrolled in the course: {course.title}")
@@ -275,16 +450,10 @@ def course_students(request, course_id):
 
 # Views for the search results   
 def live_search(request):
-    # Performs a live search of users.
+    # Performs a live search of users by name prefix, through the indexed search backend.
     query = request.GET.get('query', '')
-    if query:
-        users = User.objects.filter(
-            Q(first_name__icontains=query) | Q(last_name__icontains=query),
-            Q(role='ST') | Q(role='TE')
-        )
-    else:
-        users = User.objects.none()
-    
+    users = search_users(query)
+
     html = render_to_string('Main/live_results.html', {'users': users})
     return HttpResponse(html)
 
@@ -318,34 +487,65 @@ def chat_room(request, course_id):
 def read_notification(request, notification_id):
     # Marks a notification as read.
     notification = get_object_or_404(Notification, id=notification_id, recipient=request.user)
-    notification.read = True
-    notification.save()
+    mark_read(notification)
     return redirect('profile')  # Adjust the redirection as needed
 
 @login_required
+def read_all_notifications(request):
+    # Marks all of the current user's notifications as read.
+    mark_all_read(request.user)
+    return redirect('profile')
+
+def notifications_etag(request):
+    # Validator for fetch_notifications: the unread count and newest unread id change whenever the response would.
+    unread_count = request.user.unread_notification_count
+    if not unread_count:
+        return '0'
+    latest_id = request.user.notifications.filter(read=False).aggregate(Max('id'))['id__max']
+    return f'{unread_count}-{latest_id}'
+
+@login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=notifications_etag)
 def fetch_notifications(request):
-    # Fetches unread notifications for the current user.
-    notifications = request.user.notifications.filter(read=False).order_by('-created_at')[:5]  # Adjust the number as needed
+    # Fetches unread notifications for the current user, using the maintained counter to skip the query when there are none.
+    unread_count = request.user.unread_notification_count
+    notifications = request.user.get_unread_notifications().order_by('-created_at')[:5]  # Adjust the number as needed
     notifications_data = [{
         'id': notification.id,
         'message': notification.message,
         'read': notification.read
     } for notification in notifications]
-    return JsonResponse({'notifications': notifications_data})
+    return JsonResponse({'notifications': notifications_data, 'unread_count': unread_count})
 
 
 # API Views and ViewSets
 
 
-class LatestUserPostsAPIView(APIView):
-    # API view to get the latest posts.
+# Columns needed to render a post in the feed.
+USER_POST_FEED_FIELDS = ('content', 'created_at', 'user__first_name', 'user__last_name', 'user__photo', 'user__role')
+
+class LatestUserPostsAPIView(ConditionalGetMixin, APIView):
+    # API view to get the latest posts, one keyset page at a time.
     permission_classes = [IsAuthenticated]
+    version_names = ('userpost', 'user')
 
     def get(self, request, format=None):
-        latest_posts = UserPost.objects.select_related('user').all().order_by('-created_at')[:5]
+        return self.conditional_get(request, self.get_page)
+
+    def get_page(self, request):
+        # Without a cursor this is the newest page; pass back `next_cursor` to get the page after it.
+        try:
+            latest_posts, next_cursor = keyset_page(
+                UserPost.objects.select_related('user').only(*USER_POST_FEED_FIELDS),
+                request.query_params.get('cursor'),
+                settings.FEED_PAGE_SIZE
+            )
+        except ValueError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         # Pass the request context to the serializer 
         serializer = UserPostSerializer(latest_posts, many=True, context={'request': request})
-        return Response(serializer.data)
+        return Response({'results': serializer.data, 'next_cursor': next_cursor})
     
     def post(self, request, format=None):
         # Adjust this part as needed. Ensure you're not requiring unnecessary fields for POST.
@@ -357,18 +557,22 @@ class LatestUserPostsAPIView(APIView):
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
-class UserPostViewSet(viewsets.ModelViewSet):
+class UserPostViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     # ViewSet for user posts.
-    queryset = UserPost.objects.all()
+    version_names = ('userpost', 'user')
+    queryset = UserPost.objects.select_related('user')
     serializer_class = UserPostSerializer
+    pagination_class = UserPostCursorPagination
     
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
-class UserProfileViewSet(viewsets.ModelViewSet):
+class UserProfileViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     # ViewSet for viewing and editing user profiles.
+    version_names = ('user',)
     serializer_class = UserProfileSerializer
     queryset = User.objects.all()
+    pagination_class = CappedCursorPagination
     permission_classes = [IsAuthenticated]  # Use appropriate permissions
 
     def get_queryset(self):
@@ -378,28 +582,42 @@ class UserProfileViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(username=username)
         return queryset   
     
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     # ViewSet for courses.
+    version_names = ('user',)
     queryset = User.objects.all()
     serializer_class = UserSerializer
+    pagination_class = CappedCursorPagination
     permission_classes = [IsAuthenticated, IsTeacher]
 
-class CourseViewSet(viewsets.ModelViewSet):
+class CourseViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     # ViewSet for courses.
+    version_names = ('course', 'enrollment')
+    # Tracked names that expanding a field with ?expand= adds, since the nested objects come from other models.
+    expanded_version_names = {'teacher': 'user', 'students': 'user', 'category': 'category'}
     queryset = Course.objects.all()
     serializer_class = CourseSerializer
+    pagination_class = NewestFirstCursorPagination
+
+    def get_version_names(self, request):
+        expand = query_param_set(request, 'expand')
+        expanded = {name for field, name in self.expanded_version_names.items() if field in expand}
+        return self.version_names + tuple(sorted(expanded))
     
     def get_queryset(self):
         queryset = Course.objects.all()
         teacher_id = self.request.query_params.get('teacher_id')
         if teacher_id is not None:
             queryset = queryset.filter(teacher__id=teacher_id)
-        return queryset
+        # Load exactly what the requested fields and expansions need.
+        return self.get_serializer().optimize_queryset(queryset)
     
-class CourseFeedbackViewSet(viewsets.ModelViewSet):
+class CourseFeedbackViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     # ViewSet for course feedback.
+    version_names = ('coursefeedback', 'user')
     queryset = CourseFeedback.objects.all()
     serializer_class = CourseFeedbackSerializer
+    pagination_class = NewestFirstCursorPagination
     
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
@@ -0,0 +1,195 @@
+"""
+Load test for the chat consumer.
+
+Connects many simulated clients across many course chat rooms through
+WebsocketCommunicator, sends messages at a fixed overall rate, and measures how
+long each message takes to reach every member of its room. Reports p50/p99
+fan-out latency, messages and deliveries per second, and memory per connection.
+The per-connection rate limit is raised to the overall rate, so it does not
+reject the test's own traffic; any frames it rejects are counted as errors.
+
+The in-memory channel layer is used unless --redis gives a Redis URL. Chat
+history is written to a temporary in-memory test database.
+
+Run from the project directory:
+    python benchmarks/chat_load.py [--clients N] [--rooms N] [--rate N] [--duration S] [--json]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'eLearning.settings')
+
+import django
+
+django.setup()
+
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.db import connection
+from eLearning.routing import websocket_urlpatterns
+from Main.models import Category, Course, Enrollment, User
+
+# Clients are connected in groups of this many at a time.
+CONNECT_BATCH = 100
+
+
+class Client:
+    def __init__(self, application, course_id, user):
+        self.communicator = WebsocketCommunicator(application, f'/ws/chat/{course_id}/')
+        self.communicator.scope['user'] = user
+        self.course_id = course_id
+        self.reader = None
+
+    async def connect(self):
+        connected, _ = await self.communicator.connect()
+        assert connected, 'Chat connection refused.'
+
+    # Records the delivery latency of every message received, whether framed alone or in a batch. Frames telling
+    # the client a limit rejected its message are counted instead.
+    async def read(self, latencies, errors):
+        while True:
+            text = await self.communicator.receive_from(timeout=3600)
+            received = time.perf_counter_ns()
+            frame = json.loads(text)
+            if isinstance(frame, dict) and 'error' in frame:
+                errors.append(frame['error'])
+                continue
+            for message in frame if isinstance(frame, list) else [frame]:
+                latencies.append(received - int(message['message']))
+
+    async def send(self):
+        await self.communicator.send_to(text_data=json.dumps({'message': str(time.perf_counter_ns())}))
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+async def run(args, course_ids, user):
+    application = URLRouter(websocket_urlpatterns)
+    clients = [Client(application, course_ids[i % len(course_ids)], user) for i in range(args.clients)]
+
+    # Memory is traced only while connecting, since tracing slows everything down.
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for start in range(0, len(clients), CONNECT_BATCH):
+        await asyncio.gather(*(client.connect() for client in clients[start:start + CONNECT_BATCH]))
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    connection_bytes = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+
+    latencies = []
+    errors = []
+    for client in clients:
+        client.reader = asyncio.create_task(client.read(latencies, errors))
+
+    members = {course_id: 0 for course_id in course_ids}
+    for client in clients:
+        members[client.course_id] += 1
+
+    # Senders take turns, so every room gets an equal share of the traffic.
+    total = int(args.rate * args.duration)
+    expected = 0
+    started = time.perf_counter()
+    for i in range(total):
+        sender = clients[i % len(clients)]
+        await sender.send()
+        expected += members[sender.course_id]
+        delay = started + (i + 1) / args.rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+    sent = time.perf_counter()
+
+    # Waits for the remaining deliveries, giving up after --drain seconds.
+    while len(latencies) < expected and time.perf_counter() - sent < args.drain:
+        await asyncio.sleep(0.01)
+    finished = time.perf_counter()
+
+    for client in clients:
+        client.reader.cancel()
+    await asyncio.gather(*(client.reader for client in clients), return_exceptions=True)
+    for start in range(0, len(clients), CONNECT_BATCH):
+        await asyncio.gather(*(client.communicator.disconnect() for client in clients[start:start + CONNECT_BATCH]))
+
+    latencies.sort()
+    return {
+        'messages_sent': total,
+        'messages_per_second': round(total / (sent - started)),
+        'deliveries_expected': expected,
+        'deliveries_received': len(latencies),
+        'deliveries_per_second': round(len(latencies) / (finished - started)),
+        'error_frames': len(errors),
+        'fanout_latency_p50_ms': round(percentile(latencies, 0.50) / 1e6, 3) if latencies else None,
+        'fanout_latency_p99_ms': round(percentile(latencies, 0.99) / 1e6, 3) if latencies else None,
+        'bytes_per_connection': round(connection_bytes / len(clients)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=1000, help='Simulated clients, spread evenly over the rooms.')
+    parser.add_argument('--rooms', type=int, default=20, help='Course chat rooms.')
+    parser.add_argument('--rate', type=float, default=200, help='Messages sent per second, across all rooms.')
+    parser.add_argument('--duration', type=float, default=5, help='Seconds to send for.')
+    parser.add_argument('--drain', type=float, default=10, help='Seconds to wait for deliveries once sending stops.')
+    parser.add_argument('--coalesce-members', type=int, default=None, help='Sets CHAT_COALESCE_MIN_MEMBERS.')
+    parser.add_argument('--redis', metavar='URL', help='Use a Redis channel layer, e.g. redis://127.0.0.1:6379/1.')
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON.')
+    args = parser.parse_args()
+
+    if args.redis:
+        settings.CHANNEL_LAYERS = {'default': {'BACKEND': 'channels_redis.core.RedisChannelLayer', 'CONFIG': {'hosts': [args.redis]}}}
+    else:
+        # Room queues must hold a whole burst, since the in-memory layer drops messages to full queues.
+        settings.CHANNEL_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer', 'CONFIG': {'capacity': 100_000}}}
+    settings.CHAT_COALESCE_MIN_MEMBERS = args.coalesce_members
+    # The per-connection rate limit would otherwise reject most of the traffic and the test would measure it
+    # instead of delivery. No client sends faster than the overall rate.
+    settings.CHAT_RATE_LIMIT = args.rate
+    settings.CHAT_RATE_BURST = max(1, int(args.rate))
+
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        user = User.objects.create_user(username='load_test', role='ST')
+        teacher = User.objects.create_user(username='load_teacher', role='TE')
+        category = Category.objects.create(name='Load')
+        course_ids = [
+            Course.objects.create(title=f'Room {i}', description='Load test room', teacher=teacher, category=category).id
+            for i in range(args.rooms)
+        ]
+        # Only enrolled students may join a room.
+        Enrollment.objects.bulk_create([Enrollment(student=user, course_id=course_id) for course_id in course_ids])
+        results = asyncio.run(run(args, course_ids, user))
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    results = {
+        'config': {
+            'clients': args.clients,
+            'rooms': args.rooms,
+            'rate': args.rate,
+            'duration': args.duration,
+            'coalesce_members': args.coalesce_members,
+            'channel_layer': 'redis' if args.redis else 'memory',
+        },
+        'results': results,
+    }
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for section in results.values():
+        for name, value in section.items():
+            print(f'{name:>24}: {value}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""
+Write concurrency benchmark for the database profiles.
+
+Runs concurrent writer threads against each DJANGO_DB_PROFILE for a fixed time.
+Each writer alternates between the app's two most frequent writes: a notification
+(an INSERT and an unread counter UPDATE in one transaction) and a chat flush (a
+bulk INSERT of chat messages). Reports writes per second, p50/p99 write latency,
+and how many writes failed, e.g. with "database is locked".
+
+Every profile runs in its own process against a fresh test database; SQLite
+profiles use a temporary file rather than memory, so journaling and syncing are
+measured. The postgres profile needs a server, configured as in settings.py.
+
+Run from the project directory:
+    python benchmarks/db_writes.py [--profiles sqlite sqlite-wal postgres] [--writers N] [--duration S] [--json]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+
+# Chat messages written per chat flush.
+CHAT_BATCH = 20
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+# Runs the writers against the profile in DJANGO_DB_PROFILE, returning the results.
+def run_profile(args):
+    sys.path.insert(0, str(PROJECT_DIR))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'eLearning.settings')
+
+    import django
+
+    django.setup()
+
+    from django.db import DatabaseError, connection, transaction
+    from Main.models import Category, ChatMessage, Course, Notification, User
+
+    directory = tempfile.mkdtemp()
+    if connection.vendor == 'sqlite':
+        connection.settings_dict['TEST']['NAME'] = os.path.join(directory, 'benchmark.sqlite3')
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        teacher = User.objects.create_user(username='write_teacher', role='TE')
+        category = Category.objects.create(name='Writes')
+        course = Course.objects.create(title='Writes', description='Write benchmark', teacher=teacher, category=category)
+        user_ids = [User.objects.create_user(username=f'writer{i}', role='ST').pk for i in range(args.writers)]
+
+        def notify(user_id):
+            with transaction.atomic():
+                Notification.objects.create(recipient_id=user_id, message='Benchmark', course=course)
+                User.change_unread_notification_count([user_id], 1)
+
+        def flush_chat(user_id):
+            ChatMessage.objects.bulk_create([
+                ChatMessage(course=course, user_id=user_id, username='writer', message='Benchmark') for _ in range(CHAT_BATCH)
+            ])
+
+        latencies = []
+        errors = []
+        start = threading.Barrier(args.writers + 1)
+
+        def writer(user_id):
+            done, failed = [], 0
+            start.wait()
+            deadline = time.perf_counter() + args.duration
+            i = 0
+            while time.perf_counter() < deadline:
+                began = time.perf_counter_ns()
+                try:
+                    (notify if i % 2 == 0 else flush_chat)(user_id)
+                    done.append(time.perf_counter_ns() - began)
+                except DatabaseError:
+                    failed += 1
+                i += 1
+            connection.close()
+            latencies.extend(done)
+            errors.append(failed)
+
+        threads = [threading.Thread(target=writer, args=(user_id,)) for user_id in user_ids]
+        for thread in threads:
+            thread.start()
+        start.wait()
+        started = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
+
+    latencies.sort()
+    return {
+        'writes': len(latencies),
+        'writes_per_second': round(len(latencies) / elapsed),
+        'write_latency_p50_ms': round(percentile(latencies, 0.50) / 1e6, 3) if latencies else None,
+        'write_latency_p99_ms': round(percentile(latencies, 0.99) / 1e6, 3) if latencies else None,
+        'failed_writes': sum(errors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--profiles', nargs='+', default=['sqlite', 'sqlite-wal'], help='Database profiles to compare.')
+    parser.add_argument('--writers', type=int, default=8, help='Concurrent writer threads.')
+    parser.add_argument('--duration', type=float, default=5, help='Seconds to write for.')
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON.')
+    parser.add_argument('--run-profile', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_profile:
+        print(json.dumps(run_profile(args)))
+        return
+
+    results = {
+        'config': {'writers': args.writers, 'duration': args.duration},
+        'results': {},
+    }
+    for profile in args.profiles:
+        # Settings are read once per process, so each profile gets a process of its own.
+        child = subprocess.run(
+            [sys.executable, __file__, '--run-profile', '--writers', str(args.writers), '--duration', str(args.duration)],
+            env={**os.environ, 'DJANGO_DB_PROFILE': profile}, capture_output=True, text=True,
+        )
+        if child.returncode:
+            results['results'][profile] = {'error': child.stderr.strip().splitlines()[-1] if child.stderr.strip() else 'failed'}
+        else:
+            results['results'][profile] = json.loads(child.stdout.strip().splitlines()[-1])
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for name, value in results['config'].items():
+        print(f'{name:>22}: {value}')
+    for profile, result in results['results'].items():
+        print(f'\n{profile}')
+        for name, value in result.items():
+            print(f'{name:>22}: {value}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Benchmark for the UserPost list read path.
+
+Compares the per-field serializer (each post through UserPostSerializer) with the
+list fast path (UserPostListSerializer) at 5, 100 and 1,000 posts. Posts are built
+in memory, so only serialization is measured.
+
+Run from the project directory:
+    python benchmarks/user_post_serializer.py [--repeat N]
+"""
+
+import argparse
+import json
+import os
+import sys
+import timeit
+from datetime import timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'eLearning.settings')
+
+import django
+
+django.setup()
+
+from django.test import RequestFactory
+from django.utils import timezone
+from rest_framework import serializers
+from Main.models import User, UserPost
+from Main.serializers import UserPostSerializer, UserPostListSerializer
+
+SIZES = (5, 100, 1000)
+
+
+def make_posts(count):
+    authors = [
+        User(id=i, first_name=f'First{i}', last_name=f'Last{i}', role='TE' if i % 5 == 0 else 'ST', photo=f'images/user{i}.jpg')
+        for i in range(1, 51)
+    ]
+    # Posts are a few minutes apart, as in a busy feed.
+    now = timezone.now()
+    return [
+        UserPost(id=i, user=authors[i % len(authors)], content=f'Status update {i}', created_at=now - timedelta(seconds=97 * i))
+        for i in range(count)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help='Timing runs per measurement; the best is kept.')
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON.')
+    args = parser.parse_args()
+
+    request = RequestFactory().get('/api/latest_user_posts/', HTTP_HOST='localhost')
+    context = {'request': request}
+    results = []
+    for size in SIZES:
+        posts = make_posts(size)
+        per_field = serializers.ListSerializer(posts, child=UserPostSerializer(), context=context)
+        fast_path = UserPostListSerializer(posts, child=UserPostSerializer(), context=context)
+        assert per_field.to_representation(posts) == fast_path.to_representation(posts)
+
+        number = max(1, 2000 // size)
+        row = {'rows': size}
+        for name, serializer in (('per_field', per_field), ('fast_path', fast_path)):
+            best = min(timeit.repeat(lambda: serializer.to_representation(posts), number=number, repeat=args.repeat))
+            row[f'{name}_rows_per_second'] = round(size * number / best)
+        row['speedup'] = round(row['fast_path_rows_per_second'] / row['per_field_rows_per_second'], 2)
+        results.append(row)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'rows':>6} {'per-field rows/s':>18} {'fast path rows/s':>18} {'speedup':>8}")
+    for row in results:
+        print(f"{row['rows']:>6} {row['per_field_rows_per_second']:>18,} {row['fast_path_rows_per_second']:>18,} {row['speedup']:>7}x")
+
+
+if __name__ == '__main__':
+    main()
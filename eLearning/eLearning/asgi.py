@@ -3,14 +3,15 @@ from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
 import eLearning.routing
+from Main.transports import TransportBufferMiddleware
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Main.settings')
 
 application = ProtocolTypeRouter({
   "http": get_asgi_application(),
-  "websocket": AuthMiddlewareStack(
+  "websocket": TransportBufferMiddleware(AuthMiddlewareStack(
         URLRouter(
             eLearning.routing.websocket_urlpatterns
         )
-    ),
+    )),
 })
\ No newline at end of file
@@ -0,0 +1,23 @@
+"""
+Celery config for eLearning project.
+
+Defines the Celery application used to run background tasks. Workers are
+started with ``celery -A eLearning worker``.
+
+For more information on this file, see
+https://docs.celeryq.dev/en/stable/django/first-steps-with-django.html
+"""
+
+import os
+
+from celery import Celery
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'eLearning.settings')
+
+app = Celery('eLearning')
+
+# Read all CELERY_* options from the Django settings.
+app.config_from_object('django.conf:settings', namespace='CELERY')
+
+# Discover tasks.py modules in the installed apps.
+app.autodiscover_tasks()
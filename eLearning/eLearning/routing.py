@@ -2,5 +2,7 @@ from django.urls import re_path, path
 from Main.consumers import *
 
 websocket_urlpatterns = [
-    re_path(r'ws/chat/(?P<course_id>\w+)/$', ChatConsumer.as_asgi()),
+    re_path(r'ws/chat/(?P<course_id>\d+)/$', ChatConsumer.as_asgi()),
+    re_path(r'ws/notifications/$', NotificationConsumer.as_asgi()),
+    re_path(r'ws/feed/$', UserPostFeedConsumer.as_asgi()),
 ]
\ No newline at end of file
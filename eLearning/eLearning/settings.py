@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/3.2/ref/settings/
 
 from pathlib import Path
 import os
+from django.core.exceptions import ImproperlyConfigured
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -54,6 +55,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'Main.middleware.ReplicaRoutingMiddleware',
 ]
 
 AUTH_USER_MODEL = 'Main.User'
@@ -82,13 +84,73 @@ ASGI_APPLICATION = 'eLearning.asgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
-
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# Chosen with DJANGO_DB_PROFILE:
+# - 'sqlite' (default): the bundled db.sqlite3, for development.
+# - 'sqlite-wal': SQLite tuned for a single-node deployment. In WAL mode readers no longer block the writer (or
+#   each other), writers wait up to DJANGO_DB_BUSY_TIMEOUT ms for the write lock instead of failing at once, and
+#   commits skip the fsync that WAL makes unnecessary for consistency (synchronous=NORMAL). The file is read
+#   through mmap up to DJANGO_DB_MMAP_SIZE bytes. DJANGO_DB_NAME sets the file.
+# - 'postgres': PostgreSQL through psycopg 3, configured by DJANGO_DB_NAME, DJANGO_DB_USER, DJANGO_DB_PASSWORD,
+#   DJANGO_DB_HOST and DJANGO_DB_PORT. Set DJANGO_DB_PGBOUNCER=1 when connecting through PgBouncer in transaction
+#   pooling mode, where a server-side cursor could outlive the transaction it was opened in.
+# Except in development, each worker thread keeps its connection open for DJANGO_DB_CONN_MAX_AGE seconds and
+# checks it is still usable before reusing it, so requests do not pay for connecting.
+
+DB_PROFILE = os.environ.get('DJANGO_DB_PROFILE', 'sqlite')
+# PRAGMAs run on every new SQLite connection.
+SQLITE_PRAGMAS = {}
+
+if DB_PROFILE == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DJANGO_DB_NAME', 'elearning'),
+            'USER': os.environ.get('DJANGO_DB_USER', ''),
+            'PASSWORD': os.environ.get('DJANGO_DB_PASSWORD', ''),
+            'HOST': os.environ.get('DJANGO_DB_HOST', ''),
+            'PORT': os.environ.get('DJANGO_DB_PORT', ''),
+            'DISABLE_SERVER_SIDE_CURSORS': os.environ.get('DJANGO_DB_PGBOUNCER') == '1',
+        }
     }
-}
+elif DB_PROFILE in ('sqlite', 'sqlite-wal'):
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DJANGO_DB_NAME', BASE_DIR / 'db.sqlite3'),
+        }
+    }
+    if DB_PROFILE == 'sqlite-wal':
+        SQLITE_PRAGMAS = {
+            'journal_mode': 'WAL',
+            'synchronous': 'NORMAL',
+            'busy_timeout': int(os.environ.get('DJANGO_DB_BUSY_TIMEOUT', 5000)),
+            'mmap_size': int(os.environ.get('DJANGO_DB_MMAP_SIZE', 256 * 1024 * 1024)),
+        }
+else:
+    raise ImproperlyConfigured(f"Unknown DJANGO_DB_PROFILE {DB_PROFILE!r}; use 'sqlite', 'sqlite-wal' or 'postgres'.")
+
+if DB_PROFILE != 'sqlite':
+    DATABASES['default']['CONN_MAX_AGE'] = int(os.environ.get('DJANGO_DB_CONN_MAX_AGE', 600))
+    DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+
+# Read replicas
+# DJANGO_DB_REPLICAS lists read replicas of the primary database, comma separated: database files for the SQLite
+# profiles (e.g. a copy of the primary, to try routing locally), or host[:port] for postgres. Requests read from a
+# replica and write to the primary. A client that wrote reads from the primary for DJANGO_DB_REPLICA_PIN_SECONDS
+# afterwards, which should exceed the replication lag.
+DATABASE_REPLICAS = []
+for number, replica in enumerate(filter(None, os.environ.get('DJANGO_DB_REPLICAS', '').split(',')), 1):
+    alias = f'replica{number}'
+    DATABASES[alias] = {**DATABASES['default'], 'TEST': {'MIRROR': 'default'}}
+    if DB_PROFILE == 'postgres':
+        host, _, port = replica.strip().partition(':')
+        DATABASES[alias].update(HOST=host, PORT=port or DATABASES['default']['PORT'])
+    else:
+        DATABASES[alias]['NAME'] = replica.strip()
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['Main.routers.PrimaryReplicaRouter']
+REPLICA_PIN_SECONDS = int(os.environ.get('DJANGO_DB_REPLICA_PIN_SECONDS', 10))
 
 
 # Password validation
@@ -131,6 +193,48 @@ STATIC_URL = '/static/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'images')
 MEDIA_URL = '/images/'
 
+# Chunked uploads of course files
+# Files are sent in chunks of COURSE_UPLOAD_CHUNK_SIZE bytes, up to COURSE_UPLOAD_MAX_SIZE in total. Chunks are
+# written to COURSE_UPLOAD_PARTIAL_DIR, outside MEDIA_ROOT so unfinished files are never served, and should be on
+# the same filesystem so finished files are moved rather than copied. Unfinished uploads expire after
+# COURSE_UPLOAD_EXPIRY_HOURS.
+COURSE_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+COURSE_UPLOAD_MAX_SIZE = 4 * 1024 * 1024 * 1024
+COURSE_UPLOAD_PARTIAL_DIR = os.path.join(BASE_DIR, 'partial_uploads')
+COURSE_UPLOAD_EXPIRY_HOURS = 24
+# Files uploaded through the API within COURSE_FILE_ANNOUNCE_DELAY seconds of the first one are announced to the
+# course's students in a single notification, sent once the delay has passed.
+COURSE_FILE_ANNOUNCE_DELAY = 60
+
+# Course material imports
+# Teachers can upload a ZIP archive of course files, kept in COURSE_IMPORT_DIR (outside MEDIA_ROOT) until a worker
+# extracts it. Archives holding more than COURSE_IMPORT_MAX_FILES files or COURSE_IMPORT_MAX_SIZE extracted bytes
+# are refused, as are files compressed more than COURSE_IMPORT_MAX_RATIO times, which only zip bombs are.
+COURSE_IMPORT_DIR = os.path.join(BASE_DIR, 'course_imports')
+COURSE_IMPORT_MAX_FILES = 1000
+COURSE_IMPORT_MAX_SIZE = COURSE_UPLOAD_MAX_SIZE
+COURSE_IMPORT_MAX_RATIO = 200
+
+# Course file downloads
+# By default Django sends course files, through the server's wsgi.file_wrapper (sendfile() on servers such as
+# gunicorn). Set COURSE_FILE_SERVE_MODE to 'x-accel-redirect' to let nginx send them from an internal location
+# mapping COURSE_FILE_ACCEL_PREFIX to MEDIA_ROOT, or to 'x-sendfile' for Apache's mod_xsendfile or lighttpd.
+# Course files live in MEDIA_ROOT/course_files/ and must never be served from MEDIA_URL: the proxy should deny that
+# directory in its public media location and only reach it through the internal one (nginx's 'internal;'), so
+# every download goes through the access check.
+COURSE_FILE_SERVE_MODE = None
+COURSE_FILE_ACCEL_PREFIX = '/protected/'
+
+# Profile photo variants
+# Fixed-size JPEG versions of profile photos, created on upload (or on first use for older photos) next to the
+# original. Sizes are twice the displayed size, for high-density screens; cropped variants fill their size.
+PHOTO_VARIANTS = {
+    'nav': {'size': (60, 60), 'crop': True},
+    'feed': {'size': (60, 60), 'crop': True},
+    'profile': {'size': (400, 400), 'crop': False},
+}
+PHOTO_VARIANT_QUALITY = 82
+
 # Default primary key field type 
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
@@ -138,6 +242,33 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 LOGIN_REDIRECT_URL = 'profile'
 
+# API pagination
+# Pages of the API viewsets hold API_PAGE_SIZE rows unless the client asks for up to API_MAX_PAGE_SIZE with ?page_size=.
+API_PAGE_SIZE = 20
+API_MAX_PAGE_SIZE = 100
+
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+# Version stamps and cached data must be shared by every worker process, so deployments running more than one
+# process set DJANGO_CACHE_URL to a Redis instance (e.g. redis://127.0.0.1:6379/1). Local memory is used otherwise.
+
+if os.environ.get('DJANGO_CACHE_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['DJANGO_CACHE_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# How long (in seconds) a version of the course catalog stays cached. Changes invalidate it immediately.
+COURSE_CATALOG_CACHE_TIMEOUT = 60 * 60 * 24
+
 CHANNEL_LAYERS = {
     'default': {
         'BACKEND': 'channels_redis.core.RedisChannelLayer',
@@ -146,3 +277,49 @@ CHANNEL_LAYERS = {
         },
     },
 }
+
+# Celery
+# https://docs.celeryq.dev/en/stable/django/first-steps-with-django.html
+
+CELERY_BROKER_URL = 'redis://127.0.0.1:6379/0'
+CELERY_TASK_IGNORE_RESULT = True
+
+# Number of notifications written per bulk INSERT when fanning out to a course's students.
+NOTIFICATION_BATCH_SIZE = 500
+
+# Live search
+# Maximum number of users returned per query, and how long (in seconds) results are cached.
+LIVE_SEARCH_LIMIT = 10
+LIVE_SEARCH_CACHE_TIMEOUT = 30
+
+# Number of status updates per page of the profile feed.
+FEED_PAGE_SIZE = 10
+
+# Number of feedback entries per page of the course detail page.
+FEEDBACK_PAGE_SIZE = 10
+
+# Chat history
+# Messages are saved in batches: a batch is written once it holds CHAT_FLUSH_BATCH_SIZE messages,
+# or CHAT_FLUSH_INTERVAL_MS milliseconds after its first message, whichever comes first.
+# Clients joining a room are sent its last CHAT_HISTORY_SIZE messages.
+CHAT_FLUSH_BATCH_SIZE = 100
+CHAT_FLUSH_INTERVAL_MS = 500
+CHAT_HISTORY_SIZE = 50
+
+# Busy chat rooms send their messages in batches, gathered for CHAT_COALESCE_WINDOW_MS milliseconds.
+# A room is busy when a server process holds at least CHAT_COALESCE_MIN_MEMBERS of its members, or
+# receives at least CHAT_COALESCE_MIN_RATE of its messages in one second. None disables either trigger.
+CHAT_COALESCE_MIN_MEMBERS = None
+CHAT_COALESCE_MIN_RATE = None
+CHAT_COALESCE_WINDOW_MS = 20
+
+# Per-connection chat limits. Each connection may send CHAT_RATE_LIMIT messages per second, with bursts of up
+# to CHAT_RATE_BURST, in frames of at most CHAT_MAX_MESSAGE_LENGTH characters. Clients that fall more than
+# CHAT_OUTBOUND_BUFFER_SIZE bytes behind (counting what the server has buffered for their socket, where it can be
+# measured), or whose frames take longer than CHAT_SEND_TIMEOUT seconds to send, are disconnected, and get the
+# recent history when they reconnect.
+CHAT_RATE_LIMIT = 1
+CHAT_RATE_BURST = 5
+CHAT_MAX_MESSAGE_LENGTH = 2000
+CHAT_OUTBOUND_BUFFER_SIZE = 1024 * 1024
+CHAT_SEND_TIMEOUT = 10
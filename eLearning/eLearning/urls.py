@@ -17,8 +17,10 @@ from django.contrib import admin
 from django.urls import include, path
 from django.conf import settings
 from django.conf.urls.static import static
+from Main.downloads import serve_public_media
 
+# In DEBUG, media is served by Django, leaving out course files, which need an access check.
 urlpatterns = [
     path('', include('Main.urls')),
     path('admin/', admin.site.urls),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+] + static(settings.MEDIA_URL, view=serve_public_media, document_root=settings.MEDIA_ROOT)